@@ -1,13 +1,20 @@
+import os
+import time
+import uuid
 import streamlit as st
 import pandas as pd
-import random
-import eval7
+import cards
 from simulate_shift_flop import run_shift_flop  # ホールカード貢献付きバージョン
-from simulate_shift_turn import run_shift_turn
-from simulate_shift_river import simulate_shift_river_multiple_turns
 from hand_utils import all_starting_hands, hand_str_to_cards
-from preflop_winrates_random import get_static_preflop_winrate
-from generate_preflop_winrates import calculate_preflop_winrates_streamlit
+from preflop_winrates_random import get_static_preflop_winrate, preflop_table_path
+from generate_preflop_winrates import calculate_preflop_winrates_streamlit, calculate_preflop_table, save_preflop_table
+from auto_pipeline import run_auto_pipeline
+import instrument
+import iso_cache
+import result_cache
+import result_writer
+from result_writer import iter_upper_rows, iter_result_rows
+import jobs
 
 # --- セッションステートの初期化 ---
 if "auto_flop" not in st.session_state:
@@ -16,6 +23,39 @@ if "auto_turn" not in st.session_state:
     st.session_state["auto_turn"] = {}
 if "auto_river" not in st.session_state:
     st.session_state["auto_river"] = {}
+if "session_id" not in st.session_state:
+    st.session_state["session_id"] = uuid.uuid4().hex[:12]
+
+
+@st.cache_resource
+def get_job_manager():
+    """全セッション共通のジョブ管理（Streamlit サーバープロセスに1つ）"""
+    return jobs.JobManager(run_auto_pipeline)
+
+
+# 結果ファイル（Parquet が本体、CSV はそこから変換した書き出し）。
+# 別セッションの保存で上書きされないよう、ファイル名にセッション ID を付ける
+def session_result_paths(name):
+    """このセッションの (Parquet, CSV) のパス"""
+    stem = os.path.join("results", f"{name}_{st.session_state['session_id']}")
+    return stem + ".parquet", stem + ".csv"
+
+
+result_path, result_csv_path = session_result_paths("shift_results")
+upper_result_path, upper_result_csv_path = session_result_paths("shift_results_upper")
+DIAGNOSTICS_PATH = os.path.join("results", "diagnostics.jsonl")
+
+
+def download_result_files(path, csv_path, file_stem, label_suffix=""):
+    """保存済みの Parquet / CSV をファイルから渡すダウンロードボタン"""
+    col_csv, col_parquet = st.columns([1, 1])
+    with col_csv, open(csv_path, "rb") as f:
+        st.download_button(label=f"📥 CSVをダウンロード{label_suffix}", data=f,
+                           file_name=f"{file_stem}.csv", mime="text/csv")
+    with col_parquet, open(path, "rb") as f:
+        st.download_button(label=f"📥 Parquetをダウンロード{label_suffix}", data=f,
+                           file_name=f"{file_stem}.parquet", mime="application/octet-stream")
+
 
 st.set_page_config(page_title="統合 勝率変動分析", layout="centered")
 st.title("統合 勝率変動分析アプリ（複数ハンド対応・CSV保存付き）")
@@ -27,19 +67,25 @@ mode = st.radio("モードを選択", ["プリフロップ勝率", "自動生成
 if mode == "プリフロップ勝率":
     st.header("プリフロップ勝率生成（ランダムハンド vs ランダムハンド）")
 
-    trials_pf = st.selectbox("試行回数", [1000, 2000, 3000, 5000, 10000, 50000, 100000])
+    boards_pf = st.selectbox("相手ハンド1組あたりのボード数（相手1225通りは全列挙）", [20, 50, 100, 200, 500], index=2)
+    workers_pf = st.number_input("並列プロセス数", min_value=1, max_value=64, value=os.cpu_count() or 1)
+    opponents_pf = st.number_input("相手人数（2人以上は 1225×ボード数 回の標本化）", min_value=1, max_value=8,
+                                   value=1, step=1)
 
     if st.button("プリフロップ勝率を生成して保存"):
-        deck_full = [r + s for r in '23456789TJQKA' for s in 'shdc']
-
-        preflop_results = []
-        for hand in generate_169_hands():
-            win_rate = simulate_preflop_vs_random(hand, trials_pf)
-            preflop_results.append({"hand": hand, "win_rate": win_rate})
-
-        df_pf = pd.DataFrame(preflop_results)
-        df_pf.to_csv("preflop_winrates_random.csv", index=False, encoding="utf-8-sig")
-        st.success("プリフロップ勝率を preflop_winrates_random.csv に保存しました！")
+        pf_progress = st.progress(0)
+        pf_status = st.empty()
+
+        def _update(i, hand, winrate):
+            pf_progress.progress(i / 169)
+            pf_status.text(f"[{i}/169] {hand}: {winrate}%")
+
+        df_pf = calculate_preflop_table(boards_per_combo=boards_pf, workers=int(workers_pf), update_func=_update,
+                                        opponents=int(opponents_pf))
+        table_path = save_preflop_table(df_pf, preflop_table_path(int(opponents_pf)), boards_per_combo=boards_pf)
+        csv_path = os.path.splitext(os.path.basename(table_path))[0] + ".csv"
+        df_pf.to_csv(csv_path, index=False, encoding="utf-8-sig")
+        st.success(f"プリフロップ勝率を {table_path} と {csv_path} に保存しました！")
         st.dataframe(df_pf)
 
 
@@ -96,148 +142,126 @@ elif mode == "自動生成モード":
 
     # === 自動生成設定 ===
     st.subheader("自動生成パラメータ設定")
-    trials = st.selectbox("試行回数", [1000, 2000, 3000, 5000, 10000, 50000, 100000])
+    trials = st.selectbox("試行回数", [1000, 2000, 3000, 5000, 10000, 50000, 100000],
+                          help="モンテカルロの標本（勝ち・引き分け・試行数）は局面ごとに結果キャッシュへ保存されます。"
+                               "前回より多い試行回数で実行すると、足りない分だけ追加で引きます")
     flop_count = st.selectbox("フロップ枚数", [5, 10, 20, 30])
+    stratified = st.checkbox("フロップをタイプ別に均等抽出（層化抽出）", value=False,
+                             help="monotone / paired / high_rainbow などのフロップタイプから同じ数ずつ選びます")
     turn_count = st.selectbox("ターンカード枚数", [5, 10, 20, 30])
+    engine = st.selectbox("評価エンジン", ["runout_tree", "numpy", "eval7"],
+                          help="runout_tree: 全ランアウトを1回だけ評価し3ストリート共通で使用 / "
+                               "numpy: ベクトル化一括評価 / eval7: 1ハンドずつ評価")
+    exact_turn = st.checkbox("ShiftTurn を厳密列挙で計算（試行回数を使わない）", value=True,
+                             disabled=(engine == "runout_tree"))
+    workers = st.number_input("並列プロセス数（1 = 並列化しない）", min_value=1, max_value=64,
+                              value=os.cpu_count() or 1)
+    seed = st.number_input("乱数シード", min_value=0, value=0, step=1)
+    opponents = st.number_input("相手人数（ランダムハンド）", min_value=1, max_value=8, value=1, step=1,
+                                help="2人以上は各ストリートを多人数ポットの標本化で計算します（ツリー・厳密列挙は使いません）")
+    crn = st.checkbox("共通乱数（全ターン・リバー・ハンドで同じ標本を使う）", value=False,
+                      help="モンテカルロで計算するとき、同じフロップの兄弟局面で相手ハンド・ランアウトの標本を共通にし、"
+                           "シフトの順位を少ない試行回数で安定させます（厳密列挙・ツリーには影響しません）")
+    importance_on = st.checkbox("希少な役・特徴のフロップを重点抽出（重要度サンプリング）", value=False,
+                                help="newmade_quads_hc2 など一様抽出ではほとんど出ないカテゴリの出るフロップを多めに選び、"
+                                     "結果に重み（Weight 列）を付けます。集計ページの「重み付き集計」で偏りを補正した平均が出ます"
+                                     "（層化抽出より優先。初回はハンドごとに準備で約 10 秒かかり、結果はキャッシュに保存します）")
+    importance_target = st.number_input("カテゴリごとの目標行数", min_value=1, max_value=1000, value=30, step=5,
+                                        disabled=not importance_on)
+    tolerance = st.number_input(
+        "目標精度: 勝率の標準誤差（%ポイント, 0 = 試行回数を固定）", min_value=0.0, max_value=10.0,
+        value=0.0, step=0.1,
+        help="0 より大きいと、標準誤差がこの値を下回った時点でモンテカルロを打ち切ります（試行回数は上限）")
+    # 計測はジョブ（と CSV 作成）の間だけ有効にする（instrument.session）。ウィジェットの状態で
+    # プロセス全体の差し替えを切り替えると、別セッションで計測中のジョブまで止まってしまう
+    profile = st.checkbox("計測（ステージごとの時間・評価回数）", value=False, key="profile",
+                          help="下の「診断」に集計し、進捗に評価/秒を表示します")
+    profile_memory = st.checkbox("ピークメモリも計測（tracemalloc・遅くなります）", value=False,
+                                 key="profile_memory", disabled=not profile)
+
+    # === 実行（バックグラウンドジョブ） ===
+    # 計算は JobManager のスレッドで走るので、ウィジェット操作や再読み込みで再実行されても続く
+    job_params = dict(
+        hands=tuple(selected_hands), flop_count=flop_count, turn_count=turn_count, trials=trials,
+        engine=engine, exact_turn=exact_turn, workers=int(workers), seed=int(seed),
+        tolerance=(tolerance if tolerance > 0 else None), opponents=int(opponents), stratified=stratified,
+        profile=profile, profile_memory=(profile and profile_memory), crn=crn,
+        importance_target=(int(importance_target) if importance_on else None),
+    )
+    job_manager = get_job_manager()
 
-    # === 実行ボタン ===
     if st.button("ShiftFlop → ShiftTurn → ShiftRiver を一括実行"):
-        # --- 念のため再初期化 ---
-        for key in ["auto_flop", "auto_turn", "auto_river"]:
-            if key not in st.session_state:
-                st.session_state[key] = {}
+        st.session_state["auto_job"] = job_manager.submit(job_params).key
+    # 同じ条件で試行回数の上限だけ上げて再実行（保存済みの標本に足す。目標精度を指定していれば
+    # 信頼区間がまだ広い局面だけが追加される）
+    if st.button("精度を上げて追加計算（試行回数 ×5）",
+                 help="目標精度が 0 より大きいときは、標準誤差が目標に届いていない局面だけ標本を追加します"):
+        st.session_state["auto_job"] = job_manager.submit(dict(job_params, trials=trials * 5)).key
+
+    # 同じセッションのジョブ → 無ければ（ブラウザ再読み込み後など）最新のジョブに再接続
+    job = job_manager.get(st.session_state.get("auto_job", "")) or job_manager.latest()
+
+    if job is not None:
+        st.session_state["auto_job"] = job.key
+        st.progress(job.fraction)
+        hands_label = ", ".join(job.params["hands"])
+        if job.running:
+            st.text(f"⏳ {hands_label} [{job.done}/{job.total}] {job.message}")
+            if st.button("取り消し"):
+                job_manager.cancel(job.key)
+        elif job.status == "done":
+            st.text(f"✅ {hands_label} の計算完了（{job.finished - job.started:.1f} 秒）")
+        elif job.status == "cancelled":
+            st.warning(f"{hands_label} の計算を取り消しました（途中結果を表示しています）")
+        else:
+            st.error(f"計算エラー:\n{job.error}")
 
-        deck_full = [r + s for r in '23456789TJQKA' for s in 'hdcs']
-        batch_flop, batch_turn, batch_river = {}, {}, {}
+        snapshot = job.snapshot()
+        if snapshot is not None:
+            st.session_state["auto_flop"], st.session_state["auto_turn"], st.session_state["auto_river"] = snapshot
+            st.session_state["auto_opponents"] = job.params.get("opponents", 1)
 
-        for hand in selected_hands:
-            with st.spinner(f"ハンド {hand} を処理中..."):
-                # --- フロップ生成 ---
-                flops_str = []
-                while len(flops_str) < flop_count:
-                    sample = random.sample(deck_full, 3)
-                    if sample not in flops_str:
-                        flops_str.append(sample)
-
-                flop_results, turn_results, river_results = [], [], []
-                static_wr_pf = get_static_preflop_winrate(hand)
-
-                # --- 進捗バー ---
-                flop_progress = st.progress(0)
-                flop_status = st.empty()
-                total_flops = len(flops_str)
-
-                for idx, flop_cards_str in enumerate(flops_str):
-                    flop_status.text(f"[{idx+1}/{total_flops}] フロップ計算中: {' '.join(flop_cards_str)}")
-                    flop_progress.progress((idx + 1) / total_flops)
-
-                    flop_cards = [eval7.Card(c) for c in flop_cards_str]
-                    flop_wr, shift_feats = run_shift_flop(hand, flop_cards, trials)
-
-                                        # --- ターン・リバー処理 ---
-                    turn_all_items, turn_top10, turn_bottom10 = run_shift_turn(
-                        hand, flop_cards, flop_wr, trials
-                    )
-
-                    # ターンカード一覧を抽出
-                    if isinstance(turn_all_items, list) and len(turn_all_items) > 0:
-                        all_turn_cards = [t["turn_card"] for t in turn_all_items if "turn_card" in t]
-                    else:
-                        all_turn_cards = []
-
-                    # 指定枚数だけサンプリング（ターン数より少なければ全使用）
-                    if len(all_turn_cards) > 0:
-                        sampled_turn_cards = random.sample(
-                            all_turn_cards, min(turn_count, len(all_turn_cards))
-                        )
-                    else:
-                        sampled_turn_cards = []
-
-                    # --- ターン結果を格納 ---
-                    turn_results.append(turn_all_items)
-
-                    # --- フロップごとに、ターン×リバー構造で保持 ---
-                    river_result_per_flop = []  # 各ターンごとのリバー結果リスト
-
-                    # 各ターンに対してリバー全探索を実行
-                    for t_card in sampled_turn_cards:
-                        turn_wr = next(
-                            (t["winrate"] for t in turn_all_items if t.get("turn_card") == t_card),
-                            flop_wr
-                        )
-
-                        # 各ターンごとにリバー全探索
-                        river_items, _, _ = simulate_shift_river_multiple_turns(
-                            hand,
-                            flop_cards + [eval7.Card(t_card)],
-                            turn_wr,
-                            turn_count=turn_count,   # UIで指定したターン数をそのまま反映
-                            trials_per_river=trials
-                        )
-
-                        # ターンカードとリバー結果を1セットとして保存
-                        river_result_per_flop.append({
-                            "turn_card": t_card,
-                            "all": river_items
-                        })
-
-                    # --- フロップ単位でまとめて保存 ---
-                    river_results.append(river_result_per_flop)
-                    flop_results.append((flop_cards_str, flop_wr, shift_feats))
-
-                # --- 各ハンド処理完了 ---
-                flop_status.text(f"✅ ハンド {hand} のフロップ計算完了")
-                flop_progress.progress(1.0)
-
-                # --- セッションステートに格納 ---
-                batch_flop[hand] = flop_results
-                batch_turn[hand] = turn_results
-                batch_river[hand] = river_results
-                    
-        st.session_state["auto_flop"] = batch_flop
-        st.session_state["auto_turn"] = batch_turn
-        st.session_state["auto_river"] = batch_river
-        # --- CSV出力 ---
+        st.caption(f"スート同型キャッシュ（このプロセス分）: 勝率 {iso_cache.equity_memo.stats()} / ツリー {iso_cache.tree_memo.stats()}")
+        st.caption(f"結果キャッシュ（{result_cache.shift_cache.path}）: {result_cache.shift_cache.stats()}")
+
+        # --- CSV出力（計算済みのフロップ分のみ） ---
         col1, col2 = st.columns([1, 1])
         with col1:
             if st.button("CSV保存（上部）"):
-                csv_rows = []
-                for hand_str, flop_list in st.session_state.get("auto_flop", {}).items():
-                    static_wr_pf = round(get_static_preflop_winrate(hand_str), 2)
-                    csv_rows.append({
-                        "Stage": "HandInfo", "Flop": "", "Turn": "", "Detail": "",
-                        "Shift": "", "Winrate": static_wr_pf, "Features": "",
-                        "Role": "", "Hand": hand_str
-                    })
-
-                    for i, (flop_cards_str, static_wr_flop, shift_feats) in enumerate(flop_list):
-                        flop_str = ' '.join(flop_cards_str)
-                        csv_rows.append({
-                            "Stage": f"=== Flop {i+1}: {flop_str} ===", "Flop": "", "Turn": "",
-                            "Detail": "", "Shift": "", "Winrate": "", "Features": "",
-                            "Role": "", "Hand": hand_str
-                        })
-
-                        for f, delta in shift_feats.items():
-                            csv_rows.append({
-                                "Stage": "ShiftFlop", "Flop": flop_str, "Turn": "",
-                                "Detail": f, "Shift": round(delta, 2),
-                                "Winrate": round(static_wr_pf + delta, 2),
-                                "Features": "", "Role": "", "Hand": hand_str
-                            })
-
-                df = pd.DataFrame(csv_rows)
-                st.session_state["csv_data"] = df.to_csv(index=False)
-                st.success("CSVをセッションに保存しました")
+                with instrument.session(profile, profile and profile_memory), instrument.stage("csv_build"):
+                    with result_writer.ShiftResultWriter(upper_result_path) as writer:
+                        writer.write_rows(iter_upper_rows(st.session_state.get("auto_flop", {}),
+                                                          st.session_state.get("auto_opponents", 1)))
+                    result_writer.export_csv(upper_result_path, upper_result_csv_path)
+                st.session_state["upper_result_path"] = upper_result_path
+                st.success(f"{writer.rows_written} 行を {upper_result_path} に保存しました")
 
         with col2:
-            if "csv_data" in st.session_state:
-                st.download_button(
-                    label="📥 ダウンロード（上部）",
-                    data=st.session_state["csv_data"],
-                    file_name="shift_results.csv",
-                    mime="text/csv"
-                )
+            if st.session_state.get("upper_result_path") == upper_result_path and os.path.exists(upper_result_path):
+                download_result_files(upper_result_path, upper_result_csv_path, "shift_results", "（上部）")
+
+        # --- 診断（計測結果） ---
+        with st.expander("診断（ステージごとの計測）", expanded=job.params.get("profile", False)):
+            diag_rows = instrument.recorder.table()
+            if diag_rows:
+                st.caption(f"評価回数 合計 {instrument.recorder.evals:,}（時間・評価回数は入れ子のステージを含む）")
+                st.dataframe(pd.DataFrame(diag_rows), use_container_width=True)
+            else:
+                st.info("計測結果はまだありません（「計測」を有効にして実行してください）")
+            col_export, col_reset = st.columns([1, 1])
+            with col_export:
+                if st.button("JSONL に書き出し", disabled=not diag_rows):
+                    instrument.export_jsonl(DIAGNOSTICS_PATH, job=job.key, hands=",".join(job.params["hands"]),
+                                            engine=job.params["engine"], workers=job.params["workers"])
+                    st.success(f"{DIAGNOSTICS_PATH} に追記しました")
+            with col_reset:
+                if st.button("計測結果をリセット"):
+                    instrument.recorder.reset()
+
+        # 実行中は定期的に再描画して途中結果を更新する
+        if job.running:
+            time.sleep(1.0)
+            st.rerun()
 
 # --- 手動選択モード ---
 elif mode == "手動選択モード":
@@ -251,7 +275,7 @@ elif mode == "手動選択モード":
         if len(flop_cards_str) != 3:
             st.error("フロップは3枚指定してください（例: Ah Ks Td）")
         else:
-            flop_cards = [eval7.Card(c) for c in flop_cards_str]
+            flop_cards = cards.to_cards(flop_cards_str)
             flop_wr, shift_feats = run_shift_flop(selected_hands[0], flop_cards, trials)
             st.session_state["manual"] = {
                 "flop_cards_str": flop_cards_str,
@@ -264,322 +288,30 @@ elif mode == "手動選択モード":
         st.error(f"入力エラー: {e}")
 
 if st.button("CSV保存"):
-    import ast
-    csv_rows = []
-
-    auto_flop = st.session_state.get("auto_flop", {})
-    auto_turn = st.session_state.get("auto_turn", {})
-    auto_river = st.session_state.get("auto_river", {})
-
-    for hand_str, flop_list in auto_flop.items():
-        static_wr_pf = round(get_static_preflop_winrate(hand_str), 2)
-
-        # Hand info row
-        csv_rows.append({
-            "Stage": "HandInfo",
-            "Flop": "",
-            "Turn": "",
-            "Detail": "",
-            "Shift": "",
-            "Winrate": static_wr_pf,
-            "Features": "",
-            "Role": "",
-            "Hand": hand_str
-        })
-
-        # ==========================================================
-        # Flop loop
-        # ==========================================================
-        for i, flop_entry in enumerate(flop_list):
-            try:
-                flop_cards_str, static_wr_flop, shift_feats = flop_entry
-            except Exception:
-                continue
-
-            flop_str = ' '.join(flop_cards_str)
-
-            # Flop header row
-            csv_rows.append({
-                "Stage": f"=== Flop {i+1}: {flop_str} ===",
-                "Flop": "",
-                "Turn": "",
-                "Detail": "",
-                "Shift": "",
-                "Winrate": "",
-                "Features": "",
-                "Role": "",
-                "Hand": hand_str
-            })
-
-            # ==========================================================
-            # ShiftFlop（特徴は Detail 列）
-            # ==========================================================
-            if isinstance(shift_feats, dict) and shift_feats:
-                for f, delta in sorted(shift_feats.items(), key=lambda x: float(x[1])):
-                    d = float(delta)
-                    csv_rows.append({
-                        "Stage": "ShiftFlop",
-                        "Flop": flop_str,
-                        "Turn": "",
-                        "Detail": str(f),
-                        "Shift": round(d, 2),
-                        "Winrate": round(float(static_wr_pf) + d, 2),
-                        "Features": "",
-                        "Role": "",
-                        "Hand": hand_str
-                    })
-            else:
-                csv_rows.append({
-                    "Stage": "ShiftFlop",
-                    "Flop": flop_str,
-                    "Turn": "",
-                    "Detail": "―",
-                    "Shift": "",
-                    "Winrate": round(float(static_wr_flop), 2),
-                    "Features": "",
-                    "Role": "",
-                    "Hand": hand_str
-                })
-
-            # ==========================================================
-            # ShiftTurn
-            # ==========================================================
-            turn_wr_dict = {}   # { 'Tc': 96.05, ... }
-
-            if hand_str in auto_turn and i < len(auto_turn[hand_str]):
-                turn_items = auto_turn[hand_str][i] or []
-
-                for t in turn_items:
-                    if not isinstance(t, dict):
-                        continue
-
-                    tc = t.get("turn_card")
-                    wr = t.get("winrate")
-                    if tc is None or wr is None:
-                        continue
-
-                    turn_wr_dict[str(tc)] = float(wr)
-
-                    made = t.get("hand_rank", "―")
-                    if made == "high_card":
-                        made = "―"
-
-                    feats = [fx for fx in t.get("features", []) if str(fx).startswith("newmade_")]
-                    if not feats:
-                        feats = ["―"]
-
-                    try:
-                        shift_t = round(float(wr) - float(static_wr_flop), 2)
-                        wr_out = round(float(wr), 2)
-                    except Exception:
-                        shift_t, wr_out = "", wr
-
-                    csv_rows.append({
-                        "Stage": "ShiftTurn",
-                        "Flop": flop_str,
-                        "Turn": str(tc),
-                        "Detail": str(tc),
-                        "Shift": shift_t,
-                        "Winrate": wr_out,
-                        "Features": ", ".join(feats),
-                        "Role": made,
-                        "Hand": hand_str
-                    })
-
-            # ==========================================================
-            # ShiftRiver（ターン勝率基準）
-            # ==========================================================
-            if hand_str in auto_river and i < len(auto_river[hand_str]):
-                river_blocks = auto_river[hand_str][i] or []
-
-                for block in river_blocks:
-                    if not isinstance(block, dict):
-                        continue
-
-                    turn_card = str(block.get("turn_card", "―"))
-                    river_items = block.get("all", []) or []
-
-                    # ターン基準（無ければフロップ勝率でフォールバック）
-                    baseline_turn_wr = turn_wr_dict.get(turn_card, float(static_wr_flop))
-
-                    seen_rivers = set()
-                    for item in river_items:
-                        if not isinstance(item, dict):
-                            continue
-
-                        rc = item.get("river_card")
-                        if rc is None:
-                            continue
-                        rc = str(rc)
-
-                        if rc in seen_rivers:
-                            continue
-                        seen_rivers.add(rc)
-
-                        made = item.get("hand_rank", "―")
-                        if made == "high_card":
-                            made = "―"
-
-                        feats = [fx for fx in item.get("features", []) if str(fx).startswith("newmade_")]
-                        if not feats:
-                            feats = ["―"]
-
-                        wr = item.get("winrate")
-                        if wr is not None:
-                            try:
-                                wr_out = round(float(wr), 2)
-                                # ★ ShiftRiver は「リバー勝率 − ターン勝率」
-                                shift_r = round(float(wr) - float(baseline_turn_wr), 2)
-                            except Exception:
-                                wr_out, shift_r = wr, ""
-                        else:
-                            wr_out, shift_r = "―", ""
-
-                        csv_rows.append({
-                            "Stage": "ShiftRiver",
-                            "Flop": flop_str,
-                            "Turn": turn_card,
-                            "Detail": rc,
-                            "Shift": shift_r,
-                            "Winrate": wr_out,
-                            "Features": ", ".join(feats),
-                            "Role": made,
-                            "Hand": hand_str
-                        })
-
-    # 保存
-    df = pd.DataFrame(csv_rows)
-    st.session_state["csv_data"] = df.to_csv(index=False)
-    st.success("CSVをセッションに保存しました")
-
-# --- ダウンロードボタン ---
-if "csv_data" in st.session_state and st.session_state["csv_data"]:
-    st.download_button(
-        label="📥 CSVをダウンロード",
-        data=st.session_state["csv_data"],
-        file_name="shift_results.csv",
-        mime="text/csv"
-    )
+    # 行はファイルへ逐次書き出す（全行をメモリ・セッションに持たない）
+    profile = st.session_state.get("profile", False)
+    profile_memory = profile and st.session_state.get("profile_memory", False)
+    with instrument.session(profile, profile_memory), instrument.stage("csv_build"):
+        with result_writer.ShiftResultWriter(result_path) as writer:
+            writer.write_rows(iter_result_rows(
+                st.session_state.get("auto_flop", {}), st.session_state.get("auto_turn", {}),
+                st.session_state.get("auto_river", {}), st.session_state.get("auto_opponents", 1)))
+        result_writer.export_csv(result_path, result_csv_path)
+    st.session_state["result_path"] = result_path
+    st.success(f"{writer.rows_written} 行を {result_path} と {result_csv_path} に保存しました")
+
+# --- ダウンロードボタン（ファイルから読む） ---
+if st.session_state.get("result_path") == result_path and os.path.exists(result_path):
+    download_result_files(result_path, result_csv_path, "shift_results")
 else:
     st.warning("CSVがまだ生成されていません。Shift計算を先に実行してください。")
 # analyze_shift_features.py
 # ============================================
 # ============================================
 
-import re
-import pandas as pd
-import streamlit as st
-
-# ====== 定義 ======
-MADE_ROLES = {
-    "newmade_set", "newmade_straight", "newmade_flush", "newmade_full_house",
-    "newmade_two_pair", "newmade_pair", "newmade_quads", "newmade_straight_flush",
-}
-EXCLUDED_FEATURES = {"newmade_rainbow", "newmade_two_tone", "newmade_monotone"}
-ROLE_RE = re.compile(r'^(newmade_[a-z_]+?)(?:_hc([0-2]))?$')
-
-def make_buckets(start: int, end: int, step: int):
-    return [f"{v}%以上〜{v+step}%未満" for v in range(start, end, step)]
+from shift_analysis import (MADE_ROLES, analyze_roles_and_features, analyze_by_hc_groups, analyze_weighted,
+                            read_shift_files)
 
-BUCKETS = ["-100%未満"] + make_buckets(-100, 100, 10) + ["100%以上"]
-
-def get_bucket(v) -> str | None:
-    try:
-        x = float(v)
-    except Exception:
-        return None
-    if pd.isna(x): return None
-    if x < -100:  return "-100%未満"
-    if x >= 100:  return "100%以上"
-    lo = int(x // 10) * 10
-    return f"{lo}%以上〜{lo+10}%未満"
-
-def _split_items(cell) -> list[str]:
-    if cell is None or (isinstance(cell, float) and pd.isna(cell)):
-        return []
-    s = str(cell).strip()
-    if not s or s == "―":
-        return []
-    s = s.strip("[]")
-    return [x.strip() for x in s.split(",") if x.strip()]
-
-def collect_newmade_items(row) -> list[str]:
-    items = []
-    if "Features" in row: items += _split_items(row["Features"])
-    if "Detail"   in row: items += _split_items(row["Detail"])
-    return [it for it in items if str(it).startswith("newmade_")]
-
-# ====== 集計 ======
-def analyze_roles_and_features(df: pd.DataFrame):
-    role_rows, feat_rows = [], []
-    if "Shift" not in df.columns or "Winrate" not in df.columns:
-        return pd.DataFrame(), pd.DataFrame()
-
-    for _, row in df.iterrows():
-        bucket = get_bucket(row.get("Shift"))
-        if bucket is None:
-            continue
-        try:
-            shift = float(row.get("Shift"))
-            winrate = float(row.get("Winrate"))
-        except Exception:
-            continue
-
-        items = collect_newmade_items(row)
-        if not items:
-            continue
-
-        for item in items:
-            if item in EXCLUDED_FEATURES:
-                continue
-            m = ROLE_RE.match(item)
-            if not m:
-                continue
-            base, hc = m.group(1), m.group(2)
-
-            if base in MADE_ROLES:
-                if base == "newmade_pair" and hc == "2":
-                    continue
-                role_key = f"{base}_hc{hc}" if hc is not None else f"{base}_hcnone"
-                role_rows.append(
-                    {"role_key": role_key, "role_base": base, "hc": ("none" if hc is None else hc),
-                     "bucket": bucket, "shift": shift, "winrate": winrate}
-                )
-            else:
-                feat_rows.append(
-                    {"feature": base, "bucket": bucket, "shift": shift, "winrate": winrate}
-                )
-
-    df_role = pd.DataFrame(role_rows)
-    df_feat = pd.DataFrame(feat_rows)
-
-    # ====== 役の集計 ======
-    if not df_role.empty:
-        summary_roles = df_role.groupby(["role_key", "bucket"]).size().unstack(fill_value=0)
-        summary_roles["平均Shift"]        = df_role.groupby("role_key")["shift"].mean().round(2)
-        summary_roles["Shift標準偏差"]     = df_role.groupby("role_key")["shift"].std().round(2)
-        summary_roles["平均Winrate"]      = df_role.groupby("role_key")["winrate"].mean().round(2)
-        summary_roles["Winrate標準偏差"]   = df_role.groupby("role_key")["winrate"].std().round(2)
-        cols = [c for c in BUCKETS if c in summary_roles.columns]
-        summary_roles = summary_roles.reindex(columns=cols + ["平均Shift", "Shift標準偏差", "平均Winrate", "Winrate標準偏差"])
-        summary_roles = summary_roles.sort_values("平均Shift", ascending=False)
-    else:
-        summary_roles = pd.DataFrame()
-
-    # ====== 特徴量の集計 ======
-    if not df_feat.empty:
-        summary_feats = df_feat.groupby(["feature", "bucket"]).size().unstack(fill_value=0)
-        summary_feats["平均Shift"]        = df_feat.groupby("feature")["shift"].mean().round(2)
-        summary_feats["Shift標準偏差"]     = df_feat.groupby("feature")["shift"].std().round(2)
-        summary_feats["平均Winrate"]      = df_feat.groupby("feature")["winrate"].mean().round(2)
-        summary_feats["Winrate標準偏差"]   = df_feat.groupby("feature")["winrate"].std().round(2)
-        cols = [c for c in BUCKETS if c in summary_feats.columns]
-        summary_feats = summary_feats.reindex(columns=cols + ["平均Shift", "Shift標準偏差", "平均Winrate", "Winrate標準偏差"])
-        summary_feats = summary_feats.sort_values("平均Shift", ascending=False)
-    else:
-        summary_feats = pd.DataFrame()
-
-    return summary_roles, summary_feats
 # ================================
 #   UI
 # ================================
@@ -588,7 +320,7 @@ st.title("特徴量別 勝率シフト集計（Features or Detail の newmade_*
 files = st.file_uploader("Shift結果のCSVをアップロード（複数可）", type="csv", accept_multiple_files=True)
 
 if files:
-    df_all = pd.concat([pd.read_csv(f) for f in files], ignore_index=True)
+    df_all = read_shift_files(files)
     st.success(f"{len(files)} ファイル, 合計 {len(df_all)} 行を読み込みました。")
 
     roles, feats = analyze_roles_and_features(df_all)
@@ -613,6 +345,23 @@ if files:
             mime="text/csv",
         )
 
+    # 重要度サンプリングの結果は重みで偏りを補正した平均を出す
+    if "Weight" in df_all.columns and df_all["Weight"].notna().any():
+        w_roles, w_feats = analyze_weighted(df_all)
+        st.subheader("⚖️ 重み付き集計（重要度サンプリングの Weight 列で補正）")
+        st.caption("加重平均Shift は一様にフロップを選んだ場合の平均の推定値、標準誤差は同じフロップの行をまとめて求めています。"
+                   "有効標本数が小さいカテゴリは推定が不安定です。")
+        for name, slug, summary in (("役（hc別）", "roles", w_roles), ("特徴", "features", w_feats)):
+            if summary.empty:
+                continue
+            st.dataframe(summary)
+            st.download_button(
+                f"📥 重み付き集計（{name}）CSVを保存",
+                data=summary.to_csv(index=True, encoding="utf-8-sig"),
+                file_name=f"summary_weighted_{slug}.csv",
+                mime="text/csv",
+            )
+
     if roles.empty and feats.empty:
         st.info("newmade_* が見つかりませんでした（Features/Detailのどちらにも存在しない可能性があります）。")
 
@@ -635,95 +384,6 @@ if "df_all" in locals():
     )
 
 
-    # --- HC別集計（役を混ぜるバージョン） ---
-    def analyze_by_hc_groups(df: pd.DataFrame, selected_roles):
-        hc_groups = {"hc0": [], "hc1": [], "hc2": []}
-        total_rows = []
-
-        for _, row in df.iterrows():
-            bucket = get_bucket(row.get("Shift"))
-            if bucket is None:
-                continue
-
-            try:
-                shift = float(row.get("Shift"))
-                winrate = float(row.get("Winrate"))
-            except Exception:
-                continue
-
-            items = collect_newmade_items(row)
-            if not items:
-                continue
-
-            for item in items:
-                if item in EXCLUDED_FEATURES:
-                    continue
-
-                m = ROLE_RE.match(item)
-                if not m:
-                    continue
-
-                base, hc = m.group(1), m.group(2)
-
-                # ★選択した役だけ集計
-                if base not in selected_roles:
-                    continue
-
-                if base == "newmade_pair" and hc == "2":
-                    continue
-
-                # HC分類
-                if hc is None or hc == "0":
-                    group = "hc0"
-                elif hc == "1":
-                    group = "hc1"
-                else:
-                    group = "hc2"
-
-                rec = {"bucket": bucket, "shift": shift, "winrate": winrate}
-
-                hc_groups[group].append(rec)
-                total_rows.append(rec)
-
-        summaries = {}
-
-        # --- HCごと（役を混ぜるので role は使わない）---
-        for key, rows in hc_groups.items():
-            if not rows:
-                summaries[key] = pd.DataFrame()
-                continue
-
-            df_hc = pd.DataFrame(rows)
-
-            # bucketごとの件数
-            bucket_counts = df_hc.groupby("bucket").size().reindex(BUCKETS, fill_value=0)
-
-            # 平均値など
-            summary = bucket_counts.to_frame(name="count")
-            summary.loc["平均Shift"] = df_hc["shift"].mean().round(2)
-            summary.loc["標準偏差"] = df_hc["shift"].std().round(2)
-            summary.loc["平均Winrate"] = df_hc["winrate"].mean().round(2)
-
-            summaries[key] = summary
-
-        # --- 全体 ---
-        if total_rows:
-            df_total = pd.DataFrame(total_rows)
-
-            summary_total = df_total.groupby("bucket").size().reindex(BUCKETS, fill_value=0)
-            summary_total = summary_total.to_frame(name="count")
-
-            summary_total.loc["平均Shift"]    = df_total["shift"].mean().round(2)
-            summary_total.loc["標準偏差"]     = df_total["shift"].std().round(2)
-            summary_total.loc["平均Winrate"] = df_total["winrate"].mean().round(2)
-
-            summaries["total"] = summary_total
-        else:
-            summaries["total"] = pd.DataFrame()
-
-        return summaries
-
-
     # --- 表示 ---
     st.header("HC 別集計（選択した役をごちゃ混ぜで hc0 / hc1 / hc2 に分離）")
 
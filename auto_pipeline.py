@@ -0,0 +1,289 @@
+# auto_pipeline.py
+#
+# 自動生成モード（ShiftFlop → ShiftTurn → ShiftRiver）の計算本体。
+# (ハンド, フロップ) 単位のジョブをプロセスプールに投げ、各フロップのターン結果が
+# 出た時点でそのフロップのリバージョブを投入する。結果は app.py と同じ
+# auto_flop / auto_turn / auto_river の構造にまとめ直す。
+
+import hashlib
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import cards
+import flop_index
+import importance
+import instrument
+from simulate_shift_flop import run_shift_flop
+from simulate_shift_turn import run_shift_turn
+from simulate_shift_river import run_shift_river
+from runout_tree import LazyRunoutTree
+
+DECK_STR = [r + s for r in '23456789TJQKA' for s in 'hdcs']
+
+
+def task_seed(base_seed, *parts):
+    """(基準シード, ハンド, フロップ, ターン …) から決まるタスク固有のシード"""
+    key = "|".join([str(base_seed)] + [str(p) for p in parts])
+    return int.from_bytes(hashlib.sha256(key.encode()).digest()[:8], "little")
+
+
+def select_flops(hand, flop_count, base_seed, stratified=False, flop_types=None):
+    """
+    ハンドごとに重複なしのランダムフロップを flop_count 個選ぶ（シード固定）。
+    stratified=True ならフロップタイプ（flop_index.FLOP_TYPES）間で均等に選ぶ。
+    flop_types を指定したらそのタイプだけから（タイプ間で均等に）選ぶ。
+    """
+    rng = random.Random(task_seed(base_seed, hand, "flops"))
+    if stratified or flop_types:
+        index = flop_index.get_index()
+        return [list(f) for f in index.stratified_sample(flop_count, rng, flop_types or flop_index.FLOP_TYPES)]
+    flops_str = []
+    while len(flops_str) < flop_count:
+        sample = rng.sample(DECK_STR, 3)
+        if sample not in flops_str:
+            flops_str.append(sample)
+    return flops_str
+
+
+def run_flop_unit(hand, flop_cards_str, params, base_seed):
+    """
+    1 フロップ分の ShiftFlop と ShiftTurn を計算し、リバーを調べるターンを選ぶ。
+    runout_tree エンジンではツリーに全リバーが含まれるので、リバー結果もここで作る。
+    ターンはタスク固有のシードの random.Random で選ぶ（random モジュールの状態には触れない。
+    勝率の標本は result_cache.refined_stats が局面ごとのシードで引く）。
+    """
+    rng = random.Random(task_seed(base_seed, hand, *flop_cards_str))
+    trials = params["trials"]
+    engine = params["engine"]
+
+    flop_cards = cards.to_cards(flop_cards_str)
+    opponents = params["opponents"]
+    # ランアウトツリーはヘッズアップ専用（相手複数人は multiway の標本化）。
+    # 作るのは result_cache に無い局面を計算するときだけ（繰り返しの問い合わせはキャッシュだけで返る）
+    tree = LazyRunoutTree(hand, flop_cards) if engine == "runout_tree" and opponents == 1 else None
+    flop_wr, shift_feats, flop_ci = run_shift_flop(hand, flop_cards, trials, engine=engine, tree=tree,
+                                                   tolerance=params["tolerance"], return_ci=True,
+                                                   opponents=opponents)
+
+    turn_all_items, _, _ = run_shift_turn(
+        hand, flop_cards, flop_wr, trials, engine=engine, exact=params["exact_turn"], tree=tree,
+        tolerance=params["tolerance"], opponents=opponents, crn_seed=_crn_seed(params, base_seed)
+    )
+
+    all_turn_cards = [t["turn_card"] for t in turn_all_items if "turn_card" in t]
+    sampled_turn_cards = rng.sample(all_turn_cards, min(params["turn_count"], len(all_turn_cards)))
+    turn_wrs = {t["turn_card"]: t["winrate"] for t in turn_all_items if "turn_card" in t}
+
+    rivers = None
+    if tree is not None:
+        rivers = [_river_block(hand, flop_cards, t_card, turn_wrs.get(t_card, flop_wr), params, tree, base_seed)
+                  for t_card in sampled_turn_cards]
+
+    return {
+        "flop": (flop_cards_str, flop_wr, shift_feats, flop_ci),
+        "turn": turn_all_items,
+        "river_jobs": [(t_card, turn_wrs.get(t_card, flop_wr)) for t_card in sampled_turn_cards],
+        "rivers": rivers,
+    }
+
+
+def run_river_unit(hand, flop_cards_str, t_card, turn_wr, params, base_seed):
+    """1 ターン分の ShiftRiver（リバー全探索。ターン固定なので乱数で選ぶものは無い）"""
+    flop_cards = cards.to_cards(flop_cards_str)
+    return _river_block(hand, flop_cards, t_card, turn_wr, params, None, base_seed)
+
+
+def _crn_seed(params, base_seed):
+    """共通乱数のシード（crn=True なら基準シード。ハンドによらずフロップごとに同じ標本になる）"""
+    return base_seed if params.get("crn") else None
+
+
+def _run_unit(func, args, profile=False, memory=False, collect=False):
+    """
+    ワーカーで 1 ジョブを実行する。profile=True なら計測を有効にして実行し、
+    collect=True（別プロセス）なら (結果, そのジョブ分の計測集計) を返す。
+    """
+    if profile and collect:
+        instrument.enable(memory=memory)
+    result = func(*args)
+    return (result, instrument.recorder.drain()) if collect else (result, None)
+
+
+def _progress_message(message, done, total, started, evals_start=None):
+    """
+    進捗メッセージに 計測した処理速度（評価/秒）と残り時間の見込みを付ける。
+    evals_start: 開始時の instrument.recorder.evals（None なら処理速度は出さない）
+    """
+    elapsed = time.time() - started
+    parts = [message]
+    if evals_start is not None and elapsed > 0:
+        parts.append(f"{(instrument.recorder.evals - evals_start) / elapsed:,.0f} 評価/秒")
+    if done and total > done:
+        parts.append(f"残り約 {elapsed / done * (total - done):.0f} 秒")
+    return " / ".join(parts)
+
+
+def _river_block(hand, flop_cards, t_card, turn_wr, params, tree, base_seed):
+    river_items, _, _ = run_shift_river(
+        hand,
+        flop_cards + [cards.card(t_card)],
+        turn_wr,
+        turn_count=params["turn_count"],
+        trials_per_river=params["trials"],
+        engine=params["engine"],
+        tree=tree,
+        opponents=params["opponents"],
+        crn_seed=_crn_seed(params, base_seed),
+    )
+    return {"turn_card": t_card, "all": river_items}
+
+
+def _importance_flops(pool, hands, flop_count, target, base_seed, unit_opts, cancelled, progress):
+    """
+    重要度サンプリングのフロップと重み（importance.sample_flops）をハンドごとにプールで求める。
+    カテゴリの判定は 1 ハンド約 10 秒かかるので、ハンドの間で取り消しを確認する。
+    取り消されたら、まだ求まっていないハンドの枠は None（フロップジョブは投入されない）。
+    """
+    flops = {hand: [None] * flop_count for hand in hands}
+    weights = {hand: [None] * flop_count for hand in hands}
+    pending = {pool.submit(_run_unit, importance.sample_flops,
+                           (hand, flop_count, target, task_seed(base_seed, hand, "flops")), *unit_opts): hand
+               for hand in hands}
+    done_count = 0
+    while pending:
+        if cancelled():
+            for future in pending:
+                future.cancel()
+            break
+        finished, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+        for future in finished:
+            hand = pending.pop(future)
+            (flops[hand], weights[hand]), stats = future.result()
+            if stats is not None:
+                instrument.recorder.merge(stats)
+            done_count += 1
+            if progress:
+                progress(0, 0, f"重要度サンプリングの準備中（{done_count}/{len(hands)} ハンド完了）")
+    return flops, weights
+
+
+def run_auto_pipeline(hands, flop_count, turn_count, trials, engine="runout_tree", exact_turn=True,
+                      workers=None, seed=None, progress=None, tolerance=None, on_partial=None, cancel_event=None,
+                      opponents=1, stratified=False, profile=False, profile_memory=False,
+                      flop_types=None, skip_units=None, on_unit=None, crn=False, importance_target=None):
+    """
+    自動生成モードを実行し (auto_flop, auto_turn, auto_river) を返す。
+    auto_flop の各要素は (フロップ, 勝率, 特徴別シフト, 95%信頼区間の半幅)。未計算の枠は None。
+    重要度サンプリングのときは 5 番目に重み（importance.sample_flops）が付く。
+    - tolerance: モンテカルロの目標標準誤差（%ポイント）。trials は上限になる
+    - stratified: フロップをフロップタイプ間で均等に選ぶ（False なら一様ランダム）
+    - flop_types: 選ぶフロップのタイプ（flop_index.FLOP_TYPES の部分集合。タイプ間で均等）
+    - opponents: ランダムハンドの相手人数（2 人以上は各ストリート trials 回の multiway 標本化）
+    - crn: モンテカルロの標本を同じフロップの全ターン・全リバー・全ハンドで共通にする（crn.py）
+    - importance_target: 指定すると、newmade_* カテゴリごとの行数がこの件数に近づくように
+      希少カテゴリの出るフロップを重点的に（復元抽出で）選び、重みを付ける（importance.py）。
+      stratified / flop_types より優先する
+    - workers: プロセス数（1 ならプロセスプールを使わず、1 本のスレッドで順に計算する）
+    - seed: 基準シード（同じシードで同じ result_cache の状態なら、実行順・並列度に関係なく同じ結果）
+    - progress(done, total, message): 進捗コールバック（total はリバージョブ投入で増える）
+    - on_partial(auto_flop, auto_turn, auto_river): ジョブが1つ終わるたびに途中結果で呼ぶ
+    - cancel_event: threading.Event。セットされたら新しいジョブを投入せず、未開始のジョブを
+      取り消して途中結果を返す
+    - profile: ステージごとの計測（instrument.recorder に集計）。profile_memory=True ならピークメモリも測る
+    - skip_units: 計算しない (ハンド, フロップ番号) の集合（再開時の計算済み分。枠は None のまま）
+    - on_unit(hand, i, flop_entry, turn_items, river_blocks): (ハンド, フロップ) 単位が
+      リバーまで揃うたびに呼ぶ（チェックポイント用。取り消しで揃わなかった単位は呼ばない）
+    """
+    cancelled = cancel_event.is_set if cancel_event is not None else (lambda: False)
+    if seed is None:
+        seed = random.randrange(1 << 31)
+    params = {"trials": trials, "turn_count": turn_count, "engine": engine, "exact_turn": exact_turn,
+              "tolerance": tolerance, "opponents": opponents, "crn": crn}
+
+    skip_units = skip_units or set()
+    weights = None
+    if not importance_target:
+        flops = {hand: select_flops(hand, flop_count, seed, stratified, flop_types) for hand in hands}
+    river_slots = {}
+
+    # workers=1 でも別スレッドで計算し、1 ジョブごとに進捗・途中結果・取り消しを反映する
+    in_process = workers == 1
+    executor = ThreadPoolExecutor(max_workers=1) if in_process else ProcessPoolExecutor(max_workers=workers)
+    unit_opts = (profile, profile_memory, profile and not in_process)
+    started = time.time()
+    evals_start = instrument.recorder.evals if profile else None
+    # 同じプロセスで計算するときはこのジョブの間だけ計測を有効にする（他のジョブが計測中なら
+    # 終わっても元に戻さない）
+    with instrument.session(profile and in_process, profile_memory):
+        with executor as pool:
+            if importance_target:
+                flops, weights = _importance_flops(pool, hands, flop_count, importance_target, seed, unit_opts,
+                                                   cancelled, progress)
+            batch_flop = {hand: [None] * len(flops[hand]) for hand in hands}
+            batch_turn = {hand: [None] * len(flops[hand]) for hand in hands}
+            batch_river = {hand: [[] for _ in flops[hand]] for hand in hands}
+
+            pending = {}
+            for hand in hands:
+                for i, flop_cards_str in enumerate(flops[hand]):
+                    if cancelled():
+                        break
+                    if (hand, i) in skip_units:
+                        continue
+                    future = pool.submit(_run_unit, run_flop_unit, (hand, flop_cards_str, params, seed), *unit_opts)
+                    pending[future] = ("flop", hand, i, None)
+
+            done_count = 0
+            total = len(pending)
+            while pending:
+                if cancelled():
+                    for future in pending:
+                        future.cancel()
+                    pending = {f: v for f, v in pending.items() if not f.cancelled()}
+                    if not pending:
+                        break
+                finished, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    kind, hand, i, slot = pending.pop(future)
+                    result, stats = future.result()
+                    if stats is not None:
+                        instrument.recorder.merge(stats)
+                    done_count += 1
+
+                    if kind == "flop":
+                        flop_cards_str = result["flop"][0]
+                        batch_flop[hand][i] = result["flop"] + ((weights[hand][i],) if weights else ())
+                        batch_turn[hand][i] = result["turn"]
+                        if result["rivers"] is not None:
+                            batch_river[hand][i] = result["rivers"]
+                            unit_done = True
+                        else:
+                            # ターン結果が揃ったので、このフロップのリバージョブを投入
+                            river_slots[(hand, i)] = [None] * len(result["river_jobs"])
+                            for j, (t_card, turn_wr) in enumerate(result["river_jobs"]):
+                                if cancelled():
+                                    break
+                                rf = pool.submit(_run_unit, run_river_unit,
+                                                 (hand, flop_cards_str, t_card, turn_wr, params, seed), *unit_opts)
+                                pending[rf] = ("river", hand, i, j)
+                                total += 1
+                            if not result["river_jobs"]:
+                                batch_river[hand][i] = []
+                            unit_done = not result["river_jobs"]
+                        message = f"{hand} フロップ {' '.join(flop_cards_str)} 完了"
+                    else:
+                        river_slots[(hand, i)][slot] = result
+                        unit_done = all(b is not None for b in river_slots[(hand, i)])
+                        if unit_done:
+                            batch_river[hand][i] = river_slots.pop((hand, i))
+                        message = f"{hand} ターン {result['turn_card']} のリバー完了"
+
+                    if unit_done and on_unit:
+                        on_unit(hand, i, batch_flop[hand][i], batch_turn[hand][i], batch_river[hand][i])
+                    if progress:
+                        progress(done_count, total, _progress_message(message, done_count, total, started, evals_start))
+                    if on_partial:
+                        on_partial(batch_flop, batch_turn, batch_river)
+
+    return batch_flop, batch_turn, batch_river
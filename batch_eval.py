@@ -0,0 +1,174 @@
+# batch_eval.py
+#
+# NumPy によるベクトル化ハンド評価器。
+# 7 枚（5〜7 枚）のハンドを (N, k) の整数配列でまとめて受け取り、
+# eval7.evaluate と同一のスコア（そのまま大小比較できる値）を int 配列で返す。
+
+import itertools
+import random
+from functools import lru_cache
+
+import numpy as np
+
+import cards
+
+# =============================
+# カード整数コード（cards.code: eval7.Card.mask のビット位置と一致する suit*13 + rank）
+# =============================
+
+def cards_to_codes(card_list):
+    """カード（eval7.Card・文字列）のリスト → cards.code の int 配列"""
+    return np.array([cards.code(c) for c in card_list], dtype=np.int64)
+
+def live_codes(dead_cards):
+    """使用済みカード（カードの並び、またはマスク）を除いた残りデッキのコード配列"""
+    dead = dead_cards if isinstance(dead_cards, int) else cards.mask(dead_cards)
+    return np.array([c for c in range(52) if not dead >> c & 1], dtype=np.int64)
+
+
+# =============================
+# ルックアップテーブル（13 ビットのランクマスク → 値）
+# =============================
+
+# eval7 のハンドタイプ値（上位 8 ビット）
+HIGH_CARD = 0
+PAIR = 1 << 24
+TWO_PAIR = 2 << 24
+TRIPS = 3 << 24
+STRAIGHT = 4 << 24
+FLUSH = 5 << 24
+FULL_HOUSE = 6 << 24
+QUADS = 7 << 24
+STRAIGHT_FLUSH = 8 << 24
+
+def _build_tables():
+    size = 1 << 13
+    top1 = np.zeros(size, dtype=np.int64)
+    top5 = np.zeros(size, dtype=np.int64)
+    straight = np.full(size, -1, dtype=np.int64)
+    wheel = (1 << 12) | 0b1111  # A,5,4,3,2
+
+    for m in range(1, size):
+        ranks_desc = [r for r in range(12, -1, -1) if m >> r & 1]
+        top1[m] = ranks_desc[0]
+        packed = 0
+        for i, r in enumerate(ranks_desc[:5]):
+            packed |= r << (16 - 4 * i)
+        top5[m] = packed
+        for hi in range(12, 3, -1):
+            window = 0b11111 << (hi - 4)
+            if m & window == window:
+                straight[m] = hi
+                break
+        else:
+            if m & wheel == wheel:
+                straight[m] = 3
+    return top1, top5, straight
+
+TOP1_TABLE, TOP5_TABLE, STRAIGHT_TABLE = _build_tables()
+
+
+# =============================
+# バッチ評価
+# =============================
+
+def evaluate_batch(hands):
+    """
+    (N, k) の整数コード配列（k=5〜7）を評価し、eval7.evaluate と同じスコアを返す。
+    """
+    hands = np.asarray(hands, dtype=np.int64)
+    if hands.ndim == 1:
+        hands = hands[None, :]
+    n = hands.shape[0]
+    ranks = hands % 13
+    suits = hands // 13
+
+    rank_bit = np.left_shift(1, ranks)
+    rank_bits = np.bitwise_or.reduce(rank_bit, axis=1)
+
+    # ランクごとの枚数（3 ビット × 13）とスートごとの枚数（4 ビット × 4）を一括集計
+    rank_counts = np.left_shift(1, ranks * 3).sum(axis=1)
+    suit_counts = np.left_shift(1, suits * 4).sum(axis=1)
+
+    quads = np.zeros(n, dtype=np.int64)
+    trips = np.zeros(n, dtype=np.int64)
+    pairs = np.zeros(n, dtype=np.int64)
+    for r in range(13):
+        cnt = (rank_counts >> (3 * r)) & 7
+        quads |= (cnt == 4).astype(np.int64) << r
+        trips |= (cnt == 3).astype(np.int64) << r
+        pairs |= (cnt == 2).astype(np.int64) << r
+
+    flush_mask = np.zeros(n, dtype=np.int64)
+    for s in range(4):
+        is_flush_suit = ((suit_counts >> (4 * s)) & 15) >= 5
+        if is_flush_suit.any():
+            suited = np.bitwise_or.reduce(np.where(suits == s, rank_bit, 0), axis=1)
+            flush_mask = np.where(is_flush_suit, suited, flush_mask)
+    has_flush = flush_mask != 0
+
+    sf_top = STRAIGHT_TABLE[flush_mask]
+    st_top = STRAIGHT_TABLE[rank_bits]
+
+    q = TOP1_TABLE[quads]
+    t = TOP1_TABLE[trips]
+    t_rest = trips & ~np.left_shift(1, t)
+    p1 = TOP1_TABLE[pairs]
+    p2 = TOP1_TABLE[pairs & ~np.left_shift(1, p1)]
+
+    v_sf = STRAIGHT_FLUSH | (sf_top << 16)
+    v_quads = QUADS | (q << 16) | (TOP1_TABLE[rank_bits & ~np.left_shift(1, q)] << 12)
+    v_fh = FULL_HOUSE | (t << 16) | (TOP1_TABLE[t_rest | pairs] << 12)
+    v_flush = FLUSH | TOP5_TABLE[flush_mask]
+    v_straight = STRAIGHT | (st_top << 16)
+    v_trips = TRIPS | (t << 16) | ((TOP5_TABLE[rank_bits & ~np.left_shift(1, t)] >> 4) & 0xFF00)
+    two_bits = np.left_shift(1, p1) | np.left_shift(1, p2)
+    v_two = TWO_PAIR | (p1 << 16) | (p2 << 12) | (TOP1_TABLE[rank_bits & ~two_bits] << 8)
+    v_pair = PAIR | (p1 << 16) | ((TOP5_TABLE[rank_bits & ~np.left_shift(1, p1)] >> 4) & 0xFFF0)
+    v_high = TOP5_TABLE[rank_bits]
+
+    conds = [
+        has_flush & (sf_top >= 0),
+        quads != 0,
+        (trips != 0) & ((t_rest != 0) | (pairs != 0)),
+        has_flush,
+        st_top >= 0,
+        trips != 0,
+        (pairs & (pairs - 1)) != 0,
+        pairs != 0,
+    ]
+    choices = [v_sf, v_quads, v_fh, v_flush, v_straight, v_trips, v_two, v_pair]
+    return np.select(conds, choices, default=v_high)
+
+
+# =============================
+# サンプリング補助
+# =============================
+
+def make_rng(rng=None):
+    """
+    rng（random.Random。省略時は random モジュール）の状態から NumPy Generator を作る。
+    シード済みの乱数による再現性をそのまま NumPy 側にも引き継ぐため。
+    """
+    return np.random.default_rng((random if rng is None else rng).getrandbits(64))
+
+def sample_without_replacement(live, n, k, rng=None):
+    """live（コード配列）から重複なしで k 枚を n 回引き、(n, k) の配列を返す"""
+    if rng is None:
+        rng = make_rng()
+    keys = rng.random((n, len(live)))
+    idx = np.argpartition(keys, k - 1, axis=1)[:, :k] if k < len(live) else np.argsort(keys, axis=1)
+    return live[idx]
+
+@lru_cache(maxsize=None)
+def combination_indices(n, k):
+    """range(n) から k 個選ぶ全組み合わせのインデックス配列 (C(n,k), k)"""
+    idx = np.array(list(itertools.combinations(range(n), k)), dtype=np.int64)
+    idx.setflags(write=False)
+    return idx
+
+def outcome_counts(my_scores, opp_scores):
+    """勝ち数・引き分け数を返す"""
+    wins = int(np.count_nonzero(my_scores > opp_scores))
+    ties = int(np.count_nonzero(my_scores == opp_scores))
+    return wins, ties
@@ -0,0 +1,199 @@
+# batch_runner.py
+#
+# 自動生成モード（ShiftFlop → ShiftTurn → ShiftRiver）をブラウザなしで実行するコマンド。
+# 計算は app.py と同じ auto_pipeline.run_auto_pipeline。
+# (ハンド, フロップ) 単位が揃うたびにチェックポイント（JSON Lines）へ追記するので、
+# 途中で止まっても同じコマンドを再実行すれば計算済みの単位は飛ばして続きから再開する。
+# 最後にチェックポイントからハンドごとに結果表（Parquet、--csv なら CSV も）を書き出す。
+#
+# 例:
+#   python batch_runner.py --hands "QQ+, AKs, T9s-76s" --flop-count 30 --turn-count 10 --workers 8
+#   python batch_runner.py --groups "Low Pair,Suited Connectors" --flop-types paired,wet --flop-count 20
+#   python batch_runner.py --hands "77, 22" --flop-count 30 --importance-target 30   # 希少カテゴリを重点抽出
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import flop_index
+import instrument
+import result_writer
+from auto_pipeline import run_auto_pipeline
+from hand_group_mapping import classify_hand_group, generate_all_169_hands
+from hand_range import hand_classes
+
+DEFAULT_OUTPUT = os.path.join("results", "batch_shift_results.parquet")
+
+# フロップ選択と各単位の結果を決めるパラメータ（再開時はこれが一致している必要がある）
+RESUME_KEYS = ("flop_count", "turn_count", "trials", "engine", "exact_turn", "seed", "tolerance",
+               "opponents", "stratified", "flop_types", "crn", "importance_target")
+
+
+def select_hands(hands_text=None, groups_text=None):
+    """--hands（レンジ文字列）と --groups（hand_group_mapping のグループ名）からハンドの一覧を作る"""
+    hands = hand_classes(hands_text) if hands_text else []
+    if groups_text:
+        groups = [g.strip() for g in groups_text.split(",") if g.strip()]
+        known = {classify_hand_group(h) for h in generate_all_169_hands()}
+        unknown = [g for g in groups if g not in known]
+        if unknown:
+            raise ValueError(f"不明なハンドグループ: {', '.join(unknown)}（{', '.join(sorted(known))}）")
+        hands += [h for h in generate_all_169_hands() if classify_hand_group(h) in groups and h not in hands]
+    return hands
+
+
+def checkpoint_path_for(output):
+    return os.path.splitext(output)[0] + ".checkpoint.jsonl"
+
+
+def load_checkpoint(path, params):
+    """
+    チェックポイントを読み、{(ハンド, フロップ番号): 単位の結果} を返す。
+    1 行目のパラメータが今回と違えばエラー（ハンドの追加・削除は可）。
+    途中で書きかけの最終行（強制終了時）は読み飛ばす。
+    """
+    units = {}
+    if not os.path.exists(path):
+        return units
+    with open(path, encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    if not lines:
+        return units
+    saved = json.loads(lines[0])["params"]
+    diff = [k for k in RESUME_KEYS if saved.get(k) != params[k]]
+    if diff:
+        raise ValueError(f"チェックポイント {path} とパラメータが違います: "
+                         + ", ".join(f"{k}={saved.get(k)!r}→{params[k]!r}" for k in diff)
+                         + "（別の --output を指定するか、チェックポイントを削除してください）")
+    for line in lines[1:]:
+        try:
+            unit = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        units[(unit["hand"], unit["i"])] = unit
+    return units
+
+
+class CheckpointWriter:
+    """完了した単位を 1 行ずつ追記する（1 行ごとに fsync）"""
+
+    def __init__(self, path, params):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, "a", encoding="utf-8")
+        if new:
+            self._write({"params": params})
+
+    def _write(self, obj):
+        self._file.write(json.dumps(obj, ensure_ascii=False, default=float) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def write_unit(self, hand, i, flop_entry, turn_items, river_blocks):
+        self._write({"hand": hand, "i": i, "flop": flop_entry, "turn": turn_items, "river": river_blocks})
+
+    def close(self):
+        self._file.close()
+
+
+def write_results(units, hands, flop_count, opponents, output, csv_path=None):
+    """チェックポイントの単位から結果表を書き出す（ハンドごとに組み立てて逐次書き込み）"""
+    with result_writer.ShiftResultWriter(output) as writer:
+        for hand in hands:
+            flops = [None] * flop_count
+            turns = [None] * flop_count
+            rivers = [[] for _ in range(flop_count)]
+            for i in range(flop_count):
+                unit = units.get((hand, i))
+                if unit is not None:
+                    flops[i], turns[i], rivers[i] = unit["flop"], unit["turn"], unit["river"]
+            writer.write_rows(result_writer.iter_result_rows({hand: flops}, {hand: turns}, {hand: rivers},
+                                                             opponents))
+    if csv_path:
+        result_writer.export_csv(output, csv_path)
+    return writer.rows_written
+
+
+def _print_progress(done, total, message):
+    print(f"[{done}/{total}] {message}", file=sys.stderr, flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ShiftFlop → ShiftTurn → ShiftRiver の一括計算（チェックポイント再開つき）")
+    parser.add_argument("--hands", help='ハンドのレンジ文字列（例: "QQ+, AKs, T9s-76s"）')
+    parser.add_argument("--groups", help='hand_group_mapping のグループ名（カンマ区切り。例: "High Pair,Suited Connectors"）')
+    parser.add_argument("--flop-count", type=int, default=10, help="ハンドごとのフロップ数")
+    parser.add_argument("--flop-types", help=f"フロップタイプ（カンマ区切り。{', '.join(flop_index.FLOP_TYPES)}）")
+    parser.add_argument("--stratified", action="store_true", help="フロップをタイプ間で均等に選ぶ")
+    parser.add_argument("--turn-count", type=int, default=10, help="リバーを調べるターン数")
+    parser.add_argument("--trials", type=int, default=10000, help="モンテカルロ試行回数（上限）")
+    parser.add_argument("--engine", choices=["runout_tree", "numpy", "eval7"], default="runout_tree")
+    parser.add_argument("--exact-turn", action=argparse.BooleanOptionalAction, default=True,
+                        help="ShiftTurn を厳密列挙で計算する")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="プロセス数（1 = 並列化しない）")
+    parser.add_argument("--seed", type=int, default=0, help="乱数シード（再開時は同じ値にする）")
+    parser.add_argument("--tolerance", type=float, help="目標標準誤差（%%ポイント）")
+    parser.add_argument("--opponents", type=int, default=1, help="相手人数")
+    parser.add_argument("--crn", action="store_true", help="共通乱数（同じフロップの全ターン・リバー・ハンドで同じ標本）")
+    parser.add_argument("--importance-target", type=int,
+                        help="newmade_* カテゴリごとの目標行数。希少カテゴリの出るフロップを重点的に選び重みを付ける")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="結果ファイル（.parquet / .arrow）")
+    parser.add_argument("--checkpoint", help="チェックポイント（省略時は 出力名.checkpoint.jsonl）")
+    parser.add_argument("--csv", action="store_true", help="結果を CSV にも書き出す")
+    parser.add_argument("--profile", action="store_true", help="ステージごとの計測を diagnostics.jsonl に追記する")
+    args = parser.parse_args(argv)
+
+    try:
+        hands = select_hands(args.hands, args.groups)
+    except ValueError as e:
+        parser.error(str(e))
+    if not hands:
+        parser.error("--hands か --groups を指定してください")
+    flop_types = [t.strip() for t in args.flop_types.split(",")] if args.flop_types else None
+    unknown = [t for t in flop_types or [] if t not in flop_index.FLOP_TYPES]
+    if unknown:
+        parser.error(f"不明なフロップタイプ: {', '.join(unknown)}")
+
+    params = dict(flop_count=args.flop_count, turn_count=args.turn_count, trials=args.trials, engine=args.engine,
+                  exact_turn=args.exact_turn, seed=args.seed, tolerance=args.tolerance, opponents=args.opponents,
+                  stratified=args.stratified, flop_types=flop_types, crn=args.crn,
+                  importance_target=args.importance_target)
+    checkpoint = args.checkpoint or checkpoint_path_for(args.output)
+    try:
+        units = load_checkpoint(checkpoint, params)
+    except ValueError as e:
+        parser.error(str(e))
+    done = {(h, i) for h, i in units if h in hands and i < args.flop_count}
+    print(f"{len(hands)} ハンド × {args.flop_count} フロップ（計算済み {len(done)} 単位）", file=sys.stderr)
+
+    writer = CheckpointWriter(checkpoint, params)
+
+    def on_unit(hand, i, flop_entry, turn_items, river_blocks):
+        writer.write_unit(hand, i, flop_entry, turn_items, river_blocks)
+        units[(hand, i)] = {"flop": flop_entry, "turn": turn_items, "river": river_blocks}
+
+    started = time.time()
+    try:
+        run_auto_pipeline(tuple(hands), workers=args.workers, progress=_print_progress, on_unit=on_unit,
+                          skip_units=done, profile=args.profile, **params)
+    except KeyboardInterrupt:
+        print(f"中断しました。同じコマンドで再実行すると続きから再開します（{checkpoint}）", file=sys.stderr)
+        return 130
+    finally:
+        writer.close()
+
+    csv_path = os.path.splitext(args.output)[0] + ".csv" if args.csv else None
+    rows = write_results(units, hands, args.flop_count, args.opponents, args.output, csv_path)
+    print(f"{time.time() - started:.1f} 秒 / {rows} 行を {args.output} に保存しました"
+          + (f"（CSV: {csv_path}）" if csv_path else ""), file=sys.stderr)
+    if args.profile:
+        path = instrument.export_jsonl(os.path.join(os.path.dirname(args.output) or ".", "diagnostics.jsonl"),
+                                       hands=",".join(hands), engine=args.engine, workers=args.workers)
+        print(f"計測結果: {path}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,321 @@
+# benchmark.py
+#
+# 勝率計算・役判定・特徴判定のカーネルごとのマイクロベンチマーク。
+#   python benchmark.py                       # 全カーネルを計測して bench_results/ に JSON 保存
+#   python benchmark.py --quick               # 繰り返し回数を減らして計測
+#   python benchmark.py --only river          # 名前に "river" を含むカーネルだけ
+#   python benchmark.py --compare old.json    # 以前の JSON と速度を比較
+#   python benchmark.py --update-golden       # 厳密勝率の正解表（benchmark_golden.json）を作り直す
+#
+# 各カーネルは固定シード・固定局面で、1 回あたりの所要時間（中央値）・評価回数/秒・
+# tracemalloc のピークメモリを記録する。さらに正解表の厳密勝率と照合し、
+# 全列挙系は完全一致、モンテカルロ系は標準誤差の 4 倍以内かを確認する。
+
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+import eval7
+
+import board_patterns
+import cards
+import multiway
+from generate_preflop_winrates import monte_carlo_winrate_stats
+from made_hand import classify_made_hand
+from runout_tree import RunoutTree
+from simulate_shift_flop import simulate_vs_random_stats as flop_vs_random_stats
+from simulate_shift_river import enumerate_vs_all
+from simulate_shift_turn import enumerate_turn_equity, simulate_vs_random_stats
+
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_golden.json")
+RESULTS_DIR = "bench_results"
+SEED = 12345
+
+# 正解表の局面（ホールカード, ボード）。ボード 3 / 4 / 5 枚でフロップ / ターン / リバーの勝率
+GOLDEN_SPOTS = [
+    ("Ah Kh", "Qh Jh 2c 7d 9s"),
+    ("7c 7d", "7h 2s Kd Qc 3h"),
+    ("Tc 9c", "8c 7d 2c Ah 4s"),
+    ("As 2d", "3h 4c 5s 9d 9h"),
+    ("Ah Kh", "Qh Jh 2c 7d"),
+    ("5s 4s", "6s 7d Kc 2h"),
+    ("Qd Qc", "Ks 8h 3d Td"),
+    ("Ah Kh", "Qh Jh 2c"),
+    ("7c 7d", "Ah Kd 2s"),
+]
+
+# モンテカルロ系の照合で許す誤差（標準誤差の倍数）
+MC_TOLERANCE_SE = 4.0
+
+
+def _spot(hole, board):
+    return cards.to_cards(hole.split()), cards.to_cards(board.split())
+
+
+def reference_equity(hole, board):
+    """eval7 だけを使った素朴な全列挙（ランアウト × 相手ハンド）。正解表の作成用"""
+    live = cards.live_cards(hole + board)
+    wins = ties = total = 0
+    for runout in itertools.combinations(live, 5 - len(board)):
+        full = board + list(runout)
+        hero = eval7.evaluate(hole + full)
+        rest = [c for c in live if c not in runout]
+        for opp in itertools.combinations(rest, 2):
+            score = eval7.evaluate(list(opp) + full)
+            total += 1
+            if hero > score:
+                wins += 1
+            elif hero == score:
+                ties += 1
+    return (wins + ties / 2) / total * 100
+
+
+def update_golden(path=GOLDEN_PATH):
+    spots = []
+    for hole, board in GOLDEN_SPOTS:
+        start = time.perf_counter()
+        equity = reference_equity(*_spot(hole, board))
+        spots.append({"hole": hole, "board": board, "equity": equity})
+        print(f"{hole} | {board}: {equity:.6f}%  ({time.perf_counter() - start:.1f} 秒)")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"spots": spots}, f, indent=2, ensure_ascii=False)
+    return path
+
+
+def load_golden(path=GOLDEN_PATH):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)["spots"]
+
+
+# ========= カーネル定義 =========
+# name: 名前 / make: 引数なしで呼べる関数を返す / evals: 1 回あたりの手役評価回数 /
+# repeat: 計測回数 / check(golden): 照合（(合否, 説明) を返す。無ければ None）
+
+def _golden_by_street(golden, n_board):
+    return [g for g in golden if len(g["board"].split()) == n_board]
+
+
+def _check_exact(golden, n_board, compute):
+    worst = 0.0
+    for g in _golden_by_street(golden, n_board):
+        worst = max(worst, abs(compute(*_spot(g["hole"], g["board"])) - g["equity"]))
+    return worst < 1e-9, f"最大誤差 {worst:.2e}"
+
+
+def _check_mc(golden, n_board, compute_stats):
+    worst = 0.0
+    for g in _golden_by_street(golden, n_board):
+        stats = compute_stats(*_spot(g["hole"], g["board"]))
+        worst = max(worst, abs(stats.equity - g["equity"]) / max(stats.stderr, 1e-9))
+    return worst <= MC_TOLERANCE_SE, f"最大誤差 {worst:.2f} SE"
+
+
+def _tree_turn(hole, board):
+    return RunoutTree(hole, board[:3]).turn_equity(board[3])
+
+
+def _tree_river(hole, board):
+    return RunoutTree(hole, board[:3]).river_equity(board[3], board[4])
+
+
+def build_kernels(golden):
+    hole, board5 = _spot("Ah Kh", "Qh Jh 2c 7d 9s")
+    flop, board4 = board5[:3], board5[:4]
+    opp = cards.to_cards(["Tc", "Td"])
+    preflop_hand = cards.to_cards(["Qs", "Jd"])
+    n_live = 52 - 2 - 4  # ターン時点の残り枚数
+
+    rng = random.Random(SEED)
+    hands7 = [rng.sample(cards.DECK, 7) for _ in range(2000)]
+    board_samples = [rng.sample(cards.DECK, 5) for _ in range(2000)]
+
+    def mc(engine, board_cards, iterations):
+        return lambda: simulate_vs_random_stats(hole, board_cards[:3], board_cards[3:], iterations, engine=engine)
+
+    return [
+        # --- 全列挙 ---
+        dict(name="river.enumerate_vs_all[eval7]", make=lambda: lambda: enumerate_vs_all(hole, board5),
+             evals=1 + 990, repeat=20,
+             check=lambda: _check_exact(golden, 5, enumerate_vs_all)),
+        dict(name="river.enumerate_vs_all[numpy]",
+             make=lambda: lambda: enumerate_vs_all(hole, board5, engine="numpy"),
+             evals=1 + 990, repeat=50,
+             check=lambda: _check_exact(golden, 5, lambda h, b: enumerate_vs_all(h, b, engine="numpy"))),
+        dict(name="turn.enumerate_turn_equity", make=lambda: lambda: enumerate_turn_equity(hole, board4),
+             evals=n_live + n_live * (n_live - 1) * (n_live - 2) // 6, repeat=10,
+             check=lambda: _check_exact(golden, 4, enumerate_turn_equity)),
+        dict(name="flop.RunoutTree", make=lambda: lambda: RunoutTree(hole, flop),
+             evals=1081 + 47 * 46 * 45 * 44 // 24, repeat=3,
+             check=lambda: _check_exact(golden, 3, lambda h, b: RunoutTree(h, b).flop_equity())),
+        dict(name="turn.RunoutTree.turn_equity", make=None, evals=0, repeat=0,
+             check=lambda: _check_exact(golden, 4, _tree_turn)),
+        dict(name="river.RunoutTree.river_equity", make=None, evals=0, repeat=0,
+             check=lambda: _check_exact(golden, 5, _tree_river)),
+        # --- モンテカルロ ---
+        dict(name="turn.simulate_vs_random[eval7]", make=lambda: mc("eval7", board4, 2000),
+             evals=2 * 2000, repeat=10,
+             check=lambda: _check_mc(golden, 4, lambda h, b: simulate_vs_random_stats(h, b[:3], b[3:], 20000))),
+        dict(name="turn.simulate_vs_random[numpy]", make=lambda: mc("numpy", board4, 20000),
+             evals=2 * 20000, repeat=10,
+             check=lambda: _check_mc(golden, 4, lambda h, b: simulate_vs_random_stats(
+                 h, b[:3], b[3:], 20000, engine="numpy"))),
+        dict(name="flop.simulate_vs_random[eval7]", make=lambda: mc("eval7", flop, 2000),
+             evals=2 * 2000, repeat=10,
+             check=lambda: _check_mc(golden, 3, lambda h, b: simulate_vs_random_stats(h, b, [], 20000))),
+        dict(name="flop.simulate_vs_random[numpy]", make=lambda: mc("numpy", flop, 20000),
+             evals=2 * 20000, repeat=10,
+             check=lambda: _check_mc(golden, 3, lambda h, b: simulate_vs_random_stats(
+                 h, b, [], 20000, engine="numpy"))),
+        dict(name="flop.simulate_vs_random_fixed_opp[eval7]",
+             make=lambda: lambda: flop_vs_random_stats(hole, opp, flop, 2000),
+             evals=2 * 2000, repeat=10, check=None),
+        dict(name="multiway.equity_stats[2 opp, flop]",
+             make=lambda: lambda: multiway.equity_stats(hole, flop, 2, 20000),
+             evals=3 * 20000, repeat=5, check=None),
+        dict(name="preflop.monte_carlo_winrate[eval7]",
+             make=lambda: lambda: monte_carlo_winrate_stats(preflop_hand, 2000),
+             evals=2 * 2000, repeat=10, check=None),
+        dict(name="preflop.monte_carlo_winrate[numpy]",
+             make=lambda: lambda: monte_carlo_winrate_stats(preflop_hand, 20000, engine="numpy"),
+             evals=2 * 20000, repeat=10, check=None),
+        # --- 役判定・特徴判定 ---
+        dict(name="made_hand.classify_made_hand[x2000]",
+             make=lambda: lambda: [classify_made_hand(h[:2], h[2:]) for h in hands7],
+             evals=len(hands7), repeat=20, check=None),
+        dict(name="board_patterns.classify_flop_turn_pattern[x2000]",
+             make=lambda: lambda: [board_patterns.classify_flop_turn_pattern(b[:3], b[3], b[4])
+                                   for b in board_samples],
+             evals=0, repeat=20, check=None),
+        dict(name="board_patterns.new_features_bulk[river]",
+             make=lambda: lambda: board_patterns.new_features_bulk(
+                 board_patterns.texture_state(board4), cards.live_cards(hole + board4)),
+             evals=0, repeat=200, check=None),
+    ]
+
+
+# ========= 計測 =========
+
+def measure(kernel, quick=False):
+    """固定シードで repeat 回呼び、所要時間の中央値・評価回数/秒・ピークメモリを返す"""
+    repeat = max(1, kernel["repeat"] // 5) if quick else kernel["repeat"]
+    func = kernel["make"]()
+
+    random.seed(SEED)
+    func()  # ウォームアップ（テーブル構築・lru_cache など）
+    times = []
+    for _ in range(repeat):
+        random.seed(SEED)
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    # メモリは計測時間に影響するので別に 1 回だけ測る
+    random.seed(SEED)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latency = statistics.median(times)
+    return {
+        "repeat": repeat,
+        "latency_ms": latency * 1000,
+        "latency_min_ms": min(times) * 1000,
+        "evals_per_call": kernel["evals"],
+        "evals_per_sec": kernel["evals"] / latency if kernel["evals"] and latency > 0 else None,
+        "peak_memory_kb": peak / 1024,
+    }
+
+
+def run(quick=False, only=None, golden_path=GOLDEN_PATH):
+    golden = load_golden(golden_path)
+    results = []
+    for kernel in build_kernels(golden):
+        if only and only not in kernel["name"]:
+            continue
+        entry = {"name": kernel["name"]}
+        if kernel["make"] is not None:
+            entry.update(measure(kernel, quick))
+        if kernel["check"] is not None:
+            random.seed(SEED)
+            ok, detail = kernel["check"]()
+            entry["correct"] = bool(ok)
+            entry["check"] = detail
+        results.append(entry)
+        print(_format_line(entry))
+    return results
+
+
+def _format_line(entry):
+    parts = [f"{entry['name']:<50}"]
+    if "latency_ms" in entry:
+        parts.append(f"{entry['latency_ms']:10.3f} ms")
+        eps = entry["evals_per_sec"]
+        parts.append(f"{eps / 1e6:8.2f} M評価/秒" if eps else " " * 15)
+        parts.append(f"{entry['peak_memory_kb']:10.0f} KB")
+    if "correct" in entry:
+        parts.append(("OK " if entry["correct"] else "NG ") + entry["check"])
+    return "  ".join(parts)
+
+
+def compare(results, old_path):
+    """以前の結果との速度比（old / new。1 より大きければ速くなった）"""
+    with open(old_path, encoding="utf-8") as f:
+        old = {r["name"]: r for r in json.load(f)["results"]}
+    print(f"\n--- {old_path} との比較（速度比 = 旧 / 新）---")
+    for entry in results:
+        prev = old.get(entry["name"])
+        if prev is None or "latency_ms" not in entry or "latency_ms" not in prev:
+            continue
+        ratio = prev["latency_ms"] / entry["latency_ms"]
+        print(f"{entry['name']:<50} {prev['latency_ms']:10.3f} → {entry['latency_ms']:10.3f} ms  x{ratio:.2f}")
+
+
+def save(results, path=None):
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"bench_{datetime.datetime.now():%Y%m%d-%H%M%S}.json")
+    meta = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "seed": SEED,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=2, ensure_ascii=False)
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="勝率・役判定カーネルのマイクロベンチマーク")
+    parser.add_argument("--quick", action="store_true", help="繰り返し回数を 1/5 にする")
+    parser.add_argument("--only", help="名前にこの文字列を含むカーネルだけ計測する")
+    parser.add_argument("--output", help="結果 JSON の保存先（省略時は bench_results/bench_日時.json）")
+    parser.add_argument("--compare", help="比較する以前の結果 JSON")
+    parser.add_argument("--update-golden", action="store_true", help="正解表を作り直して終了する")
+    args = parser.parse_args(argv)
+
+    if args.update_golden:
+        print(f"💾 保存先: {update_golden()}")
+        return
+
+    results = run(quick=args.quick, only=args.only)
+    path = save(results, args.output)
+    print(f"\n💾 保存先: {path}")
+    if args.compare:
+        compare(results, args.compare)
+    if any(r.get("correct") is False for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
-import eval7
-from turn_generator import convert_rank_to_value
+import numpy as np
+
+import cards
 
 def classify_flop_turn_pattern(flop, turn, river=None):
     board = flop + [turn]
@@ -9,47 +10,104 @@ def classify_flop_turn_pattern(flop, turn, river=None):
     if any(card is None for card in board):
         return []
 
-    suits = [str(card)[1] for card in board]
-    ranks = [str(card)[0] for card in board]
-    rank_vals = sorted([convert_rank_to_value(r) for r in ranks])
-    rank_set = set(rank_vals)
-    unique_vals = sorted(rank_set)
-
-    features = []
-
-    # --- スート系 ---
-    suit_counts = {s: suits.count(s) for s in set(suits)}
-    max_suit_count = max(suit_counts.values())
-
-    if max_suit_count == 5:
-        features.append("monotone")
-    elif max_suit_count == 4:
-        features.append("two_tone")
-    else:
-        features.append("rainbow")
-
-    if max_suit_count >= 3:
-        features.append("three_flush")
-    if max_suit_count >= 4:
-        features.append("flush_draw")
-    # flush_complete は削除
-
-    # --- ストレートドロー（4連番のみ） ---
-    for i in range(len(unique_vals) - 3):
-        subset = unique_vals[i:i+4]
-        if subset[-1] - subset[0] == 3:  # 4連番
-            features.append("straight_draw")
-
-    # --- ガットショット4枚 ---
-    for i in range(len(unique_vals) - 3):
-        subset = unique_vals[i:i+4]
-        if subset[-1] - subset[0] == 4:
-            features.append("gutshot_draw_4")
-
-    # --- 3連番チェック ---
-    for i in range(len(unique_vals) - 2):
-        if unique_vals[i+1] == unique_vals[i]+1 and unique_vals[i+2] == unique_vals[i]+2:
+    return texture_features(texture_state(board))
+
+# ========= 差分計算用のテクスチャ状態 =========
+# 特徴はボードの「スートごとの枚数の最大値」と「出ているランクの集合（13 ビット）」だけで決まる。
+# 状態 = (スートごとの枚数 4 つ, ランクマスク)。1 枚足すのは O(1) で、
+# 特徴リストは (最大スート枚数, ランクマスク) ごとに 1 回だけ作って使い回す。
+
+def _rank_window_counts():
+    """ランクマスク（0〜8191）ごとの (4連番の数, ガットショット4枚の数, 3連番の有無)"""
+    masks = np.arange(1 << 13)
+    bit = lambda r: (masks >> r) & 1
+    straight = np.zeros(1 << 13, dtype=np.int64)
+    gutshot = np.zeros(1 << 13, dtype=np.int64)
+    three = np.zeros(1 << 13, dtype=bool)
+    for r in range(13):
+        if r + 2 < 13:
+            three |= (bit(r) & bit(r + 1) & bit(r + 2)).astype(bool)
+        if r + 3 < 13:
+            straight += bit(r) & bit(r + 1) & bit(r + 2) & bit(r + 3)
+        if r + 4 < 13:
+            # 両端あり・間の 3 つのうち 2 つあり（= 並んだ 4 値で幅 4）
+            gutshot += bit(r) & bit(r + 4) & ((bit(r + 1) + bit(r + 2) + bit(r + 3)) == 2)
+    return straight, gutshot, three
+
+_STRAIGHT_DRAWS, _GUTSHOTS, _THREE_STRAIGHT = _rank_window_counts()
+_features_memo = {}
+
+def texture_state(board):
+    """ボード（文字列・eval7.Card・コード）→ テクスチャ状態 (スート枚数のタプル, ランクマスク)"""
+    suit_counts = [0, 0, 0, 0]
+    rank_mask = 0
+    for c in cards.to_cards(board):
+        suit_counts[c.suit] += 1
+        rank_mask |= 1 << c.rank
+    return tuple(suit_counts), rank_mask
+
+def add_card(state, card):
+    """状態に 1 枚足した状態"""
+    c = cards.card(card)
+    suit_counts, rank_mask = state
+    suit_counts = list(suit_counts)
+    suit_counts[c.suit] += 1
+    return tuple(suit_counts), rank_mask | 1 << c.rank
+
+def _features_for(max_suit, rank_mask):
+    key = (max_suit, rank_mask)
+    features = _features_memo.get(key)
+    if features is None:
+        if max_suit == 5:
+            features = ["monotone"]
+        elif max_suit == 4:
+            features = ["two_tone"]
+        else:
+            features = ["rainbow"]
+        if max_suit >= 3:
+            features.append("three_flush")
+        if max_suit >= 4:
+            features.append("flush_draw")
+        features += ["straight_draw"] * int(_STRAIGHT_DRAWS[rank_mask])
+        features += ["gutshot_draw_4"] * int(_GUTSHOTS[rank_mask])
+        if _THREE_STRAIGHT[rank_mask]:
             features.append("three_straight")
-            break
+        features = tuple(features)
+        _features_memo[key] = features
+    return list(features)
+
+def texture_features(state):
+    """状態の特徴リスト（classify_flop_turn_pattern と同じ並び・重複も同じ）"""
+    suit_counts, rank_mask = state
+    return _features_for(max(suit_counts), rank_mask)
+
+def extend_texture(state, card, parent_features=None):
+    """
+    1 枚足した (状態, 新しく付いた特徴) を返す。
+    新しい特徴 = 子の特徴のうち parent_features に含まれないもの（重複はそのまま残す）。
+    parent_features 省略時は state の特徴を使う。
+    """
+    if parent_features is None:
+        parent_features = texture_features(state)
+    child = add_card(state, card)
+    return child, [f for f in texture_features(child) if f not in parent_features]
+
+def new_features_bulk(state, child_cards, parent_features=None):
+    """
+    extend_texture の一括版。子カード（44〜49 枚など）それぞれの新しい特徴のリストを返す。
+    最大スート枚数とランクマスクを numpy でまとめて求め、同じ組み合わせは 1 回だけ判定する。
+    """
+    if parent_features is None:
+        parent_features = texture_features(state)
+    suit_counts, rank_mask = state
+    codes = np.array([cards.code(c) for c in child_cards], dtype=np.int64)
+    counts = np.asarray(suit_counts, dtype=np.int64)
+    max_suits = np.maximum(counts.max(), counts[cards.SUIT_OF[codes]] + 1)
+    rank_masks = rank_mask | (1 << cards.RANK_OF[codes])
+    keys = max_suits * (1 << 13) + rank_masks
 
-    return features  # ペアボード判定は完全削除
+    new_by_key = {}
+    for key in np.unique(keys).tolist():
+        feats = _features_for(key >> 13, key & 0x1FFF)
+        new_by_key[key] = [f for f in feats if f not in parent_features]
+    return [list(new_by_key[k]) for k in keys.tolist()]
@@ -1,33 +1,92 @@
 import eval7
+import itertools
 import random
-from extract_features import extract_features_for_flop, extract_features_for_turn, extract_features_for_river
-from preflop_winrate_dict import get_static_preflop_winrate
-from hand_utils import detect_made_hand  # 役を取得
+import numpy as np
+import batch_eval
+import cards
+import flop_index
+import mc_stats
+from deck_sampler import DeckSampler
+from hand_range import as_range
+from board_patterns import classify_flop_turn_pattern
+from made_hand import classify_made_hand  # 役を取得
+from preflop_winrates_random import get_static_preflop_winrate
 
-def calculate_equity(hero, board, opp_hands, iters=1000):
-    hero_wins = 0
-    for _ in range(iters):
-        deck = eval7.Deck()
-        used = hero + board
-        for card in used:
-            deck.cards.remove(card)
-        opp_hand = random.choice(opp_hands)
-        for card in opp_hand:
-            deck.cards.remove(card)
-        remaining = 5 - len(board)
-        board_sample = list(board)
-        board_sample += deck.sample(remaining)
-        hero_score = eval7.evaluate(hero + board_sample)
-        opp_score = eval7.evaluate(opp_hand + board_sample)
+def calculate_equity(hero, board, opp_hands, iters=1000, tolerance=None, engine="eval7"):
+    """
+    opp_hands: 相手レンジ。hand_range.HandRange / レンジ文字列（例: "QQ+, AKs, AQo:0.5"）/
+               eval7.Card 2枚組のリスト のいずれか。重みに比例して相手ハンドを選ぶ。
+    ボードやヒーローと重なるコンボは除外する。
+    tolerance（標準誤差, %ポイント）を指定すると iters を上限にバッチ単位で打ち切る。
+    """
+    return calculate_equity_stats(hero, board, opp_hands, iters, tolerance, engine).equity
+
+def calculate_equity_stats(hero, board, opp_hands, iters=1000, tolerance=None, engine="eval7"):
+    """calculate_equity と同じ計算を mc_stats.EquityStats で返す"""
+    combos, weights = as_range(opp_hands).live(hero + board)
+    if len(combos) == 0:
+        raise ValueError("相手レンジにヒーロー・ボードと重ならないコンボがありません")
+    if engine == "numpy":
+        sample = lambda n: _sample_equity_numpy(hero, board, combos, weights, n)
+    else:
+        sample = lambda n: _sample_equity(hero, board, combos, weights, n)
+    return mc_stats.run_adaptive(sample, iters, tolerance)
+
+def _sample_equity(hero, board, combos, weights, iters):
+    wins = ties = 0
+    sampler = DeckSampler(hero + board)
+    remaining = 5 - len(board)
+    hero7 = hero + board + [None] * remaining
+    opp7 = [None, None] + board + [None] * remaining
+    base = 2 + len(board)
+    opp_cards = [(cards.CARDS[a], cards.CARDS[b]) for a, b in combos]
+    picks = random.choices(range(len(combos)), cum_weights=list(itertools.accumulate(weights)), k=iters)
+    for k in picks:
+        opp_hand = opp_cards[k]
+        # 相手の2枚は試行ごとに変わるので、引く対象から除外する
+        buf = sampler.draw(remaining, exclude=opp_hand)
+        opp7[0], opp7[1] = opp_hand
+        for i in range(remaining):
+            hero7[base + i] = opp7[base + i] = buf[i]
+        hero_score = eval7.evaluate(hero7)
+        opp_score = eval7.evaluate(opp7)
         if hero_score > opp_score:
-            hero_wins += 1
+            wins += 1
         elif hero_score == opp_score:
-            hero_wins += 0.5
-    return hero_wins / iters * 100
+            ties += 1
+    return wins, ties
+
+def _sample_equity_numpy(hero, board, combos, weights, iters):
+    rng = batch_eval.make_rng()
+    live = batch_eval.live_codes(hero + board)
+    picks = rng.choice(len(combos), size=iters, p=weights / weights.sum())
+    opp = combos[picks]
+
+    # 相手の2枚を除いた位置から引き、live 上の位置へずらす（コンボは昇順なので first < second）
+    first = np.searchsorted(live, opp[:, 0])[:, None]
+    second = np.searchsorted(live, opp[:, 1])[:, None]
+    remaining = 5 - len(board)
+    idx = batch_eval.sample_without_replacement(np.arange(len(live) - 2), iters, remaining, rng)
+    idx = idx + (idx >= first)
+    idx = idx + (idx >= second)
+    runouts = live[idx]
+
+    board_codes = np.broadcast_to(batch_eval.cards_to_codes(board), (iters, len(board)))
+    hero_scores = batch_eval.evaluate_batch(np.column_stack(
+        [np.broadcast_to(batch_eval.cards_to_codes(hero), (iters, 2)), board_codes, runouts]))
+    opp_scores = batch_eval.evaluate_batch(np.column_stack([opp, board_codes, runouts]))
+    return batch_eval.outcome_counts(hero_scores, opp_scores)
+
+def _hand_class(hand_str):
+    """'AhKd' → 'AKo'（プリフロップ勝率表のキー）"""
+    r1, s1, r2, s2 = hand_str[0], hand_str[1], hand_str[2], hand_str[3]
+    if r1 == r2:
+        return r1 + r2
+    return r1 + r2 + ("s" if s1 == s2 else "o")
 
 def simulate_shift_flop(hand_str, flop_list, opp_hands, iters=1000):
     hero = [eval7.Card(hand_str[0:2]), eval7.Card(hand_str[2:4])]
-    preflop = get_static_preflop_winrate(hand_str)
+    preflop = get_static_preflop_winrate(_hand_class(hand_str))
     total_shift = 0
     features_count = {}
     for flop in flop_list:
@@ -35,7 +94,7 @@ def simulate_shift_flop(hand_str, flop_list, opp_hands, iters=1000):
         equity = calculate_equity(hero, flop_cards, opp_hands, iters)
         shift = equity - preflop
         total_shift += shift
-        features = extract_features_for_flop(flop)
+        features = flop_index.get_index().flop_features(flop)
         for feat in features:
             features_count[feat] = features_count.get(feat, []) + [shift]
     avg_shift = total_shift / len(flop_list)
@@ -60,8 +119,8 @@ def simulate_shift_turn_with_ranking(hand_str, flop_list, opp_hands, iters=1000)
             board = flop_cards + [turn]
             equity = calculate_equity(hero, board, opp_hands, iters)
             shift = round(equity - base_equity, 1)
-            features = extract_features_for_turn(board)
-            made_hand = detect_made_hand(hero, board)
+            features = classify_flop_turn_pattern(flop_cards, turn)
+            made_hand = classify_made_hand(hero, board)
 
             all_turns.append({
                 'turn_card': str(turn),
@@ -89,9 +148,7 @@ def simulate_shift_river_with_ranking(hand_str, flop_list, opp_hands, iters=1000
             deck.cards.remove(card)
 
         turn = random.choice(deck)
-        used.append(turn)
-        for card in used:
-            deck.cards.remove(card)
+        deck.cards.remove(turn)
 
         base_equity = calculate_equity(hero, flop_cards + [turn], opp_hands, iters)
 
@@ -99,8 +156,8 @@ def simulate_shift_river_with_ranking(hand_str, flop_list, opp_hands, iters=1000
             board = flop_cards + [turn, river]
             equity = calculate_equity(hero, board, opp_hands, iters)
             shift = round(equity - base_equity, 1)
-            features = extract_features_for_river(board)
-            made_hand = detect_made_hand(hero, board)
+            features = classify_flop_turn_pattern(flop_cards, turn, river)
+            made_hand = classify_made_hand(hero, board)
 
             all_rivers.append({
                 'river_card': str(river),
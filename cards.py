@@ -0,0 +1,85 @@
+# cards.py
+#
+# カード表現の共通モジュール。
+# - 0〜51 の整数コード（suit*13 + rank。eval7.Card.mask のビット位置と一致）
+# - 64 ビット整数のカード集合マスク（使用済みカードの除外・所属判定をビット演算で行う）
+# - 使い回す eval7.Card オブジェクト（文字列から毎回作り直さない）
+# - コード → ランク/スートの配列
+
+import eval7
+import numpy as np
+
+RANKS = '23456789TJQKA'
+SUITS = 'cdhs'  # eval7 のスート番号順
+
+# ランク文字 → 値（2〜14, A=14）
+RANK_VALUES = {r: i + 2 for i, r in enumerate(RANKS)}
+
+# eval7.Deck と同じ並び（2c, 2d, 2h, 2s, 3c, ...）の 52 枚
+DECK = tuple(eval7.Deck())
+
+# コード順の eval7.Card と、文字列 → eval7.Card の表
+CARDS = tuple(sorted(DECK, key=lambda c: c.suit * 13 + c.rank))
+_BY_STR = {str(c): c for c in DECK}
+
+# コード → ランク(0〜12) / スート(0〜3) / ランク値(2〜14)
+RANK_OF = np.arange(52, dtype=np.int64) % 13
+SUIT_OF = np.arange(52, dtype=np.int64) // 13
+VALUE_OF = RANK_OF + 2
+
+FULL_MASK = (1 << 52) - 1
+
+
+def rank_value(rank):
+    """
+    ランクを値（2〜14, A=14）に変換する。
+    ランク文字（'A', 't' など）と eval7.Card.rank（0〜12）のどちらでも受け付ける。
+    """
+    if isinstance(rank, (int, np.integer)):
+        return int(rank) + 2
+    return RANK_VALUES.get(str(rank).upper(), 0)
+
+
+def card(c):
+    """文字列・コード・eval7.Card のいずれからも共通の eval7.Card を返す"""
+    if isinstance(c, eval7.Card):
+        return c
+    if isinstance(c, (int, np.integer)):
+        return CARDS[c]
+    s = str(c)
+    if s in _BY_STR:
+        return _BY_STR[s]
+    return eval7.Card(s)  # 不正な文字列は eval7 の例外をそのまま出す
+
+
+def to_cards(cs):
+    """card() のリスト版"""
+    return [card(c) for c in cs]
+
+
+def code(c):
+    """eval7.Card（または文字列）→ 0〜51 の整数コード"""
+    if not isinstance(c, eval7.Card):
+        c = card(c)
+    return c.suit * 13 + c.rank
+
+
+def mask(cs):
+    """カードの集合 → 64 ビット整数マスク"""
+    m = 0
+    for c in cs:
+        m |= (c if isinstance(c, eval7.Card) else card(c)).mask
+    return m
+
+
+def mask_to_cards(m):
+    """マスク → eval7.Card のリスト（DECK の並び）"""
+    return [c for c in DECK if c.mask & m]
+
+
+def live_cards(dead):
+    """
+    使用済みカード（カードの並び、またはマスク）を除いた残りデッキ（DECK の並び）。
+    """
+    dead_mask = dead if isinstance(dead, int) else mask(dead)
+    return [c for c in DECK if not c.mask & dead_mask]
@@ -0,0 +1,93 @@
+# crn.py
+#
+# 共通乱数（common random numbers）による標本化。
+# 兄弟局面（同じフロップの全ターン・全リバー、同じボードの別ハンド）で同じ相手ハンド・
+# ランアウトの標本を使い回し、シフト（勝率の差）や局面の順位の分散を下げる。
+#
+# 1 試行 = 52 枚の一様ランダムな並び。局面ごとの標本は、並びの先頭から使用済みカード
+# （ヒーロー・ボード）を飛ばして必要な枚数を取ったもの（使用済みカードの付け替え）。
+# どの局面でも生きているカードからの一様な非復元抽出なので推定は不偏のまま、
+# 使用済みカードが違う所以外は同じ標本になる。
+# 並びは (crn_seed, フロップ) だけから決めるので、別のハンド・別プロセスでも同じになる。
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import batch_eval
+import cards
+import mc_stats
+import multiway
+
+
+class SharedDraws:
+    """n 試行分の 52 枚の並び（order: (n, 52) のカードコード）"""
+
+    def __init__(self, n, rng):
+        self.order = np.argsort(rng.random((n, 52)), axis=1).astype(np.int8)
+
+    def __len__(self):
+        return len(self.order)
+
+    def draw(self, dead_cards, k, start=0, stop=None):
+        """
+        試行 start〜stop の、dead_cards を飛ばした先頭 k 枚（(試行数, k) のコード配列）。
+        使用済みカードは高々 dead 枚なので、並びの先頭 k + dead 枚だけ見ればよい。
+        """
+        dead = cards.mask(dead_cards)
+        width = min(52, k + bin(dead).count("1"))
+        prefix = self.order[start:stop, :width].astype(np.int64)
+        is_dead = (np.uint64(dead) >> prefix.astype(np.uint64)) & np.uint64(1)
+        idx = np.argsort(is_dead, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(prefix, idx, axis=1)
+
+
+_shared = OrderedDict()
+_lock = threading.Lock()
+_MAX_SHARED = 8
+
+
+def shared_draws(flop_cards, n, crn_seed):
+    """(crn_seed, フロップ) で決まる n 試行分の共通の並び（プロセス内で直近のものを使い回す）"""
+    flop_mask = cards.mask(flop_cards)
+    key = (flop_mask, n, crn_seed)
+    with _lock:
+        draws = _shared.get(key)
+        if draws is not None:
+            _shared.move_to_end(key)
+            return draws
+    seed = int.from_bytes(hashlib.sha256(repr(("crn", crn_seed, flop_mask)).encode()).digest()[:8], "little")
+    draws = SharedDraws(n, np.random.default_rng(seed))
+    with _lock:
+        _shared[key] = draws
+        while len(_shared) > _MAX_SHARED:
+            _shared.popitem(last=False)
+    return draws
+
+
+def equity_stats(hero, board, shared, opponents=1, max_samples=None, tolerance=None, river_table=None,
+                 stats=None):
+    """
+    共通の並び shared から標本を取り、相手 opponents 人に対する勝率を mc_stats.ShareStats で返す。
+    試行は並びの先頭から順に使う（tolerance で打ち切っても兄弟局面と同じ先頭部分を使う）。
+    stats（ShareStats）を渡すと、並びの stats.samples 番目の試行から続きを足す。
+    評価は batch_eval による一括評価（エンジン指定によらない）。
+    """
+    max_samples = min(max_samples or len(shared), len(shared))
+    k = 2 * opponents + 5 - len(board)
+    dead = list(hero) + list(board)
+    if len(board) == 5 and river_table is None:
+        river_table = multiway.river_score_table(batch_eval.live_codes(dead), batch_eval.cards_to_codes(board))
+    if stats is None:
+        stats = mc_stats.ShareStats()
+    cursor = [stats.samples]
+
+    def sample(n):
+        start = cursor[0]
+        cursor[0] += n
+        drawn = shared.draw(dead, k, start, start + n)
+        return multiway.sample_shares(hero, board, opponents, n, river_table=river_table, drawn=drawn)
+
+    return mc_stats.run_adaptive(sample, max_samples, tolerance, batch_size=1000, stats=stats)
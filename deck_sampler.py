@@ -0,0 +1,62 @@
+# deck_sampler.py
+#
+# モンテカルロ用の共通デッキサンプラー。
+# 局面（使用済みカード）ごとに生きているカードの配列を 1 回だけ作り、
+# 1 試行ごとにはデッキを作り直さず、部分 Fisher–Yates で必要枚数だけ引く。
+# NumPy エンジン向けにはまとめて (n, k) のコード配列を引く draw_batch を持つ。
+
+import random
+
+import batch_eval
+import cards
+
+FULL_DECK = list(cards.DECK)
+
+
+class DeckSampler:
+    """
+    dead_cards を除いた残りデッキからの非復元抽出。
+    - draw(k): 内部バッファの先頭 k 枚を新しい抽出結果に並べ替えて返す（新しいリストは作らない）
+    - draw_batch(n, k): (n, k) のカードコード配列を返す（NumPy Generator）
+    rng（random.Random）を渡すとその乱数で引く（省略時は random モジュール）。
+    """
+
+    def __init__(self, dead_cards=(), rng=None):
+        dead = cards.mask(dead_cards)
+        self.live_cards = cards.live_cards(dead)
+        self.live_codes = batch_eval.live_codes(dead)
+        self.rng = rng
+        self._buf = list(self.live_cards)
+
+    def __len__(self):
+        return len(self._buf)
+
+    def draw(self, k, exclude=()):
+        """
+        部分 Fisher–Yates で k 枚引き、バッファ（先頭 k 枚が結果）を返す。
+        exclude のカード（相手ハンドなど試行ごとに変わる使用済みカード）は引かない。
+        返すバッファは次の draw で上書きされる。
+        """
+        buf = self._buf
+        n = len(buf)
+        rand = (random if self.rng is None else self.rng).random
+        i = 0
+        while i < k:
+            j = i + int(rand() * (n - i))
+            card = buf[j]
+            buf[j] = buf[i]
+            buf[i] = card
+            if exclude and card in exclude:
+                # 除外カードは末尾側へ退避し、この位置を引き直す
+                n -= 1
+                buf[i] = buf[n]
+                buf[n] = card
+                continue
+            i += 1
+        return buf
+
+    def draw_batch(self, n, k, rng=None):
+        """n 回分の k 枚抽出をまとめて (n, k) のカードコード配列で返す（rng は NumPy Generator）"""
+        if rng is None:
+            rng = batch_eval.make_rng(self.rng)
+        return batch_eval.sample_without_replacement(self.live_codes, n, k, rng)
@@ -1,18 +1,10 @@
 import itertools
-import random
+
+from cards import rank_value as convert_rank_to_value
 
 ranks = ['2', '3', '4', '5', '6', '7', '8', '9', 'T', 'J', 'Q', 'K', 'A']
 suits = ['h', 'd', 'c', 's']
 
-def convert_rank_to_value(rank_char: str) -> int:
-    """ランク文字を数値に変換（例: A=14, K=13）"""
-    rank_map = {
-        '2': 2, '3': 3, '4': 4, '5': 5, '6': 6,
-        '7': 7, '8': 8, '9': 9, 'T': 10,
-        'J': 11, 'Q': 12, 'K': 13, 'A': 14
-    }
-    return rank_map.get(rank_char.upper(), 0)
-
 def generate_all_flops():
     """52枚から3枚の全フロップを生成"""
     deck = [r + s for r in ranks for s in suits]
@@ -47,11 +39,7 @@ def classify_flop(flop):
 def generate_flops_by_type(flop_type, count=10):
     """
     指定したフロップタイプに一致するものから最大 count 個のフロップを返す
+    （flop_index の構築済み索引から引く。flop_index が本モジュールを使うので関数内で import）
     """
-    all_flops = generate_all_flops()
-    matched = [f for f in all_flops if classify_flop(f) == flop_type]
-
-    if not matched:
-        raise ValueError(f"No flops matched type: {flop_type}")
-
-    return random.sample(matched, min(count, len(matched)))
+    import flop_index
+    return flop_index.get_index().sample(flop_type, count)
@@ -0,0 +1,106 @@
+# flop_index.py
+#
+# 全 22,100 フロップのテクスチャ索引（初回参照時に 1 回だけ作る）。
+# - フロップ（カード集合マスク）→ 行番号 の表
+# - 行ごとのカテゴリ（flop_generator.classify_flop）と特徴ビット列（extract_features_for_flop）
+# - カテゴリごとのメンバー一覧（flop_generator.generate_all_flops と同じ並び・同じ文字列タプル）
+# 判定は既存の関数をそのまま使うので結果は一致し、以後のラベル付け・抽出は表引きになる。
+
+import random
+import threading
+
+import numpy as np
+
+import cards
+from extract_features import extract_features_for_flop
+from flop_generator import classify_flop, generate_all_flops
+
+FLOP_TYPES = ("middle_monotone", "paired", "high_rainbow", "low_connected", "dry", "wet", "random")
+
+# extract_features_for_flop が返しうる特徴名（ビット位置 = 並び順）
+FEATURE_NAMES = (
+    "made_straight_flush", "made_flush", "made_straight", "monoboard", "2_flush_draw",
+    "flop_set", "flop_pair", "two_pair", "straight_draw_possible", "high_card_present",
+    "middle_board", "low_board", "dry_board", "wet_board",
+)
+_FEATURE_BIT = {name: 1 << i for i, name in enumerate(FEATURE_NAMES)}
+
+
+class FlopIndex:
+    """
+    flops     : 22,100 個のフロップ（文字列 3 枚のタプル）
+    codes     : (22100, 3) のカードコード
+    category  : (22100,) のカテゴリ番号（FLOP_TYPES の位置）
+    features  : (22100,) の特徴ビット列（FEATURE_NAMES の位置）
+    members   : {カテゴリ名: 行番号のリスト}
+    """
+
+    def __init__(self):
+        self.flops = generate_all_flops()
+        flop_cards = [cards.to_cards(f) for f in self.flops]
+        self.codes = np.array([[cards.code(c) for c in fc] for fc in flop_cards], dtype=np.int64)
+        self._row_of = {cards.mask(fc): i for i, fc in enumerate(flop_cards)}
+
+        type_id = {t: i for i, t in enumerate(FLOP_TYPES)}
+        self.category = np.array([type_id[classify_flop(f)] for f in self.flops], dtype=np.int8)
+        self.features = np.array(
+            [sum(_FEATURE_BIT[name] for name in extract_features_for_flop(fc)) for fc in flop_cards],
+            dtype=np.int32)
+        self.members = {t: np.flatnonzero(self.category == i).tolist() for i, t in enumerate(FLOP_TYPES)}
+
+    def row(self, flop):
+        """フロップ（文字列・eval7.Card・コードの 3 枚、順不同）→ 行番号"""
+        return self._row_of[cards.mask(flop)]
+
+    def flop_type(self, flop):
+        """classify_flop と同じカテゴリ名"""
+        return FLOP_TYPES[self.category[self.row(flop)]]
+
+    def flop_features(self, flop):
+        """extract_features_for_flop と同じ特徴名のリスト（同じ並び）"""
+        bits = int(self.features[self.row(flop)])
+        return [name for name in FEATURE_NAMES if bits & _FEATURE_BIT[name]]
+
+    def flops_of_type(self, flop_type):
+        """カテゴリのメンバー一覧（generate_all_flops の並び）"""
+        if flop_type not in self.members:
+            raise ValueError(f"Unknown flop type: {flop_type}")
+        return [self.flops[i] for i in self.members[flop_type]]
+
+    def sample(self, flop_type, count, rng=random):
+        """カテゴリから重複なしで最大 count 個"""
+        rows = self.members.get(flop_type)
+        if not rows:
+            raise ValueError(f"No flops matched type: {flop_type}")
+        return [self.flops[i] for i in rng.sample(rows, min(count, len(rows)))]
+
+    def stratified_sample(self, count, rng=random, flop_types=FLOP_TYPES):
+        """
+        カテゴリ間で均等に count 個を選ぶ（重複なし）。
+        各カテゴリ count // カテゴリ数 個、余りはカテゴリを無作為に選んで 1 個ずつ足す。
+        結果はカテゴリの並びではなく無作為な順に並べ替えて返す。
+        """
+        flop_types = list(flop_types)
+        per_type, extra = divmod(count, len(flop_types))
+        quota = {t: per_type for t in flop_types}
+        for t in rng.sample(flop_types, extra):
+            quota[t] += 1
+        picked = []
+        for t in flop_types:
+            picked.extend(self.sample(t, quota[t], rng) if quota[t] else [])
+        rng.shuffle(picked)
+        return picked
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def get_index():
+    """プロセスで共有する FlopIndex（初回のみ構築）"""
+    global _index
+    if _index is None:
+        with _lock:
+            if _index is None:
+                _index = FlopIndex()
+    return _index
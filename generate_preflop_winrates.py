@@ -1,8 +1,18 @@
 import eval7
-import random
-import copy
+import os
 import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
 import pandas as pd
+import batch_eval
+import mc_stats
+import multiway
+from deck_sampler import DeckSampler
+from preflop_winrates_random import (
+    TABLE_MAGIC, TABLE_VERSION, TABLE_HEADER, TABLE_RECORD, TABLE_PATH,
+    normalize_hand_key, reload_preflop_table, clear_multiway_tables,
+)
 
 def generate_all_169_hands():
     ranks = 'AKQJT98765432'
@@ -28,35 +38,64 @@ def hand_str_to_cards_precomputed(hand_str):
     else:
         return [eval7.Card(rank1 + 's'), eval7.Card(rank2 + 'h')]
 
-def monte_carlo_winrate_vs_random_optimized(my_hand, iterations):
+def monte_carlo_winrate_vs_random_optimized(my_hand, iterations, engine="eval7", tolerance=None, opponents=1):
+    """
+    tolerance（標準誤差, %ポイント）を指定すると iterations を上限にバッチ単位で打ち切る。
+    opponents: ランダムハンドの相手人数（2人以上は multiway で計算し、engine は使わない）
+    """
+    stats = monte_carlo_winrate_stats(my_hand, iterations, engine, tolerance, opponents)
+    return round(stats.equity, 2)
+
+def monte_carlo_winrate_stats(my_hand, iterations, engine="eval7", tolerance=None, opponents=1):
+    """
+    monte_carlo_winrate_vs_random_optimized と同じ計算を mc_stats.EquityStats
+    （相手が複数人なら mc_stats.ShareStats）で返す
+    """
+    if opponents > 1:
+        return multiway.equity_stats(my_hand, [], opponents, iterations, tolerance)
+    if engine == "numpy":
+        sample = lambda n: _sample_winrate_numpy(my_hand, n)
+    else:
+        sample = lambda n: _sample_winrate(my_hand, n)
+    return mc_stats.run_adaptive(sample, iterations, tolerance)
+
+def _sample_winrate(my_hand, iterations):
     wins, ties = 0, 0
-    base_deck = eval7.Deck()
-    base_deck.cards = [card for card in base_deck.cards if card not in my_hand]
+    sampler = DeckSampler(my_hand)
+    my7 = list(my_hand) + [None] * 5
+    opp7 = [None] * 7
 
     for _ in range(iterations):
-        deck = copy.copy(base_deck.cards)
-        random.shuffle(deck)
-        opp_hand = deck[:2]
-        board = deck[2:7]
+        buf = sampler.draw(7)
+        opp7[:] = buf[:7]
+        my7[2:] = buf[2:7]
 
-        my_score = eval7.evaluate(my_hand + board)
-        opp_score = eval7.evaluate(opp_hand + board)
+        my_score = eval7.evaluate(my7)
+        opp_score = eval7.evaluate(opp7)
 
         if my_score > opp_score:
             wins += 1
         elif my_score == opp_score:
             ties += 1
 
-    return round((wins + ties / 2) / iterations * 100, 2)
+    return wins, ties
+
+def _sample_winrate_numpy(my_hand, iterations):
+    drawn = DeckSampler(my_hand).draw_batch(iterations, 7)
+    board = drawn[:, 2:]
+    my_scores = batch_eval.evaluate_batch(np.column_stack(
+        [np.broadcast_to(batch_eval.cards_to_codes(my_hand), (iterations, 2)), board]))
+    opp_scores = batch_eval.evaluate_batch(drawn)
+    return batch_eval.outcome_counts(my_scores, opp_scores)
 
-def calculate_preflop_winrates(trials=100000):
+def calculate_preflop_winrates(trials=100000, engine="eval7", opponents=1):
     hands = generate_all_169_hands()
     data = []
     start = time.time()
 
     for i, hand in enumerate(hands, 1):
         my_hand = hand_str_to_cards_precomputed(hand)
-        winrate = monte_carlo_winrate_vs_random_optimized(my_hand, trials)
+        winrate = monte_carlo_winrate_vs_random_optimized(my_hand, trials, engine, opponents=opponents)
         data.append({"hand": hand, "winrate": winrate})
         print(f"[{i}/169] {hand}: {winrate}%")
 
@@ -65,20 +104,100 @@ def calculate_preflop_winrates(trials=100000):
     return pd.DataFrame(data)
 
 # ✅ Streamlit進捗表示対応版（別関数）
-def calculate_preflop_winrates_streamlit(trials=100000, update_func=None):
+def calculate_preflop_winrates_streamlit(trials=100000, update_func=None, engine="eval7", opponents=1):
     hands = generate_all_169_hands()
     data = []
     start = time.time()
 
     for i, hand in enumerate(hands, 1):
         my_hand = hand_str_to_cards_precomputed(hand)
-        winrate = monte_carlo_winrate_vs_random_optimized(my_hand, trials)
+        winrate = monte_carlo_winrate_vs_random_optimized(my_hand, trials, engine, opponents=opponents)
         data.append({"hand": hand, "winrate": winrate})
         if update_func:
             update_func(i, hand, winrate)
 
     return pd.DataFrame(data)
 
+# ==== 相手ハンド全列挙版（プロセスプール並列・バイナリテーブル出力） ====
+
+def enumerate_preflop_equity(hand, boards_per_combo=100, seed=0, chunk=64):
+    """
+    相手ハンド 1225 通りを全列挙し、各組み合わせに boards_per_combo 枚ずつ
+    ボードを割り当てて勝率を求める（相手側の偏りがなく、シードで結果が固定される）。
+    ボードまで完全列挙すると 1 ハンドあたり約 21 億評価になるため、ボードのみ標本化する。
+    """
+    my_hand = hand_str_to_cards_precomputed(hand)
+    hero = batch_eval.cards_to_codes(my_hand)
+    live = batch_eval.live_codes(my_hand)
+    combos = batch_eval.combination_indices(len(live), 2)
+    rng = np.random.default_rng([seed, zlib.crc32(normalize_hand_key(hand).encode())])
+
+    wins = ties = total = 0
+    for start in range(0, len(combos), chunk):
+        opp_idx = np.repeat(combos[start:start + chunk], boards_per_combo, axis=0)
+        n = len(opp_idx)
+
+        # 相手の2枚を除いた 48 枚からボード5枚を引く
+        keys = rng.random((n, len(live)))
+        keys[np.arange(n), opp_idx[:, 0]] = np.inf
+        keys[np.arange(n), opp_idx[:, 1]] = np.inf
+        board = live[np.argpartition(keys, 4, axis=1)[:, :5]]
+
+        my_scores = batch_eval.evaluate_batch(np.column_stack([np.broadcast_to(hero, (n, 2)), board]))
+        opp_scores = batch_eval.evaluate_batch(np.column_stack([live[opp_idx], board]))
+        w, t = batch_eval.outcome_counts(my_scores, opp_scores)
+        wins += w
+        ties += t
+        total += n
+
+    return round((wins + ties / 2) / total * 100, 2)
+
+def multiway_preflop_equity(hand, opponents, boards_per_combo=100, seed=0):
+    """
+    相手 opponents 人（ランダムハンド）に対するプリフロップ勝率。
+    相手の組み合わせは全列挙できないので、ヘッズアップ版と同じ総数
+    （1225 × boards_per_combo）の試行を multiway で標本化する（シードで結果が固定される）。
+    """
+    rng = np.random.default_rng([seed, opponents, zlib.crc32(normalize_hand_key(hand).encode())])
+    my_hand = hand_str_to_cards_precomputed(hand)
+    return round(multiway.equity(my_hand, [], opponents, 1225 * boards_per_combo, rng=rng), 2)
+
+def calculate_preflop_table(boards_per_combo=100, workers=None, seed=0, update_func=None, opponents=1):
+    """
+    169 ハンドの勝率をプロセスプールで並列計算して DataFrame(hand, winrate) を返す。
+    update_func(i, hand, winrate) は完了順に呼ばれる（進捗表示用）。
+    opponents が 2 以上なら multiway_preflop_equity で相手複数人の勝率を求める。
+    """
+    hands = [normalize_hand_key(h) for h in generate_all_169_hands()]
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        if opponents > 1:
+            futures = {pool.submit(multiway_preflop_equity, hand, opponents, boards_per_combo, seed): hand
+                       for hand in hands}
+        else:
+            futures = {pool.submit(enumerate_preflop_equity, hand, boards_per_combo, seed): hand
+                       for hand in hands}
+        for i, future in enumerate(as_completed(futures), 1):
+            hand = futures[future]
+            results[hand] = future.result()
+            if update_func:
+                update_func(i, hand, results[hand])
+
+    return pd.DataFrame([{"hand": h, "winrate": results[h]} for h in hands])
+
+def save_preflop_table(df, path=TABLE_PATH, boards_per_combo=100):
+    """DataFrame(hand, winrate) をバージョン付きバイナリテーブルとして保存する"""
+    samples = 1225 * boards_per_combo
+    with open(path, "wb") as f:
+        f.write(TABLE_HEADER.pack(TABLE_MAGIC, TABLE_VERSION, len(df), samples))
+        for hand, wr in zip(df["hand"], df["winrate"]):
+            f.write(TABLE_RECORD.pack(hand.encode("ascii"), int(round(float(wr) * 100))))
+    if os.path.abspath(path) == TABLE_PATH:
+        reload_preflop_table(path)
+    else:
+        clear_multiway_tables()
+    return path
+
 def calculate_all_winrates_montecarlo(trials=100000):
     df = calculate_preflop_winrates(trials)
     filename = f"preflop_winrates_random_{trials}.csv"
@@ -86,4 +205,8 @@ def calculate_all_winrates_montecarlo(trials=100000):
     print(f"💾 保存先: {filename}")
 
 if __name__ == "__main__":
-    calculate_all_winrates_montecarlo(trials=100000)
+    start = time.time()
+    df = calculate_preflop_table(update_func=lambda i, h, wr: print(f"[{i}/169] {h}: {wr}%"))
+    path = save_preflop_table(df)
+    print(f"\n✅ 完了：全169ハンド → {round(time.time() - start, 1)} 秒")
+    print(f"💾 保存先: {path}")
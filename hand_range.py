@@ -0,0 +1,167 @@
+# hand_range.py
+#
+# 重みつきの相手レンジ。
+# コンボ（カード2枚）ごとに重みを持ち、カードコード・カード集合マスクを前計算しておく。
+# ボードやヒーローのカードと重なるコンボはマスクのビット演算でまとめて除外する。
+#
+# レンジ文字列の例: "QQ+, AKs, AQo:0.5, KQ, T9s-76s, A5s-A2s, 22-55, AhKh"
+#   - "QQ+"      : QQ 以上のペア / "ATs+": A の下の札を K まで上げたもの
+#   - "T9s-76s"  : 同じ間隔のまま並んだハンドの範囲 / "22-55": ペアの範囲
+#   - "KQ"       : スーテッドとオフスーツの両方 / "AhKh": 個別のコンボ
+#   - ":0.5"     : 重み（省略時 1.0）
+
+import itertools
+
+import numpy as np
+
+import cards
+from hand_group_mapping import classify_hand_group, generate_all_169_hands
+
+
+def hand_class_combos(hand):
+    """'AKs' / 'AKo' / 'AK' / 'QQ' → カードコードの組のリスト（各組は昇順）"""
+    r1, r2 = cards.RANKS.index(hand[0]), cards.RANKS.index(hand[1])
+    kind = hand[2:]
+    combos = []
+    if r1 == r2:
+        for s1, s2 in itertools.combinations(range(4), 2):
+            combos.append((s1 * 13 + r1, s2 * 13 + r2))
+    else:
+        for s1 in range(4):
+            for s2 in range(4):
+                if (kind == "s" and s1 != s2) or (kind == "o" and s1 == s2):
+                    continue
+                combos.append((s1 * 13 + r1, s2 * 13 + r2))
+    return [tuple(sorted(c)) for c in combos]
+
+
+def _expand_token(token):
+    """レンジ文字列の 1 要素 → ハンドクラス（または個別コンボ）のリスト"""
+    if len(token) == 4 and token[1] in cards.SUITS and token[3] in cards.SUITS:
+        return [token]  # 個別コンボ 'AhKh'
+
+    if "-" in token:
+        hi, lo = token.split("-")
+        kind = hi[2:]
+        if hi[0] == hi[1]:  # ペアの範囲 '22-55'
+            a, b = sorted((cards.RANKS.index(hi[0]), cards.RANKS.index(lo[0])))
+            return [cards.RANKS[r] * 2 for r in range(a, b + 1)]
+        if hi[0] == lo[0]:  # 上の札固定 'A5s-A2s'
+            a, b = sorted((cards.RANKS.index(hi[1]), cards.RANKS.index(lo[1])))
+            return [hi[0] + cards.RANKS[r] + kind for r in range(a, b + 1)]
+        # 間隔固定 'T9s-76s'
+        gap = cards.RANKS.index(hi[0]) - cards.RANKS.index(hi[1])
+        a, b = sorted((cards.RANKS.index(hi[0]), cards.RANKS.index(lo[0])))
+        return [cards.RANKS[r] + cards.RANKS[r - gap] + kind for r in range(a, b + 1)]
+
+    if token.endswith("+"):
+        base = token[:-1]
+        if base[0] == base[1]:  # 'QQ+'
+            return [cards.RANKS[r] * 2 for r in range(cards.RANKS.index(base[0]), 13)]
+        top = cards.RANKS.index(base[0])  # 'ATs+' → AT, AJ, AQ, AK
+        return [base[0] + cards.RANKS[r] + base[2:] for r in range(cards.RANKS.index(base[1]), top)]
+
+    return [token]
+
+
+def hand_classes(text):
+    """
+    レンジ文字列（重み・個別コンボなし）→ ハンドクラス名のリスト（'AKs' / 'AKo' / 'QQ'、重複なし・出現順）。
+    スート指定のない 'KQ' は KQs と KQo の両方にする。
+    """
+    hands = []
+    for token in text.replace(" ", "").split(","):
+        if not token:
+            continue
+        for hand in _expand_token(token):
+            if len(hand) == 4 or hand[0] not in cards.RANKS or hand[1] not in cards.RANKS:
+                raise ValueError(f"ハンドクラスではありません: {hand}")
+            if cards.RANKS.index(hand[0]) < cards.RANKS.index(hand[1]):
+                hand = hand[1] + hand[0] + hand[2:]
+            if hand[0] == hand[1]:
+                names = [hand[:2]]
+            elif hand[2:] in ("s", "o"):
+                names = [hand]
+            else:
+                names = [hand[:2] + "s", hand[:2] + "o"]
+            hands.extend(h for h in names if h not in hands)
+    return hands
+
+
+class HandRange:
+    """
+    重みつきコンボの集合。
+    codes: (n, 2) のカードコード / weights: (n,) / masks: (n,) の 64 ビットマスク
+    """
+
+    def __init__(self, weights_by_combo):
+        items = sorted((tuple(sorted(c)), w) for c, w in weights_by_combo.items() if w > 0)
+        self.codes = np.array([c for c, _ in items], dtype=np.int64).reshape(-1, 2)
+        self.weights = np.array([w for _, w in items], dtype=float)
+        self.masks = (np.left_shift(np.uint64(1), self.codes[:, 0].astype(np.uint64))
+                      | np.left_shift(np.uint64(1), self.codes[:, 1].astype(np.uint64)))
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __repr__(self):
+        return f"HandRange({len(self)} combos, total weight {self.weights.sum():g})"
+
+    @classmethod
+    def from_string(cls, text):
+        """レンジ文字列（モジュール冒頭の書式）から作る"""
+        weights = {}
+        for token in text.replace(" ", "").split(","):
+            if not token:
+                continue
+            token, _, w = token.partition(":")
+            weight = float(w) if w else 1.0
+            for hand in _expand_token(token):
+                if len(hand) == 4:
+                    combos = [tuple(sorted((cards.code(hand[:2]), cards.code(hand[2:]))))]
+                else:
+                    combos = hand_class_combos(hand)
+                for c in combos:
+                    weights[c] = weight
+        return cls(weights)
+
+    @classmethod
+    def from_groups(cls, groups, weights=None):
+        """
+        hand_group_mapping.classify_hand_group のグループ名から作る。
+        weights: {グループ名: 重み}（省略時はすべて 1.0）
+        """
+        groups = set(groups)
+        weights = weights or {}
+        combo_weights = {}
+        for hand in generate_all_169_hands():
+            group = classify_hand_group(hand)
+            if group in groups:
+                for c in hand_class_combos(hand):
+                    combo_weights[c] = weights.get(group, 1.0)
+        return cls(combo_weights)
+
+    @classmethod
+    def from_hands(cls, hands):
+        """eval7.Card 2 枚組のリスト（従来の opp_hands）から重み 1 で作る"""
+        return cls({(cards.code(a), cards.code(b)): 1.0 for a, b in hands})
+
+    @classmethod
+    def random(cls):
+        """全 1326 コンボ（ランダムハンド）"""
+        return cls({c: 1.0 for c in itertools.combinations(range(52), 2)})
+
+    def live(self, dead_cards):
+        """dead_cards（カードの並び、またはマスク）と重ならないコンボの (codes, weights)"""
+        dead = dead_cards if isinstance(dead_cards, int) else cards.mask(dead_cards)
+        keep = (self.masks & np.uint64(dead)) == 0
+        return self.codes[keep], self.weights[keep]
+
+
+def as_range(opp):
+    """HandRange / レンジ文字列 / eval7.Card 2 枚組のリスト のいずれかを HandRange にする"""
+    if isinstance(opp, HandRange):
+        return opp
+    if isinstance(opp, str):
+        return HandRange.from_string(opp)
+    return HandRange.from_hands(opp)
@@ -0,0 +1,151 @@
+# importance.py
+#
+# 希少な newmade_* カテゴリを狙った重要度サンプリングによるフロップ選択。
+# newmade_quads_hc2 や newmade_straight_flush_hc1 などは一様ランダムなフロップではほとんど出ず、
+# 集計（shift_analysis）の平均が数件の標本で決まってしまう。
+# カテゴリの判定（役判定・ボード特徴）は勝率計算よりずっと軽いので、ハンドごとに全フロップについて
+# 「そのフロップの ShiftFlop・ShiftTurn の行にどのカテゴリが何件付くか」を先に数えておき
+# （category_profile。1 ハンド約 10 秒かかるので result_cache に保存する）、一様抽出では目標件数に届かないカテゴリの行を持つフロップを多めに引く
+# 提案分布 q を作る（proposal）。引いたフロップには重み w = p / q（p は一様分布）を付け、
+# カテゴリごとの平均は重み付きの比推定（shift_analysis.analyze_weighted）で一様抽出と同じ量を推定する。
+# q には一様分布を UNIFORM_SHARE の割合で混ぜる（defensive mixture）ので、重みは 1 / UNIFORM_SHARE 以下。
+# ShiftRiver の行はフロップの重みを引き継ぐ（ターンの選び方は一様のままなので推定は崩れない）。
+
+import functools
+from collections import Counter
+
+import numpy as np
+
+import board_patterns
+import cards
+import flop_index
+import result_cache
+from board_patterns import classify_flop_turn_pattern
+from hand_utils import hand_str_to_cards
+from made_hand import classify_made_hand
+from shift_analysis import category_key
+from simulate_shift_flop import flop_row_features
+from simulate_shift_turn import generate_turns, turn_features
+
+# 提案分布に混ぜる一様分布の割合（重みの上限 = 1 / UNIFORM_SHARE）
+UNIFORM_SHARE = 0.2
+
+
+class CategoryProfile:
+    """
+    flops  : ホールカードと重ならない全フロップ（文字列 3 枚のタプル。flop_index の並び）
+    names  : カテゴリ名（shift_analysis.category_key。役は newmade_xxx_hcN、特徴は newmade_xxx）
+    counts : (フロップ数, カテゴリ数) の行数。ShiftFlop の行と全ターンの ShiftTurn の行を数える
+    """
+
+    def __init__(self, flops, names, counts):
+        self.flops = flops
+        self.names = names
+        self.counts = counts
+
+    def totals(self):
+        """全フロップでのカテゴリごとの行数"""
+        return self.counts.sum(axis=0)
+
+
+def _flop_items(hole_cards, flop, made_preflop):
+    """1 フロップ分の ShiftFlop・ShiftTurn の行に付く newmade_* 項目（集計と同じく重複も数える）"""
+    # ShiftFlop は特徴ごとに 1 行（特徴別シフトの辞書なので重複しない）
+    items = list(dict.fromkeys(flop_row_features(hole_cards, flop, made_preflop)))
+    made_before, _ = classify_made_hand(hole_cards, flop)
+    feats_before = classify_flop_turn_pattern(flop, turn=None)
+    turns = generate_turns(flop, hole_cards)
+    new_feats_by_turn = board_patterns.new_features_bulk(board_patterns.texture_state(flop), turns, feats_before)
+    for turn, new_feats in zip(turns, new_feats_by_turn):
+        items += turn_features(hole_cards, flop + [turn], [turn], made_before, new_feats)[0]
+    return items
+
+
+@functools.lru_cache(maxsize=8)
+def category_profile(hand):
+    """
+    ハンドの CategoryProfile（全フロップ × 全ターンの判定で 1 ハンド約 10 秒）。
+    result_cache に保存し、再開や別プロセスでは読み込むだけにする。プロセス内でも使い回す。
+    """
+    hole_cards = hand_str_to_cards(hand)
+    return result_cache.cached("importance_profile", hand, hole_cards, [], (),
+                               lambda: _build_profile(hole_cards))
+
+
+def _build_profile(hole_cards):
+    """ホールカードと重ならない全フロップについてカテゴリごとの行数を数える"""
+    hole_mask = cards.mask(hole_cards)
+    made_preflop, _ = classify_made_hand(hole_cards, [])
+
+    flops, rows = [], []
+    for flop_str in flop_index.get_index().flops:
+        flop = cards.to_cards(flop_str)
+        if cards.mask(flop) & hole_mask:
+            continue
+        counts = Counter(category_key(item) for item in _flop_items(hole_cards, flop, made_preflop))
+        counts.pop(None, None)
+        flops.append(flop_str)
+        rows.append(counts)
+
+    names = sorted({name for counts in rows for name in counts})
+    column = {name: j for j, name in enumerate(names)}
+    matrix = np.zeros((len(flops), len(names)), dtype=np.int32)
+    for i, counts in enumerate(rows):
+        for name, n in counts.items():
+            matrix[i, column[name]] = n
+    return CategoryProfile(flops, names, matrix)
+
+
+def _water_fill(need):
+    """
+    合計 1 の配分を need に届くまで均等に割り振る（届かないカテゴリ同士は同じ量）。
+    余った分は配分に比例して足す。
+    """
+    share = np.zeros(len(need))
+    budget = 1.0
+    order = np.argsort(need)
+    for k, c in enumerate(order):
+        share[c] = min(need[c], budget / (len(order) - k))
+        budget -= share[c]
+    return share / share.sum()
+
+
+def proposal(profile, n, target, uniform_share=UNIFORM_SHARE):
+    """
+    フロップ n 個を引くときの提案分布 q（profile.flops ごとの確率）。
+    一様抽出での期待行数が target 未満のカテゴリ（希少カテゴリ）ごとに「そのカテゴリの行数に比例して
+    フロップを引く」成分を作り、一様分布と混ぜる。成分の比重は、一様分の期待行数との差を埋めるのに
+    要る量（1 回引いたときの期待行数から逆算）を、合計 1 の中で均等に割り振って決める
+    （出現し得る行数が少なく目標に届かないカテゴリが他を押しのけないように）。
+    """
+    counts = profile.counts.astype(float)
+    n_flops = len(counts)
+    uniform = np.full(n_flops, 1.0 / n_flops)
+    totals = counts.sum(axis=0)
+    from_uniform = n * uniform_share * totals / n_flops
+    rare = np.flatnonzero((totals > 0) & (n * totals / n_flops < target))
+    if not len(rare):
+        return uniform
+
+    components = counts[:, rare] / totals[rare]          # 列ごとに和 1
+    rows_per_draw = (components * counts[:, rare]).sum(axis=0)
+    need = np.maximum(target - from_uniform[rare], 0) / (n * (1 - uniform_share) * rows_per_draw)
+    q = uniform_share * uniform + (1 - uniform_share) * components @ _water_fill(need)
+    return q / q.sum()
+
+
+def expected_counts(profile, q, n):
+    """提案分布 q でフロップを n 個引いたときのカテゴリごとの期待行数 {カテゴリ: 行数}"""
+    return dict(zip(profile.names, (n * (q @ profile.counts)).round(1).tolist()))
+
+
+def sample_flops(hand, n, target, seed):
+    """
+    提案分布からフロップを n 個（復元抽出）引き、(フロップのリスト, 重みのリスト) を返す。
+    重み = 一様分布の確率 / 提案分布の確率（提案分布の下での平均が 1）。
+    """
+    profile = category_profile(hand)
+    q = proposal(profile, n, target)
+    rows = np.random.default_rng(seed).choice(len(q), size=n, p=q)
+    weights = 1.0 / (len(q) * q[rows])
+    return [list(profile.flops[r]) for r in rows], weights.tolist()
@@ -0,0 +1,285 @@
+# instrument.py
+#
+# ホットパスの計測（ステージごとの実時間・呼び出し回数・eval7.evaluate の呼び出し回数・
+# tracemalloc のピークメモリ）。
+# 無効時はどこにも手を入れない（計測対象の関数は元のまま）ので、オーバーヘッドはない。
+# enable() で TARGETS の関数をモジュール属性ごと計測用のラッパーに差し替え、
+# disable() で元に戻す。差し替えはプロセス全体に効くので、同じプロセスで複数のジョブ
+# （Streamlit の別セッションなど）が計測するときは with session(...) で使う。利用者を数え、
+# 最後の利用者が抜けるまで元に戻さない。
+# プロセスプールのワーカーでは各ワーカーが enable() し、drain() した集計を親の recorder に
+# merge() する（auto_pipeline 参照）。
+
+import functools
+import importlib
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+# (モジュール名, 属性名, ステージ名)。同じ関数を複数モジュールが import している場合は
+# それぞれの名前を差し替える（from ... import した名前はモジュールごとに別）
+TARGETS = (
+    ("auto_pipeline", "run_shift_flop", "run_shift_flop"),
+    ("auto_pipeline", "run_shift_turn", "run_shift_turn"),
+    ("auto_pipeline", "run_shift_river", "run_shift_river"),
+    ("runout_tree", "build_runout_tree", "runout_tree"),
+    ("simulate_shift_river", "enumerate_vs_all", "river_enumeration"),
+    ("simulate_shift_flop", "classify_made_hand", "made_hand"),
+    ("simulate_shift_turn", "classify_made_hand", "made_hand"),
+    ("simulate_shift_river", "classify_made_hand", "made_hand"),
+    ("simulate_shift_flop", "classify_flop_turn_pattern", "board_features"),
+    ("simulate_shift_turn", "classify_flop_turn_pattern", "board_features"),
+    ("simulate_shift_river", "classify_flop_turn_pattern", "board_features"),
+    ("board_patterns", "new_features_bulk", "board_features"),
+    ("importance", "category_profile", "importance_profile"),
+    ("result_writer", "export_csv", "csv"),
+)
+
+# 評価回数を数える関数: (モジュール名, 属性名, 1 回の呼び出しで数える評価数)
+EVAL_TARGETS = (
+    ("eval7", "evaluate", None),
+    ("made_hand", "evaluate", None),
+    ("batch_eval", "evaluate_batch", len),
+)
+
+enabled = False
+_originals = {}
+_tracing_memory = False
+_local = threading.local()
+# session() の利用者数（全体 / ピークメモリも測る利用者）
+_users = 0
+_memory_users = 0
+_users_lock = threading.Lock()
+
+
+class Recorder:
+    """
+    ステージ名 → {"calls", "wall", "evals", "peak_bytes"} の集計。
+    evals・wall は入れ子のステージを含む（run_shift_turn の中の made_hand も run_shift_turn に数える）。
+    peak_bytes はステージ実行中に増えた tracemalloc のピーク（メモリ計測時のみ）。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.stages = {}
+            self.evals = 0
+            self.started = time.time()
+
+    def add(self, name, wall, evals=0, peak_bytes=0, calls=1):
+        with self._lock:
+            s = self.stages.get(name)
+            if s is None:
+                s = self.stages[name] = {"calls": 0, "wall": 0.0, "evals": 0, "peak_bytes": 0}
+            s["calls"] += calls
+            s["wall"] += wall
+            s["evals"] += evals
+            s["peak_bytes"] = max(s["peak_bytes"], peak_bytes)
+
+    def merge(self, data):
+        """snapshot() / drain() の結果（別プロセスの集計）を足し込む"""
+        for name, s in data["stages"].items():
+            self.add(name, s["wall"], s["evals"], s["peak_bytes"], s["calls"])
+        with self._lock:
+            self.evals += data["evals"]
+
+    def snapshot(self):
+        with self._lock:
+            return {"stages": {k: dict(v) for k, v in self.stages.items()}, "evals": self.evals}
+
+    def drain(self):
+        """集計を取り出して空にする（ワーカーから親へ渡す用）"""
+        data = self.snapshot()
+        self.reset()
+        return data
+
+    def evals_per_sec(self):
+        elapsed = time.time() - self.started
+        return self.evals / elapsed if elapsed > 0 else 0.0
+
+    def table(self):
+        """表示用の行（実時間の降順）"""
+        rows = []
+        for name, s in sorted(self.snapshot()["stages"].items(), key=lambda kv: -kv[1]["wall"]):
+            rows.append({
+                "stage": name,
+                "calls": s["calls"],
+                "wall_sec": round(s["wall"], 4),
+                "ms_per_call": round(1000 * s["wall"] / s["calls"], 4) if s["calls"] else 0.0,
+                "evals": s["evals"],
+                "evals_per_sec": round(s["evals"] / s["wall"]) if s["wall"] > 0 else 0,
+                "peak_mb": round(s["peak_bytes"] / 2**20, 3),
+            })
+        return rows
+
+
+recorder = Recorder()
+
+
+# ====== ステージ ======
+class _Stage:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        base = 0
+        if _tracing_memory:
+            base, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1][2] = max(stack[-1][2], peak)
+            tracemalloc.reset_peak()
+        # [開始時刻, 開始時の評価回数, これまでのピーク, 開始時の使用量]
+        stack.append([time.perf_counter(), recorder.evals, base, base])
+        return self
+
+    def __exit__(self, *exc):
+        wall_end = time.perf_counter()
+        start, evals0, max_peak, base = _local.stack.pop()
+        peak_bytes = 0
+        if _tracing_memory:
+            max_peak = max(max_peak, tracemalloc.get_traced_memory()[1])
+            peak_bytes = max_peak - base
+            if _local.stack:
+                _local.stack[-1][2] = max(_local.stack[-1][2], max_peak)
+        recorder.add(self.name, wall_end - start, recorder.evals - evals0, peak_bytes)
+        return False
+
+
+class _NoStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_STAGE = _NoStage()
+
+
+def stage(name):
+    """with stage("csv_build"): ... で区間を計測する（無効時は何もしない）"""
+    return _Stage(name) if enabled else _NO_STAGE
+
+
+# ====== 差し替え ======
+def _timed(func, name):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with _Stage(name):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def _counted(func, size):
+    if size is None:
+        def wrapper(*args, **kwargs):
+            recorder.evals += 1
+            return func(*args, **kwargs)
+    else:
+        def wrapper(hands, *args, **kwargs):
+            recorder.evals += size(hands)
+            return func(hands, *args, **kwargs)
+    return functools.wraps(func)(wrapper)
+
+
+def _patch(module_name, attr, make):
+    module = importlib.import_module(module_name)
+    key = (module_name, attr)
+    if key in _originals:
+        return
+    original = getattr(module, attr)
+    _originals[key] = original
+    setattr(module, attr, make(original))
+
+
+def _set_memory(memory):
+    """ピークメモリの計測（tracemalloc）を memory に合わせて開始・停止する"""
+    global _tracing_memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _tracing_memory = True
+    elif not memory and _tracing_memory:
+        tracemalloc.stop()
+        _tracing_memory = False
+
+
+def enable(memory=False):
+    """
+    計測を有効にする（memory=True なら tracemalloc でピークメモリも測る。遅くなる）。
+    有効なまま呼んでも memory の指定は反映する。
+    """
+    global enabled
+    for module_name, attr, name in TARGETS:
+        _patch(module_name, attr, lambda f, name=name: _timed(f, name))
+    for module_name, attr, size in EVAL_TARGETS:
+        _patch(module_name, attr, lambda f, size=size: _counted(f, size))
+    _set_memory(memory or _memory_users > 0)
+    enabled = True
+
+
+def disable():
+    """差し替えた関数を元に戻す（集計は残す）"""
+    global enabled
+    for (module_name, attr), original in _originals.items():
+        setattr(importlib.import_module(module_name), attr, original)
+    _originals.clear()
+    _set_memory(False)
+    enabled = False
+
+
+class _Session:
+    def __init__(self, memory):
+        self.memory = bool(memory)
+
+    def __enter__(self):
+        global _users, _memory_users
+        with _users_lock:
+            _users += 1
+            _memory_users += self.memory
+            enable(memory=_memory_users > 0)
+        return self
+
+    def __exit__(self, *exc):
+        global _users, _memory_users
+        with _users_lock:
+            _users -= 1
+            _memory_users -= self.memory
+            if _users:
+                enable(memory=_memory_users > 0)
+            else:
+                disable()
+        return False
+
+
+def session(active=True, memory=False):
+    """
+    with session(active, memory): の間だけ計測を有効にする（active=False なら何もしない）。
+    同時に使っている利用者が残っていれば、抜けても差し替えたままにする。
+    memory=True の利用者が 1 人でもいる間はピークメモリも測る。
+    """
+    return _Session(memory) if active else _NO_STAGE
+
+
+# ====== 書き出し ======
+def export_jsonl(path, **meta):
+    """
+    集計をステージ 1 行ずつ JSON Lines で書き出す（既存ファイルには追記）。
+    meta（ハンド・エンジンなど）は各行に付ける。
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    data = recorder.snapshot()
+    timestamp = time.strftime("%Y-%m-%dT%H:%M:%S")
+    with open(path, "a", encoding="utf-8") as f:
+        for row in recorder.table():
+            f.write(json.dumps({"time": timestamp, **meta, **row}, ensure_ascii=False) + "\n")
+        f.write(json.dumps({"time": timestamp, **meta, "stage": "total", "evals": data["evals"]},
+                           ensure_ascii=False) + "\n")
+    return path
@@ -0,0 +1,116 @@
+# iso_cache.py
+#
+# スート同型（スートの入れ替え）による正規化と、勝率計算のメモ化キャッシュ。
+# 例: AsKs / 2h 7d Tc と AhKh / 2s 7c Td はスートを入れ替えただけの同じ局面なので、
+#     正規形を同じキーにして 1 回だけ計算する。
+
+import hashlib
+import itertools
+import random
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import cards
+
+# 4 スートの全置換（24 通り）を「カードコード → カードコード」の写像表にしておく
+SUIT_PERMUTATIONS = [
+    np.array([perm[c // 13] * 13 + c % 13 for c in range(52)], dtype=np.int64)
+    for perm in itertools.permutations(range(4))
+]
+
+
+def canonical_form(hole_cards, board_cards):
+    """
+    (ホールカード, ボード) のスート同型での正規形を返す。
+    戻り値: (key, perm)
+      key  : ハッシュ可能な正規形（ホール・ボードそれぞれ順不同）
+      perm : 実カードコード → 正規形カードコード の写像（np.ndarray, 長さ52）
+    """
+    hole = [cards.code(c) for c in hole_cards]
+    board = [cards.code(c) for c in board_cards]
+
+    best_key = None
+    best_perm = None
+    for perm in SUIT_PERMUTATIONS:
+        key = (tuple(sorted(perm[hole].tolist())), tuple(sorted(perm[board].tolist())))
+        if best_key is None or key < best_key:
+            best_key = key
+            best_perm = perm
+    return best_key, best_perm
+
+
+class LRUMemo:
+    """件数上限つきの LRU メモ（上限を超えたら最も古く使われたものから削除）"""
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        return {"size": len(self._data), "maxsize": self.maxsize,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+# プロセス内で共有するメモ（勝率など小さな値用 / ランアウトツリー用）
+equity_memo = LRUMemo(maxsize=200000)
+tree_memo = LRUMemo(maxsize=2000)
+
+_MISSING = object()
+
+
+def memoized(kind, hole_cards, board_cards, compute, params=()):
+    """
+    kind（"flop" / "turn" / "river" など）と計算パラメータ params を含めた正規形キーで
+    equity_memo を引き、無ければ compute() を実行して保存する。
+    compute の戻り値はスートの入れ替えで変わらない値（勝率など）であること。
+    モンテカルロの標本は compute の中で seeded_rng などの呼び出しごとの乱数で引くこと。
+    """
+    key, _ = canonical_form(hole_cards, board_cards)
+    full_key = (kind, tuple(params), key)
+    value = equity_memo.get(full_key, _MISSING)
+    if value is _MISSING:
+        value = compute()
+        equity_memo.put(full_key, value)
+    return value
+
+
+def seeded_rng(seed_key):
+    """
+    seed_key（repr できる値）から決まるシードの random.Random。
+    random モジュールの状態には触れないので、スレッドから並行に使っても乱数列が混ざらない。
+    """
+    return random.Random(int.from_bytes(hashlib.sha256(repr(seed_key).encode()).digest()[:8], "little"))
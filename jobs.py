@@ -0,0 +1,125 @@
+# jobs.py
+#
+# Streamlit のスクリプトスレッドから切り離して長い計算を走らせるジョブ管理。
+# パラメータ一式をキーにジョブを登録し、バックグラウンドスレッドで実行する。
+# 進捗・途中結果・取り消しはジョブオブジェクト経由でやり取りする。
+# app.py では st.cache_resource で JobManager を 1 つだけ作り、再実行・再読み込み後も
+# 同じジョブに再接続する。
+
+import hashlib
+import threading
+import time
+import traceback
+
+
+def job_key(params):
+    """パラメータ一式（dict）から決まるジョブキー"""
+    return hashlib.sha256(repr(sorted(params.items())).encode()).hexdigest()[:16]
+
+
+class Job:
+    """
+    1 回の計算ジョブ。
+    status: "running" / "done" / "cancelled" / "error"
+    results: target が on_partial で渡した途中結果（完了後は最終結果）
+    """
+
+    def __init__(self, key, params):
+        self.key = key
+        self.params = dict(params)
+        self.status = "running"
+        self.done = 0
+        self.total = 0
+        self.message = ""
+        self.results = None
+        self.error = None
+        self.started = time.time()
+        self.finished = None
+        self.cancel_event = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self.status == "running"
+
+    @property
+    def fraction(self):
+        if self.status == "done":
+            return 1.0
+        return self.done / self.total if self.total else 0.0
+
+    def snapshot(self):
+        """途中結果のコピー（計算スレッドが書き換え中でも安全に読める形）"""
+        with self._lock:
+            if self.results is None:
+                return None
+            return tuple({k: list(v) for k, v in part.items()} for part in self.results)
+
+    def _progress(self, done, total, message):
+        self.done, self.total, self.message = done, total, message
+
+    def _partial(self, *results):
+        with self._lock:
+            self.results = results
+
+
+class JobManager:
+    """
+    target(**params, progress=..., on_partial=..., cancel_event=...) をジョブとして実行する。
+    同じパラメータのジョブが実行中または完了済みなら、新しく作らずそれを返す。
+    """
+
+    def __init__(self, target, max_finished=20):
+        self.target = target
+        self.max_finished = max_finished
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, params):
+        key = job_key(params)
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and job.status in ("running", "done"):
+                return job
+            job = Job(key, params)
+            self._jobs[key] = job
+            self._prune()
+
+        thread = threading.Thread(target=self._run, args=(job,), daemon=True, name=f"job-{key}")
+        thread.start()
+        return job
+
+    def _run(self, job):
+        try:
+            results = self.target(**job.params, progress=job._progress, on_partial=job._partial,
+                                  cancel_event=job.cancel_event)
+            job._partial(*results)
+            job.status = "cancelled" if job.cancel_event.is_set() else "done"
+        except Exception:
+            job.error = traceback.format_exc()
+            job.status = "error"
+        finally:
+            job.finished = time.time()
+
+    def _prune(self):
+        """完了済みジョブは新しいものから max_finished 件だけ残す"""
+        finished = sorted((j for j in self._jobs.values() if not j.running), key=lambda j: j.started)
+        for job in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job.key]
+
+    def get(self, key):
+        return self._jobs.get(key)
+
+    def cancel(self, key):
+        job = self._jobs.get(key)
+        if job is not None:
+            job.cancel_event.set()
+        return job
+
+    def jobs(self):
+        """新しい順のジョブ一覧"""
+        return sorted(self._jobs.values(), key=lambda j: j.started, reverse=True)
+
+    def latest(self):
+        jobs = self.jobs()
+        return jobs[0] if jobs else None
@@ -0,0 +1,79 @@
+# made_hand.py
+#
+# 役判定（ShiftFlop / ShiftTurn / ShiftRiver 共通）。
+# eval7.evaluate を 1 回だけ呼び、スコアの上位 8 ビット（役の種類）と
+# ランクのニブル（役を作るランク）から役名を決める。
+# ホールカードの関与枚数（hc）はランク・スートのビットマスクで数える。
+#
+# eval7 のスコア: (役の種類 << 24) | ランクのニブル（ビット 16, 12, 8, 4, 0。2=0 … A=12）
+#   pair: ペア, キッカー… / two_pair: 上のペア, 下のペア, キッカー / trips: トリップス, キッカー…
+#   straight, straight_flush: 最上位ランク（A-5 は 5=3） / flush: 5 枚のランク
+#   full_house: トリップス, ペア / quads: クワッズ, キッカー
+
+from eval7 import evaluate
+
+HAND_NAMES = ("high_card", "pair", "two_pair", "set", "straight",
+              "flush", "full_house", "quads", "straight_flush")
+
+HIGH_CARD, PAIR, TWO_PAIR, TRIPS, STRAIGHT, FLUSH, FULL_HOUSE, QUADS, STRAIGHT_FLUSH = range(9)
+
+_WHEEL = 0b1000000001111  # A,5,4,3,2
+
+# ストレートの最上位ランク（ニブル値）→ 5 ランクのマスク
+_STRAIGHT_RANKS = tuple(_WHEEL if top == 3 else (0b11111 << (top - 4) if top >= 4 else 0)
+                        for top in range(16))
+
+
+def hand_name(score):
+    """eval7 のスコア → 役名"""
+    return HAND_NAMES[score >> 24]
+
+
+def _role_ranks(score, kind):
+    """役を作るランクのマスク（ストレート系は 5 ランク、フラッシュは上位 5 枚のランク）"""
+    if kind == PAIR or kind == TRIPS or kind == QUADS:
+        return 1 << (score >> 16 & 0xF)
+    if kind == TWO_PAIR or kind == FULL_HOUSE:
+        return 1 << (score >> 16 & 0xF) | 1 << (score >> 12 & 0xF)
+    if kind == FLUSH:
+        return (1 << (score >> 16 & 0xF) | 1 << (score >> 12 & 0xF) | 1 << (score >> 8 & 0xF)
+                | 1 << (score >> 4 & 0xF) | 1 << (score & 0xF))
+    return _STRAIGHT_RANKS[score >> 16 & 0xF]
+
+
+def classify_made_hand(hole_cards, board_cards):
+    """
+    (役名, ホールカードの関与枚数 hc) を返す。
+    - 5 枚未満（プリフロップ）: ポケットペア=("pair", 2) / それ以外=("high_card", 0)
+    - hc: 役を作るカードに入るホールカードの枚数（最大 2）
+        ペア系: 役のランク（ペア・トリップス・クワッズ・フルハウスの両方）のホールカード
+        ストレート: ストレートの 5 ランクに入るホールカード（同ランク 2 枚は 1 枚と数える）
+        フラッシュ: フラッシュのスートで、上位 5 枚に入るホールカード
+        ストレートフラッシュ: フラッシュのスートで、ストレートの 5 ランクに入るホールカード
+        ハイカード: 0
+    """
+    seven = hole_cards + board_cards
+    if len(seven) < 5:
+        if len(hole_cards) == 2 and hole_cards[0].rank == hole_cards[1].rank:
+            return "pair", 2
+        return "high_card", 0
+
+    score = evaluate(seven)
+    kind = score >> 24
+    if kind == HIGH_CARD:
+        return "high_card", 0
+
+    h0, h1 = hole_cards
+    ranks = _role_ranks(score, kind)
+    in0 = ranks >> h0.rank & 1
+    in1 = ranks >> h1.rank & 1
+
+    if kind == STRAIGHT and h0.rank == h1.rank:
+        in1 = 0
+    elif kind == FLUSH or kind == STRAIGHT_FLUSH:
+        # フラッシュのスート = 5 枚以上あるスート
+        suits = [c.suit for c in seven]
+        flush_suit = max(range(4), key=suits.count)
+        in0 = in0 and h0.suit == flush_suit
+        in1 = in1 and h1.suit == flush_suit
+    return HAND_NAMES[kind], in0 + in1
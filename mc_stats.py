@@ -0,0 +1,156 @@
+# mc_stats.py
+#
+# モンテカルロ勝率の集計（勝ち・引き分け・試行数）と、標準誤差による打ち切り。
+# 1 試行の結果は 勝ち=1 / 引き分け=0.5 / 負け=0 として扱う。
+
+import math
+
+Z_95 = 1.96
+
+
+class EquityStats:
+    """勝率推定の十分統計量（wins, ties, samples）"""
+
+    def __init__(self, wins=0, ties=0, samples=0):
+        self.wins = wins
+        self.ties = ties
+        self.samples = samples
+
+    def add(self, wins, ties, samples):
+        self.wins += wins
+        self.ties += ties
+        self.samples += samples
+        return self
+
+    def merge(self, other):
+        return self.add(other.wins, other.ties, other.samples)
+
+    @property
+    def equity(self):
+        """勝率（%）"""
+        if self.samples == 0:
+            return 0.0
+        return (self.wins + self.ties / 2) / self.samples * 100
+
+    @property
+    def stderr(self):
+        """勝率の標準誤差（%ポイント）"""
+        if self.samples == 0:
+            return float("inf")
+        p = (self.wins + self.ties / 2) / self.samples
+        second_moment = (self.wins + self.ties / 4) / self.samples
+        var = max(second_moment - p * p, 0.0)
+        return math.sqrt(var / self.samples) * 100
+
+    @property
+    def ci95(self):
+        """95% 信頼区間の半幅（%ポイント）"""
+        return Z_95 * self.stderr
+
+    def __repr__(self):
+        return f"EquityStats(wins={self.wins}, ties={self.ties}, samples={self.samples})"
+
+
+class ShareStats:
+    """
+    多人数ポット用の勝率推定の十分統計量（取り分の合計, 取り分の二乗和, samples）。
+    1 試行の取り分は 勝ち=1 / k 人で分け合い=1/k / 負け=0。
+    """
+
+    def __init__(self, total=0.0, total_sq=0.0, samples=0):
+        self.total = total
+        self.total_sq = total_sq
+        self.samples = samples
+
+    def add(self, total, total_sq, samples):
+        self.total += total
+        self.total_sq += total_sq
+        self.samples += samples
+        return self
+
+    def merge(self, other):
+        return self.add(other.total, other.total_sq, other.samples)
+
+    @property
+    def equity(self):
+        """勝率（%）"""
+        if self.samples == 0:
+            return 0.0
+        return self.total / self.samples * 100
+
+    @property
+    def stderr(self):
+        """勝率の標準誤差（%ポイント）"""
+        if self.samples == 0:
+            return float("inf")
+        p = self.total / self.samples
+        var = max(self.total_sq / self.samples - p * p, 0.0)
+        return math.sqrt(var / self.samples) * 100
+
+    @property
+    def ci95(self):
+        """95% 信頼区間の半幅（%ポイント）"""
+        return Z_95 * self.stderr
+
+    def __repr__(self):
+        return f"ShareStats(total={self.total}, total_sq={self.total_sq}, samples={self.samples})"
+
+
+def run_adaptive(sample_batch, max_samples, tolerance=None, batch_size=1000, stats=None):
+    """
+    sample_batch(n) -> (wins, ties) を繰り返し呼び、EquityStats を返す。
+    ShareStats など別の集計を stats に渡した場合、sample_batch(n) の戻り値は
+    その add(..., n) の引数（ShareStats なら (total, total_sq)）。
+    - tolerance=None: max_samples 回を 1 回の呼び出しでまとめて実行（従来の固定回数）
+    - tolerance 指定: batch_size ずつ追加し、標準誤差（%ポイント）が tolerance 以下
+      になるか max_samples に達したら打ち切る
+    stats を渡すと、その続きから追加する（すでに条件を満たしていれば何もしない）。
+    """
+    if stats is None:
+        stats = EquityStats()
+
+    if tolerance is None:
+        n = max_samples - stats.samples
+        if n > 0:
+            stats.add(*sample_batch(n), n)
+        return stats
+
+    while not satisfied(stats, max_samples, tolerance, batch_size):
+        n = min(batch_size, max_samples - stats.samples)
+        stats.add(*sample_batch(n), n)
+    return stats
+
+
+def satisfied(stats, max_samples, tolerance=None, batch_size=1000):
+    """
+    これ以上標本を足さなくてよいか（run_adaptive の打ち切り条件）。
+    max_samples に達した、または tolerance 指定時に batch_size 以上の標本で標準誤差が tolerance 以下。
+    """
+    if stats.samples >= max_samples:
+        return True
+    return tolerance is not None and stats.samples >= batch_size and stats.stderr <= tolerance
+
+
+class RunningMean:
+    """勝ち/負けに限らない値（1 試行あたりの勝率など）の平均・標準誤差（Welford 法）"""
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self._m2 += delta * (x - self.mean)
+
+    @property
+    def stderr(self):
+        if self.n < 2:
+            return float("inf")
+        return math.sqrt(self._m2 / (self.n - 1) / self.n)
+
+    @property
+    def ci95(self):
+        return Z_95 * self.stderr
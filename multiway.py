@@ -0,0 +1,85 @@
+# multiway.py
+#
+# 相手 N 人（全員ランダムハンド）に対する勝率。
+# 1 試行ごとに相手 N 人の 2 枚とボードの残りをまとめて引き、batch_eval で
+# (試行数 × N) 行を 1 回で評価する。コストは相手の人数にほぼ比例する。
+# 取り分: 単独トップ=1 / ヒーローを含む k 人が同点トップ=1/k / それ以外=0。
+
+import numpy as np
+
+import batch_eval
+import mc_stats
+
+
+def share_sums(hero_scores, opp_scores):
+    """
+    hero_scores: (n,) / opp_scores: (n, N) → ヒーローの取り分の (合計, 二乗和)
+    """
+    best = opp_scores.max(axis=1)
+    tied = (opp_scores == hero_scores[:, None]).sum(axis=1)
+    share = np.where(hero_scores > best, 1.0, np.where(hero_scores == best, 1.0 / (1 + tied), 0.0))
+    return float(share.sum()), float(np.dot(share, share))
+
+
+def river_score_table(live, board_codes):
+    """ボード5枚が決まっているとき、残りカード2枚組ごとの相手スコア表（52×52）"""
+    pairs = batch_eval.combination_indices(len(live), 2)
+    scores = batch_eval.evaluate_batch(np.column_stack(
+        [live[pairs], np.broadcast_to(board_codes, (len(pairs), 5))]))
+    table = np.zeros((52, 52), dtype=np.int64)
+    table[live[pairs[:, 0]], live[pairs[:, 1]]] = scores
+    table[live[pairs[:, 1]], live[pairs[:, 0]]] = scores
+    return table
+
+
+def sample_shares(hero, board, opponents, n, rng=None, river_table=None, drawn=None):
+    """
+    n 試行分の取り分の (合計, 二乗和)。
+    drawn: 引いたカード（(n, 相手2枚×人数 + ランアウト) のコード配列）。省略時はここで引く
+    """
+    live = batch_eval.live_codes(hero + board)
+    board_codes = batch_eval.cards_to_codes(board)
+    k = 5 - len(board)
+    if 2 * opponents + k > len(live):
+        raise ValueError(f"相手 {opponents} 人分のカードが足りません")
+
+    if drawn is None:
+        drawn = batch_eval.sample_without_replacement(live, n, 2 * opponents + k, rng)
+    opp_holes = drawn[:, :2 * opponents]
+
+    if k == 0:
+        # ボード確定: 相手スコアは2枚組の表引き、ヒーローは1回だけ評価
+        if river_table is None:
+            river_table = river_score_table(live, board_codes)
+        hero_scores = np.full(n, batch_eval.evaluate_batch(
+            batch_eval.cards_to_codes(hero + board)[None, :])[0])
+        opp_scores = river_table[opp_holes[:, 0::2], opp_holes[:, 1::2]]
+        return share_sums(hero_scores, opp_scores)
+
+    full_board = np.column_stack([np.broadcast_to(board_codes, (n, len(board))), drawn[:, 2 * opponents:]])
+    hero_scores = batch_eval.evaluate_batch(np.column_stack(
+        [np.broadcast_to(batch_eval.cards_to_codes(hero), (n, 2)), full_board]))
+    opp_scores = batch_eval.evaluate_batch(np.column_stack(
+        [opp_holes.reshape(n * opponents, 2), np.repeat(full_board, opponents, axis=0)]))
+    return share_sums(hero_scores, opp_scores.reshape(n, opponents))
+
+
+def equity_stats(hero, board, opponents, max_samples, tolerance=None, rng=None, stats=None):
+    """
+    相手 opponents 人に対する勝率を mc_stats.ShareStats で返す。
+    tolerance（標準誤差, %ポイント）を指定すると max_samples を上限に打ち切る。
+    stats（ShareStats）を渡すとその続きから標本を足す。
+    """
+    if rng is None:
+        rng = batch_eval.make_rng()
+    river_table = None
+    if len(board) == 5:
+        river_table = river_score_table(batch_eval.live_codes(hero + board), batch_eval.cards_to_codes(board))
+    sample = lambda n: sample_shares(hero, board, opponents, n, rng, river_table)
+    return mc_stats.run_adaptive(sample, max_samples, tolerance, batch_size=5000,
+                                 stats=stats if stats is not None else mc_stats.ShareStats())
+
+
+def equity(hero, board, opponents, max_samples, tolerance=None, rng=None):
+    """相手 opponents 人に対する勝率（%）"""
+    return equity_stats(hero, board, opponents, max_samples, tolerance, rng).equity
@@ -1,3 +1,13 @@
+import os
+import struct
+import zlib
+
+import numpy as np
+
+import cards
+import multiway
+from cards import rank_value as convert_rank_to_value
+
 preflop_winrates_random = {
     "22": 50.36, "32o": 32.09, "32s": 35.9, "42o": 33.23, "42s": 36.83,
     "52o": 34.3, "52s": 38.09, "62o": 33.95, "62s": 37.44, "72o": 34.38,
@@ -36,13 +46,6 @@ preflop_winrates_random = {
 }
 
 
-def convert_rank_to_value(rank):
-    rank_order = {'2': 2, '3': 3, '4': 4, '5': 5, '6': 6,
-                  '7': 7, '8': 8, '9': 9, 'T': 10,
-                  'J': 11, 'Q': 12, 'K': 13, 'A': 14}
-    return rank_order[rank]
-
-
 def normalize_hand_key(hand_str):
     if len(hand_str) == 2:
         return hand_str  # ペアはそのまま
@@ -53,10 +56,85 @@ def normalize_hand_key(hand_str):
     return f"{r1}{r2}{suited}"
 
 
-def get_static_preflop_winrate(hand_str):
+# ==== バイナリ勝率テーブル（generate_preflop_winrates.save_preflop_table が出力） ====
+# ヘッダ: magic(4s) version(H) count(H) samples_per_hand(I)
+# レコード: hand(3s, 2文字ペアは \0 埋め) winrate×100(H)
+TABLE_MAGIC = b"PFWR"
+TABLE_VERSION = 1
+TABLE_HEADER = struct.Struct("<4sHHI")
+TABLE_RECORD = struct.Struct("<3sH")
+TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "preflop_winrates_random.bin")
+
+# 相手が複数人のときの勝率テーブル（{相手人数: {hand: winrate}}、必要になった時点で読み込む）
+MULTIWAY_SAMPLES = 100000
+_multiway_tables = {}
+
+
+def preflop_table_path(opponents=1):
+    """相手人数ごとのバイナリテーブルのパス（1人は従来の TABLE_PATH）"""
+    if opponents == 1:
+        return TABLE_PATH
+    return os.path.join(os.path.dirname(TABLE_PATH), f"preflop_winrates_random_{opponents}way.bin")
+
+
+def load_preflop_table(path=TABLE_PATH):
+    """
+    バイナリ勝率テーブルを読み込み {hand: winrate} を返す。
+    ファイルが無い・形式やバージョンが合わない場合は None。
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    if len(data) < TABLE_HEADER.size:
+        return None
+    magic, version, count, _samples = TABLE_HEADER.unpack_from(data, 0)
+    if magic != TABLE_MAGIC or version != TABLE_VERSION:
+        return None
+    if len(data) != TABLE_HEADER.size + count * TABLE_RECORD.size:
+        return None
+
+    table = {}
+    for i in range(count):
+        raw, wr = TABLE_RECORD.unpack_from(data, TABLE_HEADER.size + i * TABLE_RECORD.size)
+        table[raw.rstrip(b"\0").decode("ascii")] = wr / 100
+    return table
+
+
+def reload_preflop_table(path=TABLE_PATH):
+    """テーブルがあれば組み込みの勝率辞書を上書きする（再生成後の反映用）"""
+    table = load_preflop_table(path)
+    if table:
+        preflop_winrates_random.update(table)
+    return table is not None
+
+
+def clear_multiway_tables():
+    """読み込み済みの多人数テーブルを捨てる（再生成後の反映用）"""
+    _multiway_tables.clear()
+
+
+def get_static_preflop_winrate(hand_str, opponents=1):
     """
-    プリフロップ勝率を取得（ランダムハンドに対して）
+    プリフロップ勝率を取得（ランダムハンド opponents 人に対して）
     強いカードが前になるよう正規化してから取得する。
+    相手が複数人でテーブルに無いハンドは、その場で multiway の標本から求めて覚えておく。
     """
     key = normalize_hand_key(hand_str)
-    return preflop_winrates_random.get(key, 50.0)
+    if opponents == 1:
+        return preflop_winrates_random.get(key, 50.0)
+
+    table = _multiway_tables.get(opponents)
+    if table is None:
+        table = load_preflop_table(preflop_table_path(opponents)) or {}
+        _multiway_tables[opponents] = table
+    if key not in table:
+        hole = [cards.card(key[0] + "s"), cards.card(key[1] + ("s" if key.endswith("s") else "h"))]
+        rng = np.random.default_rng([opponents, zlib.crc32(key.encode())])
+        table[key] = round(multiway.equity(hole, [], opponents, MULTIWAY_SAMPLES, rng=rng), 2)
+    return table[key]
+
+
+# 起動時にバイナリテーブルがあれば読み込む
+reload_preflop_table()
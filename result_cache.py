@@ -0,0 +1,202 @@
+# result_cache.py
+#
+# run_shift_flop / run_shift_turn / run_shift_river の結果を SQLite に保存する永続キャッシュ。
+# キー: (ストリート, ハンド, スート同型の正規形ボード, エンジン・試行回数などの計算条件, CODE_VERSION)
+# 行に含まれるカード（turn_card / river_card）は正規形のスートで保存し、読み出し時に
+# 問い合わせ局面のスートへ付け替える。合計サイズが max_bytes を超えたら古く使われたものから削除する。
+#
+# モンテカルロの各局面の十分統計量（mc_stats.EquityStats / ShareStats）も同じファイルに
+# 試行回数を含まないキーで保存する（refined_stats）。試行回数を増やした再実行では
+# 足りない分だけ標本を追加し、目標精度を満たしている局面は追加しない。
+
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+
+import numpy as np
+
+import cards
+import iso_cache
+import mc_stats
+
+# 計算方法・行の形式を変えたら上げる（古いエントリは参照されなくなり、やがて削除される）
+CODE_VERSION = 2
+
+CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "shift_cache.sqlite3")
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    street TEXT NOT NULL,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+)
+"""
+
+
+class ResultCache:
+    """SQLite 1 ファイルのキャッシュ（プロセスごとに接続を作り直す）"""
+
+    def __init__(self, path=CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES, enabled=True):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def _connect(self):
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._conn.execute(_SCHEMA)
+            self._conn.commit()
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, key):
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            conn.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+            self.hits += 1
+            return pickle.loads(zlib.decompress(row[0]))
+
+    def put(self, key, street, value):
+        blob = zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        with self._lock:
+            conn = self._connect()
+            conn.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                         (key, street, blob, len(blob), time.time()))
+            conn.commit()
+            self._evict(conn)
+
+    def _evict(self, conn):
+        """合計サイズが max_bytes を超えたら、古く使われた順に 9 割まで削る"""
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9
+        for key, size in conn.execute("SELECT key, size FROM results ORDER BY last_used").fetchall():
+            if total <= target:
+                break
+            conn.execute("DELETE FROM results WHERE key = ?", (key,))
+            total -= size
+            self.evictions += 1
+        conn.commit()
+
+    def clear(self):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM results")
+            conn.commit()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            conn = self._connect()
+            entries, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        return {"entries": entries, "bytes": total, "max_bytes": self.max_bytes,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+shift_cache = ResultCache()
+
+
+def make_key(street, hand_str, canonical_key, params):
+    key = (street, hand_str, canonical_key, tuple(params), CODE_VERSION)
+    return hashlib.sha256(repr(key).encode()).hexdigest()
+
+
+def _remap_card_str(s, code_map):
+    # ターンが複数枚のときは 'As,Kd' のようにカンマ区切り
+    return ",".join(str(cards.CARDS[int(code_map[cards.code(c)])]) for c in s.split(","))
+
+
+def remap_rows(rows, code_map, card_fields):
+    """行（dict のリスト）の card_fields のカード文字列を code_map で付け替える"""
+    if not card_fields:
+        return rows
+    out = []
+    for row in rows:
+        row = dict(row)
+        for field in card_fields:
+            if field in row:
+                row[field] = _remap_card_str(row[field], code_map)
+        out.append(row)
+    return out
+
+
+def cached(street, hand_str, hole_cards, board_cards, params, compute, card_fields=(), cache=None):
+    """
+    キャッシュを引き、無ければ compute() を実行して保存する。
+    card_fields を指定した場合、compute() の戻り値は行（dict）のリストで、
+    そのフィールドのカード文字列を正規形スートで保存・復元する。
+    """
+    cache = shift_cache if cache is None else cache
+    if not cache.enabled:
+        return compute()
+
+    canonical_key, perm = iso_cache.canonical_form(hole_cards, board_cards)
+    key = make_key(street, hand_str, canonical_key, params)
+
+    value = cache.get(key)
+    if value is not None:
+        if card_fields:
+            inverse = np.empty(52, dtype=np.int64)
+            inverse[perm] = np.arange(52)
+            value = remap_rows(value, inverse, card_fields)
+        return value
+
+    value = compute()
+    cache.put(key, street, remap_rows(value, perm, card_fields) if card_fields else value)
+    return value
+
+
+def stats_key(kind, hole_cards, board_cards, params, canonical=True):
+    """
+    十分統計量のキー（試行回数・目標精度は含めない）。
+    canonical=False（共通乱数など実カードで標本が決まるもの）はスート同型をまとめない。
+    """
+    if canonical:
+        spot, _ = iso_cache.canonical_form(hole_cards, board_cards)
+    else:
+        spot = (tuple(sorted(cards.code(c) for c in hole_cards)), tuple(sorted(cards.code(c) for c in board_cards)))
+    return make_key("stats_" + kind, "", spot, params)
+
+
+def refined_stats(kind, hole_cards, board_cards, params, extend, max_samples, tolerance=None, batch_size=1000,
+                  new_stats=mc_stats.EquityStats, canonical=True, cache=None):
+    """
+    保存済みの十分統計量を読み、足りなければ extend(stats) で続きの標本を足して保存する。
+    - extend(stats, rng): stats に標本を追加して返す関数（mc_stats.run_adaptive に stats を渡す形）。
+      標本は rng（random.Random）から引くこと
+    - 保存済みが max_samples 以上、または tolerance を満たしていれば標本は引かない
+    追加分は (キー, 保存済みの試行数) から決まるシードで引くので、前回の標本と重ならず、
+    同じ手順で伸ばせば同じ値になる。
+    """
+    cache = shift_cache if cache is None else cache
+    key = stats_key(kind, hole_cards, board_cards, params, canonical)
+    stats = cache.get(key) if cache.enabled else None
+    if stats is None:
+        stats = new_stats()
+    if mc_stats.satisfied(stats, max_samples, tolerance, batch_size):
+        return stats
+
+    before = stats.samples
+    stats = extend(stats, iso_cache.seeded_rng((key, before)))
+    if cache.enabled and stats.samples > before:
+        cache.put(key, "stats_" + kind, stats)
+    return stats
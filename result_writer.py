@@ -0,0 +1,374 @@
+# result_writer.py
+#
+# Shift 結果（app.py の「CSV保存」の行）をファイルへ逐次書き出す。
+# 行を batch_size 件ずつ Arrow の RecordBatch にまとめ、Parquet（.parquet）または
+# Arrow IPC ストリーム（.arrow）に追記していく。全行をメモリに持たない。
+# 文字列列（Stage / Features / Role など）は辞書エンコード（カテゴリ）で保存し、
+# 辞書はファイル全体で共通（新しい値が出たら末尾に足す）にする。
+# CSV は保存済みファイルからバッチ単位で変換して書き出す。
+# 自動生成の結果（auto_flop / auto_turn / auto_river）→ 行 の変換もここに置く
+# （app.py と batch_runner.py で共通）。
+
+import csv
+import os
+
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+from preflop_winrates_random import get_static_preflop_winrate
+
+# app.py の結果表の列（並びも同じ）
+# Weight は重要度サンプリング（importance.py）の重み。一様に選んだフロップの行は空（= 1）
+COLUMNS = ("Stage", "Flop", "Turn", "Detail", "Shift", "Winrate", "CI", "Features", "Role", "Hand", "Weight")
+NUMERIC_COLUMNS = ("Shift", "Winrate", "CI", "Weight")
+CATEGORY_COLUMNS = tuple(c for c in COLUMNS if c not in NUMERIC_COLUMNS)
+
+SCHEMA = pa.schema([
+    pa.field(c, pa.float64() if c in NUMERIC_COLUMNS else pa.dictionary(pa.int32(), pa.string()))
+    for c in COLUMNS
+])
+
+DEFAULT_BATCH_SIZE = 10000
+
+
+def _to_float(v):
+    """数値にできない値（''・'―' など）は欠損にする"""
+    if v is None or v == "":
+        return None
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return None
+
+
+class ShiftResultWriter:
+    """
+    with ShiftResultWriter("results/shift_results.parquet") as writer:
+        writer.write({"Stage": "ShiftFlop", "Flop": "Ah Kd 2c", ...})
+    path の拡張子で形式を決める（.parquet / .arrow）。列が足りない行は欠損で埋める。
+    """
+
+    def __init__(self, path, batch_size=DEFAULT_BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self.rows_written = 0
+        self._buffer = {c: [] for c in COLUMNS}
+        self._buffered = 0
+        # 列ごとの辞書（値 → コード）と値の並び
+        self._codes = {c: {} for c in CATEGORY_COLUMNS}
+        self._values = {c: [] for c in CATEGORY_COLUMNS}
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        ext = os.path.splitext(path)[1].lower()
+        if ext == ".parquet":
+            self._writer = pq.ParquetWriter(path, SCHEMA)
+        elif ext == ".arrow":
+            # ファイル形式は辞書の追加（差分）を持てないのでストリーム形式で書く
+            self._sink = pa.OSFile(path, "wb")
+            self._writer = ipc.new_stream(self._sink, SCHEMA,
+                                          options=ipc.IpcWriteOptions(emit_dictionary_deltas=True))
+        else:
+            raise ValueError(f"対応していない拡張子です: {path}（.parquet / .arrow）")
+
+    def write(self, row):
+        for c in NUMERIC_COLUMNS:
+            self._buffer[c].append(_to_float(row.get(c)))
+        for c in CATEGORY_COLUMNS:
+            v = row.get(c)
+            if v is None:
+                self._buffer[c].append(None)
+                continue
+            v = str(v)
+            code = self._codes[c].get(v)
+            if code is None:
+                code = self._codes[c][v] = len(self._values[c])
+                self._values[c].append(v)
+            self._buffer[c].append(code)
+        self._buffered += 1
+        if self._buffered >= self.batch_size:
+            self.flush()
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.write(row)
+
+    def flush(self):
+        if not self._buffered:
+            return
+        arrays = []
+        for c in COLUMNS:
+            if c in NUMERIC_COLUMNS:
+                arrays.append(pa.array(self._buffer[c], type=pa.float64()))
+            else:
+                arrays.append(pa.DictionaryArray.from_arrays(
+                    pa.array(self._buffer[c], type=pa.int32()), pa.array(self._values[c], type=pa.string())))
+        self._writer.write_batch(pa.record_batch(arrays, schema=SCHEMA))
+        self.rows_written += self._buffered
+        self._buffer = {c: [] for c in COLUMNS}
+        self._buffered = 0
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+        if hasattr(self, "_sink"):
+            self._sink.close()
+        return self.path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iter_batches(path, batch_size=DEFAULT_BATCH_SIZE):
+    """保存済みファイルを RecordBatch 単位で読む"""
+    if path.lower().endswith(".parquet"):
+        yield from pq.ParquetFile(path).iter_batches(batch_size=batch_size)
+    else:
+        with pa.OSFile(path, "rb") as source:
+            yield from ipc.open_stream(source)
+
+
+def read_results(path):
+    """保存済みファイル全体を DataFrame で読む（文字列列はカテゴリ型）"""
+    if path.lower().endswith(".parquet"):
+        return pq.read_table(path).to_pandas()
+    with pa.OSFile(path, "rb") as source:
+        return ipc.open_stream(source).read_all().to_pandas()
+
+
+def export_csv(path, csv_path, batch_size=DEFAULT_BATCH_SIZE):
+    """保存済みファイルをバッチ単位で CSV に変換する（欠損は空欄）"""
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for batch in iter_batches(path, batch_size):
+            columns = [batch.column(c).to_pylist() for c in COLUMNS]
+            writer.writerows(("" if v is None else v for v in row) for row in zip(*columns))
+    return csv_path
+
+
+def iter_upper_rows(auto_flop, opponents=1):
+    """自動生成の上部 CSV（ハンド情報と ShiftFlop のみ）の行を1行ずつ返す"""
+    for hand_str, flop_list in auto_flop.items():
+        static_wr_pf = round(get_static_preflop_winrate(hand_str, opponents), 2)
+        yield {
+            "Stage": "HandInfo", "Flop": "", "Turn": "", "Detail": "",
+            "Shift": "", "Winrate": static_wr_pf, "Features": "",
+            "Role": "", "Hand": hand_str
+        }
+
+        for i, flop_entry in enumerate(flop_list):
+            if flop_entry is None:
+                continue
+            flop_cards_str, static_wr_flop, shift_feats = flop_entry[:3]
+            flop_str = ' '.join(flop_cards_str)
+            yield {
+                "Stage": f"=== Flop {i+1}: {flop_str} ===", "Flop": "", "Turn": "",
+                "Detail": "", "Shift": "", "Winrate": "", "Features": "",
+                "Role": "", "Hand": hand_str
+            }
+
+            for f, delta in shift_feats.items():
+                yield {
+                    "Stage": "ShiftFlop", "Flop": flop_str, "Turn": "",
+                    "Detail": f, "Shift": round(delta, 2),
+                    "Winrate": round(static_wr_pf + delta, 2),
+                    "Features": "", "Role": "", "Hand": hand_str
+                }
+
+
+def iter_result_rows(auto_flop, auto_turn, auto_river, opponents=1):
+    """自動生成の結果（auto_flop / auto_turn / auto_river）を結果表の行（dict）として1行ずつ返す"""
+    for hand_str, flop_list in auto_flop.items():
+        static_wr_pf = round(get_static_preflop_winrate(hand_str, opponents), 2)
+
+        # Hand info row
+        yield {
+            "Stage": "HandInfo",
+            "Flop": "",
+            "Turn": "",
+            "Detail": "",
+            "Shift": "",
+            "Winrate": static_wr_pf,
+            "CI": "",
+            "Features": "",
+            "Role": "",
+            "Hand": hand_str
+        }
+
+        # ==========================================================
+        # Flop loop
+        # ==========================================================
+        for i, flop_entry in enumerate(flop_list):
+            try:
+                flop_cards_str, static_wr_flop, shift_feats = flop_entry[:3]
+            except Exception:
+                continue
+            # 95%信頼区間の半幅（古い3要素の結果には無い）
+            flop_ci = round(float(flop_entry[3]), 2) if len(flop_entry) > 3 else ""
+            # 重要度サンプリングの重み（一様に選んだフロップには無い）
+            flop_weight = float(flop_entry[4]) if len(flop_entry) > 4 else ""
+
+            flop_str = ' '.join(flop_cards_str)
+
+            # Flop header row
+            yield {
+                "Stage": f"=== Flop {i+1}: {flop_str} ===",
+                "Flop": "",
+                "Turn": "",
+                "Detail": "",
+                "Shift": "",
+                "Winrate": "",
+                "CI": "",
+                "Features": "",
+                "Role": "",
+                "Hand": hand_str,
+                "Weight": flop_weight
+            }
+
+            # ==========================================================
+            # ShiftFlop（特徴は Detail 列）
+            # ==========================================================
+            if isinstance(shift_feats, dict) and shift_feats:
+                for f, delta in sorted(shift_feats.items(), key=lambda x: float(x[1])):
+                    d = float(delta)
+                    yield {
+                        "Stage": "ShiftFlop",
+                        "Flop": flop_str,
+                        "Turn": "",
+                        "Detail": str(f),
+                        "Shift": round(d, 2),
+                        "Winrate": round(float(static_wr_pf) + d, 2),
+                        "CI": flop_ci,
+                        "Features": "",
+                        "Role": "",
+                        "Hand": hand_str,
+                        "Weight": flop_weight
+                    }
+            else:
+                yield {
+                    "Stage": "ShiftFlop",
+                    "Flop": flop_str,
+                    "Turn": "",
+                    "Detail": "―",
+                    "Shift": "",
+                    "Winrate": round(float(static_wr_flop), 2),
+                    "CI": flop_ci,
+                    "Features": "",
+                    "Role": "",
+                    "Hand": hand_str,
+                    "Weight": flop_weight
+                }
+
+            # ==========================================================
+            # ShiftTurn
+            # ==========================================================
+            turn_wr_dict = {}   # { 'Tc': 96.05, ... }
+
+            if hand_str in auto_turn and i < len(auto_turn[hand_str]):
+                turn_items = auto_turn[hand_str][i] or []
+
+                for t in turn_items:
+                    if not isinstance(t, dict):
+                        continue
+
+                    tc = t.get("turn_card")
+                    wr = t.get("winrate")
+                    if tc is None or wr is None:
+                        continue
+
+                    turn_wr_dict[str(tc)] = float(wr)
+
+                    made = t.get("hand_rank", "―")
+                    if made == "high_card":
+                        made = "―"
+
+                    feats = [fx for fx in t.get("features", []) if str(fx).startswith("newmade_")]
+                    if not feats:
+                        feats = ["―"]
+
+                    try:
+                        shift_t = round(float(wr) - float(static_wr_flop), 2)
+                        wr_out = round(float(wr), 2)
+                    except Exception:
+                        shift_t, wr_out = "", wr
+
+                    yield {
+                        "Stage": "ShiftTurn",
+                        "Flop": flop_str,
+                        "Turn": str(tc),
+                        "Detail": str(tc),
+                        "Shift": shift_t,
+                        "Winrate": wr_out,
+                        "CI": t.get("ci", ""),
+                        "Features": ", ".join(feats),
+                        "Role": made,
+                        "Hand": hand_str,
+                        "Weight": flop_weight
+                    }
+
+            # ==========================================================
+            # ShiftRiver（ターン勝率基準）
+            # ==========================================================
+            if hand_str in auto_river and i < len(auto_river[hand_str]):
+                river_blocks = auto_river[hand_str][i] or []
+
+                for block in river_blocks:
+                    if not isinstance(block, dict):
+                        continue
+
+                    turn_card = str(block.get("turn_card", "―"))
+                    river_items = block.get("all", []) or []
+
+                    # ターン基準（無ければフロップ勝率でフォールバック）
+                    baseline_turn_wr = turn_wr_dict.get(turn_card, float(static_wr_flop))
+
+                    seen_rivers = set()
+                    for item in river_items:
+                        if not isinstance(item, dict):
+                            continue
+
+                        rc = item.get("river_card")
+                        if rc is None:
+                            continue
+                        rc = str(rc)
+
+                        if rc in seen_rivers:
+                            continue
+                        seen_rivers.add(rc)
+
+                        made = item.get("hand_rank", "―")
+                        if made == "high_card":
+                            made = "―"
+
+                        feats = [fx for fx in item.get("features", []) if str(fx).startswith("newmade_")]
+                        if not feats:
+                            feats = ["―"]
+
+                        wr = item.get("winrate")
+                        if wr is not None:
+                            try:
+                                wr_out = round(float(wr), 2)
+                                # ★ ShiftRiver は「リバー勝率 − ターン勝率」
+                                shift_r = round(float(wr) - float(baseline_turn_wr), 2)
+                            except Exception:
+                                wr_out, shift_r = wr, ""
+                        else:
+                            wr_out, shift_r = "―", ""
+
+                        yield {
+                            "Stage": "ShiftRiver",
+                            "Flop": flop_str,
+                            "Turn": turn_card,
+                            "Detail": rc,
+                            "Shift": shift_r,
+                            "Winrate": wr_out,
+                            "CI": item.get("ci", ""),
+                            "Features": ", ".join(feats),
+                            "Role": made,
+                            "Hand": hand_str,
+                            "Weight": flop_weight
+                        }
@@ -0,0 +1,152 @@
+# runout_tree.py
+#
+# フロップ → ターン → リバー のランアウトツリー。
+# ヒーローのハンドとフロップを固定し、(ボード5枚, 相手ハンド) の葉を 1 回ずつだけ評価して
+# リバー勝率 → ターン勝率 → フロップ勝率 へと平均で積み上げる。
+# 3 ストリートが同じ葉から計算されるため、互いに矛盾しない。
+
+import copy
+
+import numpy as np
+
+import batch_eval
+import cards
+import iso_cache
+from hand_utils import hand_str_to_cards
+
+
+class RunoutTree:
+    """
+    hole_cards（eval7.Card 2枚）と flop_cards（3枚）に対する全ランアウトの勝率表。
+    - river_equity(turn, river): ボード5枚時点の勝率（相手ハンド全列挙）
+    - turn_equity(turn): リバー全列挙の平均
+    - flop_equity(): ターン全列挙の平均
+    """
+
+    def __init__(self, hole_cards, flop_cards):
+        self.hole_cards = list(hole_cards)
+        self.flop_cards = cards.to_cards(flop_cards)
+
+        self.remaining = batch_eval.live_codes(self.hole_cards + self.flop_cards)
+        self._index = {int(code): i for i, code in enumerate(self.remaining)}
+        self._code_map = None  # スート同型の別局面として参照するときの写像
+        self.river_matrix = self._build()
+
+        n = len(self.remaining)
+        off_diag = ~np.eye(n, dtype=bool)
+        self.turn_equities = (self.river_matrix * off_diag).sum(axis=1) / (n - 1)
+        self.flop_winrate = float(self.turn_equities.mean())
+
+    def _build(self):
+        n = len(self.remaining)
+        hole = batch_eval.cards_to_codes(self.hole_cards)
+        flop = batch_eval.cards_to_codes(self.flop_cards)
+
+        # ターン・リバーの組（順不同）ごとのヒーロースコア
+        pairs = batch_eval.combination_indices(n, 2)
+        pair_id = np.full((n, n), -1, dtype=np.int64)
+        pair_id[pairs[:, 0], pairs[:, 1]] = np.arange(len(pairs))
+        pair_id[pairs[:, 1], pairs[:, 0]] = np.arange(len(pairs))
+        hero_scores = batch_eval.evaluate_batch(np.column_stack([
+            np.broadcast_to(np.concatenate([hole, flop]), (len(pairs), 5)), self.remaining[pairs]]))
+
+        # 相手の7枚 = フロップ + 残り4枚（相手2枚 + ターン + リバー）。
+        # 4枚組ごとに1回だけ評価し、どの2枚をボードとみなすかの6通りで勝敗を振り分ける。
+        quads = batch_eval.combination_indices(n, 4)
+        opp_scores = batch_eval.evaluate_batch(np.column_stack([
+            np.broadcast_to(flop, (len(quads), 3)), self.remaining[quads]]))
+
+        points = np.zeros(len(pairs))
+        for a, b in ((0, 1), (0, 2), (0, 3), (1, 2), (1, 3), (2, 3)):
+            ids = pair_id[quads[:, a], quads[:, b]]
+            hs = hero_scores[ids]
+            pts = (hs > opp_scores) + 0.5 * (hs == opp_scores)
+            points += np.bincount(ids, weights=pts, minlength=len(pairs))
+
+        combos_per_board = (n - 2) * (n - 3) // 2
+        equity = points / combos_per_board * 100
+
+        matrix = np.zeros((n, n))
+        matrix[pairs[:, 0], pairs[:, 1]] = equity
+        matrix[pairs[:, 1], pairs[:, 0]] = equity
+        return matrix
+
+    def _idx(self, card):
+        code = cards.code(card)
+        if self._code_map is not None:
+            code = int(self._code_map[code])
+        return self._index[code]
+
+    def relabeled(self, hole_cards, flop_cards, code_map):
+        """
+        スートを入れ替えた同型局面として参照するビューを返す（葉は再計算しない）。
+        code_map: 新しい局面のカードコード → このツリーのカードコード
+        """
+        view = copy.copy(self)
+        view.hole_cards = list(hole_cards)
+        view.flop_cards = list(flop_cards)
+        view._code_map = code_map if self._code_map is None else self._code_map[code_map]
+        return view
+
+    def flop_equity(self):
+        return self.flop_winrate
+
+    def turn_equity(self, turn):
+        return float(self.turn_equities[self._idx(turn)])
+
+    def river_equity(self, turn, river):
+        return float(self.river_matrix[self._idx(turn), self._idx(river)])
+
+
+def build_runout_tree(hand_str, flop_cards):
+    """
+    ハンド文字列（例: 'AKs'）とフロップからツリーを作る。
+    スート同型の局面が iso_cache.tree_memo にあれば、それを付け替えて再利用する。
+    """
+    hole = hand_str_to_cards(hand_str)
+    flop = cards.to_cards(flop_cards)
+    key, perm = iso_cache.canonical_form(hole, flop)
+
+    cached = iso_cache.tree_memo.get(key)
+    if cached is None:
+        tree = RunoutTree(hole, flop)
+        iso_cache.tree_memo.put(key, (tree, perm))
+        return tree
+
+    tree, tree_perm = cached
+    # 新局面のコード → 正規形 → キャッシュ済みツリーのコード
+    inverse = np.empty(52, dtype=np.int64)
+    inverse[tree_perm] = np.arange(52)
+    return tree.relabeled(hole, flop, inverse[perm])
+
+
+class LazyRunoutTree:
+    """
+    build_runout_tree を、勝率が初めて要るときまで遅らせる代理（RunoutTree と同じ参照メソッド）。
+    hole_cards / flop_cards はすぐ読めるので、result_cache のキー作りだけならツリーを作らない。
+    フロップ・ターン・リバーがすべてキャッシュに当たった (ハンド, フロップ) はツリーを作らずに済む。
+    """
+
+    def __init__(self, hand_str, flop_cards):
+        self.hand_str = hand_str
+        self.hole_cards = hand_str_to_cards(hand_str)
+        self.flop_cards = cards.to_cards(flop_cards)
+        self._tree = None
+
+    @property
+    def built(self):
+        return self._tree is not None
+
+    def tree(self):
+        if self._tree is None:
+            self._tree = build_runout_tree(self.hand_str, self.flop_cards)
+        return self._tree
+
+    def flop_equity(self):
+        return self.tree().flop_equity()
+
+    def turn_equity(self, turn):
+        return self.tree().turn_equity(turn)
+
+    def river_equity(self, turn, river):
+        return self.tree().river_equity(turn, river)
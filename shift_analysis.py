@@ -0,0 +1,275 @@
+# shift_analysis.py
+#
+# Shift 結果 CSV（app.py の「CSV保存」の出力）の集計。
+# Features / Detail 列の newmade_* を役（hc 別）と特徴に分け、Shift のバケットごとの件数と
+# Shift・Winrate の平均・標準偏差を求める。
+# 重要度サンプリング（importance.py）の結果は Weight 列の重みで重み付き平均・標準誤差を求める
+# （analyze_weighted）。
+# 行ごとのループは使わず、セルの値（種類は少ない）ごとに分割・抽出してから
+# 行へ展開し、groupby 1 回で集計する。
+
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# ====== 定義 ======
+MADE_ROLES = {
+    "newmade_set", "newmade_straight", "newmade_flush", "newmade_full_house",
+    "newmade_two_pair", "newmade_pair", "newmade_quads", "newmade_straight_flush",
+}
+EXCLUDED_FEATURES = {"newmade_rainbow", "newmade_two_tone", "newmade_monotone"}
+ROLE_RE = re.compile(r'^(newmade_[a-z_]+?)(?:_hc([0-2]))?$')
+
+# 読み込み時に型を決めておく文字列列（Shift / Winrate は従来どおり推定に任せる）
+TEXT_COLUMNS = ("Stage", "Flop", "Turn", "Detail", "Features", "Role", "Hand")
+
+SUMMARY_COLUMNS = ["平均Shift", "Shift標準偏差", "平均Winrate", "Winrate標準偏差"]
+
+def make_buckets(start: int, end: int, step: int):
+    return [f"{v}%以上〜{v+step}%未満" for v in range(start, end, step)]
+
+BUCKETS = ["-100%未満"] + make_buckets(-100, 100, 10) + ["100%以上"]
+
+def get_bucket(v) -> str | None:
+    try:
+        x = float(v)
+    except Exception:
+        return None
+    if pd.isna(x): return None
+    if x < -100:  return "-100%未満"
+    if x >= 100:  return "100%以上"
+    lo = int(x // 10) * 10
+    return f"{lo}%以上〜{lo+10}%未満"
+
+def _split_items(cell) -> list[str]:
+    if cell is None or (isinstance(cell, float) and pd.isna(cell)):
+        return []
+    s = str(cell).strip()
+    if not s or s == "―":
+        return []
+    s = s.strip("[]")
+    return [x.strip() for x in s.split(",") if x.strip()]
+
+def collect_newmade_items(row) -> list[str]:
+    items = []
+    if "Features" in row: items += _split_items(row["Features"])
+    if "Detail"   in row: items += _split_items(row["Detail"])
+    return [it for it in items if str(it).startswith("newmade_")]
+
+def category_key(item):
+    """
+    newmade_* 項目 → 集計のキー（役は role_key = newmade_xxx_hcN、特徴は newmade_xxx）。
+    集計しない項目（除外特徴・newmade_pair_hc2・ROLE_RE に合わない項目）は None。
+    """
+    m = ROLE_RE.match(item)
+    if m is None or item in EXCLUDED_FEATURES:
+        return None
+    base, hc = m.groups()
+    if base in MADE_ROLES:
+        if base == "newmade_pair" and hc == "2":
+            return None
+        return f"{base}_hc{hc or 'none'}"
+    return base
+
+# ====== 読み込み ======
+def read_shift_files(files, workers=None):
+    """複数の CSV（パスまたはファイルオブジェクト）を並列に読み、1 つの DataFrame にする"""
+    dtype = {c: "category" for c in TEXT_COLUMNS}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        frames = list(pool.map(lambda f: pd.read_csv(f, dtype=dtype), files))
+    return pd.concat(frames, ignore_index=True)
+
+# ====== 行 → 項目への展開 ======
+def _to_float(series):
+    """float(v) と同じ変換。(値, 変換できたか) の配列を返す（値の種類ごとに 1 回だけ変換）"""
+    if pd.api.types.is_numeric_dtype(series) and not isinstance(series.dtype, pd.CategoricalDtype):
+        return series.to_numpy(dtype=float), np.ones(len(series), dtype=bool)
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    values = np.full(len(uniques), np.nan)
+    ok = np.zeros(len(uniques), dtype=bool)
+    for i, v in enumerate(uniques):
+        try:
+            values[i] = float(v)
+            ok[i] = True
+        except Exception:
+            pass
+    return values[codes], ok[codes]
+
+def _buckets(shift):
+    """get_bucket の配列版（NaN は None）"""
+    labels = np.array(BUCKETS + [None], dtype=object)
+    idx = np.full(len(shift), len(BUCKETS))
+    with np.errstate(invalid="ignore"):
+        middle = (shift >= -100) & (shift < 100)
+        idx[shift < -100] = 0
+        idx[shift >= 100] = len(BUCKETS) - 1
+        idx[middle] = (shift[middle] // 10).astype(np.int64) + 11
+    return labels[idx]
+
+def _cell_items(series):
+    """
+    列のセルを newmade_* 項目に分割する。
+    戻り値: (行ごとの値コード, 値コードごとの項目数, 全項目を値コード順に並べた配列)
+    分割はセルの値の種類ごとに 1 回（str.split → explode）。
+    """
+    codes, uniques = pd.factorize(series)
+    cells = pd.Series(np.asarray(uniques, dtype=object)).map(str).str.strip()
+    cells = cells.mask(cells.eq("―"), "").str.strip("[]")
+    items = cells.str.split(",").explode().str.strip()
+    items = items[items.str.startswith("newmade_", na=False)]
+    counts = np.bincount(items.index.to_numpy(dtype=np.int64), minlength=len(uniques))
+    return codes, counts, items.to_numpy(dtype=object)
+
+def _expand(codes, counts, items, rows):
+    """rows の行それぞれの項目を並べた (行番号, 項目) の配列"""
+    counts = np.append(counts, 0)  # コード -1（欠損）は項目なし
+    codes = np.where(codes[rows] < 0, len(counts) - 1, codes[rows])
+    offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    lengths = counts[codes]
+    total = int(lengths.sum())
+    starts = np.repeat(offsets[codes] - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+    return np.repeat(rows, lengths), items[starts + np.arange(total)]
+
+def extract_role_items(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Shift が数値で Winrate が float にできる行の newmade_* 項目を 1 項目 1 行に展開する。
+    列: bucket, shift, winrate, base（newmade_xxx）, hc（'0'〜'2' または None）,
+        weight（Weight 列の重要度サンプリングの重み。列が無い・空の行は 1）,
+        unit（(Hand, Flop) ごとの番号。標準誤差をフロップ単位でまとめるのに使う）
+    並びは元の行順 → Features の項目 → Detail の項目（従来の iterrows と同じ）。
+    除外特徴（rainbow など）と ROLE_RE に合わない項目は落とす。
+    """
+    columns = ["bucket", "shift", "winrate", "base", "hc", "weight", "unit"]
+    if "Shift" not in df.columns or "Winrate" not in df.columns:
+        return pd.DataFrame(columns=columns)
+
+    shift, _ = _to_float(df["Shift"])
+    winrate, winrate_ok = _to_float(df["Winrate"])
+    rows = np.flatnonzero(~np.isnan(shift) & winrate_ok)
+
+    parts = [_expand(*_cell_items(df[col]), rows) for col in ("Features", "Detail") if col in df.columns]
+    if not parts:
+        return pd.DataFrame(columns=columns)
+    item_rows = np.concatenate([r for r, _ in parts])
+    item_values = np.concatenate([v for _, v in parts])
+    order = np.argsort(item_rows, kind="stable")  # Features → Detail の順を保ったまま行順に
+    item_rows, item_values = item_rows[order], item_values[order]
+
+    # 項目の種類ごとに ROLE_RE で base / hc を取り出す
+    item_codes, unique_items = pd.factorize(pd.Series(item_values, dtype=object))
+    extracted = pd.Series(unique_items, dtype=object).str.extract(ROLE_RE)
+    base = extracted[0].to_numpy(dtype=object)
+    hc = extracted[1].to_numpy(dtype=object)
+    keep = pd.notna(base) & ~np.isin(unique_items, list(EXCLUDED_FEATURES))
+    keep = keep[item_codes]
+
+    item_rows, item_codes = item_rows[keep], item_codes[keep]
+    hc = hc[item_codes]
+    weight = np.ones(len(df))
+    if "Weight" in df.columns:
+        values, _ = _to_float(df["Weight"])
+        weight = np.where(np.isnan(values), 1.0, values)
+    unit = pd.MultiIndex.from_arrays([df[c].astype(object) if c in df.columns else pd.Series([None] * len(df))
+                                      for c in ("Hand", "Flop")]).factorize()[0]
+    return pd.DataFrame({
+        "bucket": _buckets(shift)[item_rows],
+        "shift": shift[item_rows],
+        "winrate": winrate[item_rows],
+        "base": base[item_codes],
+        "hc": np.where(pd.isna(hc), None, hc),
+        "weight": weight[item_rows],
+        "unit": unit[item_rows],
+    })
+
+# ====== 集計 ======
+def _summarize(df, key):
+    """key ごとのバケット件数と Shift / Winrate の平均・標準偏差（平均Shift の降順）"""
+    summary = df.groupby([key, "bucket"]).size().unstack(fill_value=0)
+    stats = df.groupby(key).agg(s_mean=("shift", "mean"), s_std=("shift", "std"),
+                                w_mean=("winrate", "mean"), w_std=("winrate", "std")).round(2)
+    for col, stat in zip(SUMMARY_COLUMNS, ["s_mean", "s_std", "w_mean", "w_std"]):
+        summary[col] = stats[stat]
+    cols = [c for c in BUCKETS if c in summary.columns]
+    summary = summary.reindex(columns=cols + SUMMARY_COLUMNS)
+    return summary.sort_values("平均Shift", ascending=False)
+
+def _roles_and_features(items):
+    """項目を (役（role_key 列）, 特徴（feature 列）) に分ける（newmade_pair_hc2 は落とす）"""
+    is_role = items["base"].isin(MADE_ROLES).to_numpy()
+    pair_hc2 = ((items["base"] == "newmade_pair") & (items["hc"] == "2")).to_numpy()
+    rest = ["bucket", "shift", "winrate", "weight", "unit"]
+
+    roles = items[is_role & ~pair_hc2]
+    df_role = roles[rest].assign(role_key=roles["base"] + "_hc" + roles["hc"].fillna("none"))
+    feats = items[~is_role]
+    df_feat = feats[rest].assign(feature=feats["base"])
+    return df_role, df_feat
+
+def analyze_roles_and_features(df: pd.DataFrame):
+    """(役（hc 別）の集計, 特徴の集計) を返す"""
+    if "Shift" not in df.columns or "Winrate" not in df.columns:
+        return pd.DataFrame(), pd.DataFrame()
+
+    df_role, df_feat = _roles_and_features(extract_role_items(df))
+    summary_roles = _summarize(df_role, "role_key") if not df_role.empty else pd.DataFrame()
+    summary_feats = _summarize(df_feat, "feature") if not df_feat.empty else pd.DataFrame()
+    return summary_roles, summary_feats
+
+def _summarize_weighted(df, key):
+    """
+    key ごとの重み付き平均（比推定 Σ w·x / Σ w）と標準誤差。
+    標準誤差はデルタ法で、同じ (Hand, Flop) の行は独立でないので unit ごとにまとめて求める。
+    """
+    df = df.assign(ws=df["weight"] * df["shift"], ww=df["weight"] * df["winrate"], w2=df["weight"] ** 2)
+    sums = df.groupby(key).agg(n=("shift", "size"), w=("weight", "sum"), ws=("ws", "sum"), ww=("ww", "sum"),
+                               w2=("w2", "sum"), units=("unit", "nunique"))
+    mean = sums["ws"] / sums["w"]
+    resid = df["weight"] * (df["shift"] - df[key].map(mean))
+    per_unit = resid.groupby([df[key], df["unit"]]).sum()
+    # フロップが 1 つだけのキーは標準誤差を出さない（NaN）
+    var = (per_unit ** 2).groupby(level=0).sum() * sums["units"] / (sums["units"] - 1).replace(0, np.nan)
+    summary = pd.DataFrame({
+        "件数": sums["n"],
+        "有効標本数": (sums["w"] ** 2 / sums["w2"]).round(1),
+        "加重平均Shift": mean.round(2),
+        "標準誤差": (np.sqrt(var) / sums["w"]).round(2),
+        "加重平均Winrate": (sums["ww"] / sums["w"]).round(2),
+    })
+    return summary.sort_values("加重平均Shift", ascending=False)
+
+def analyze_weighted(df: pd.DataFrame):
+    """
+    重要度サンプリング（Weight 列）の重みを使った (役（hc 別）, 特徴) ごとの平均Shift と標準誤差。
+    Weight 列が無い CSV は重み 1（普通の平均とフロップ単位の標準誤差）になる。
+    """
+    if "Shift" not in df.columns or "Winrate" not in df.columns:
+        return pd.DataFrame(), pd.DataFrame()
+
+    df_role, df_feat = _roles_and_features(extract_role_items(df))
+    summary_roles = _summarize_weighted(df_role, "role_key") if not df_role.empty else pd.DataFrame()
+    summary_feats = _summarize_weighted(df_feat, "feature") if not df_feat.empty else pd.DataFrame()
+    return summary_roles, summary_feats
+
+def _summarize_group(df):
+    """バケットごとの件数（全バケット）に 平均Shift / 標準偏差 / 平均Winrate の行を足したもの"""
+    summary = df.groupby("bucket").size().reindex(BUCKETS, fill_value=0).to_frame(name="count")
+    summary.loc["平均Shift"] = df["shift"].mean().round(2)
+    summary.loc["標準偏差"] = df["shift"].std().round(2)
+    summary.loc["平均Winrate"] = df["winrate"].mean().round(2)
+    return summary
+
+def analyze_by_hc_groups(df: pd.DataFrame, selected_roles):
+    """選択した役を混ぜて hc0 / hc1 / hc2 / total ごとに集計する（hc なしは hc0）"""
+    items = extract_role_items(df)
+    selected = items["base"].isin(set(selected_roles)) & ~((items["base"] == "newmade_pair") & (items["hc"] == "2"))
+    items = items[selected]
+    group = items["hc"].map({"1": "hc1", "2": "hc2"}).fillna("hc0")
+
+    summaries = {}
+    for key in ("hc0", "hc1", "hc2"):
+        df_hc = items[(group == key).to_numpy()]
+        summaries[key] = _summarize_group(df_hc) if not df_hc.empty else pd.DataFrame()
+    summaries["total"] = _summarize_group(items) if not items.empty else pd.DataFrame()
+    return summaries
@@ -1,20 +1,18 @@
 import random
 import eval7
+import numpy as np
 from preflop_winrates_random import get_static_preflop_winrate
 from board_patterns import classify_flop_turn_pattern
 from flop_generator import generate_flops_by_type
-import itertools
-from collections import Counter
-
-def convert_rank_to_value(rank):
-    rank_map = {
-        '2': 2, '3': 3, '4': 4, '5': 5, '6': 6,
-        '7': 7, '8': 8, '9': 9, 'T': 10,
-        'J': 11, 'Q': 12, 'K': 13, 'A': 14
-    }
-    if isinstance(rank, int):
-        return rank
-    return rank_map[str(rank)]
+import batch_eval
+import cards
+import iso_cache
+import mc_stats
+import multiway
+import result_cache
+from deck_sampler import DeckSampler
+from made_hand import classify_made_hand
+from runout_tree import RunoutTree
 
 def hand_str_to_cards(hand_str):
     rank1, rank2 = hand_str[0], hand_str[1]
@@ -28,208 +26,251 @@ def hand_str_to_cards(hand_str):
     else:
         return [eval7.Card(rank1 + suits[0]), eval7.Card(rank2 + suits[1])]
 
-def simulate_vs_random(my_hand, opp_hand, board, iterations=20):
+def simulate_vs_random(my_hand, opp_hand, board, iterations=20, engine="eval7", tolerance=None):
+    """
+    tolerance（標準誤差, %ポイント）を指定すると iterations を上限にバッチ単位で打ち切る。
+    """
+    return simulate_vs_random_stats(my_hand, opp_hand, board, iterations, engine, tolerance).equity
+
+def simulate_vs_random_stats(my_hand, opp_hand, board, iterations=20, engine="eval7", tolerance=None):
+    """simulate_vs_random と同じ計算を mc_stats.EquityStats で返す"""
+    if engine == "numpy":
+        sample = lambda n: _sample_vs_random_numpy(my_hand, opp_hand, board, n)
+    else:
+        sample = lambda n: _sample_vs_random(my_hand, opp_hand, board, n)
+    return mc_stats.run_adaptive(sample, iterations, tolerance)
+
+def _sample_vs_random(my_hand, opp_hand, board, iterations):
     wins = ties = 0
-    used_cards = set(my_hand + opp_hand + board)
+    sampler = DeckSampler(my_hand + opp_hand + board)
+    k = 5 - len(board)
+    # 7枚の入れ物を1回だけ作り、ランアウト部分だけ書き換える
+    my7 = my_hand + board + [None] * k
+    opp7 = opp_hand + board + [None] * k
+    base = 2 + len(board)
     for _ in range(iterations):
-        deck = [card for card in eval7.Deck() if card not in used_cards]
-        random.shuffle(deck)
-        full_board = board + deck[:5 - len(board)]
-        my_val = eval7.evaluate(my_hand + full_board)
-        opp_val = eval7.evaluate(opp_hand + full_board)
+        buf = sampler.draw(k)
+        for i in range(k):
+            my7[base + i] = opp7[base + i] = buf[i]
+        my_val = eval7.evaluate(my7)
+        opp_val = eval7.evaluate(opp7)
         if my_val > opp_val:
             wins += 1
         elif my_val == opp_val:
             ties += 1
-    return (wins + ties / 2) / iterations * 100
-
-# ========= 厳密な役判定（ベスト5ベース）＋短枚数対応 =========
-
-def best5_from_seven(cards7):
-    """len(cards7) >= 5 を前提にベスト5を返す"""
-    best = None
-    best_score = -1
-    for comb in itertools.combinations(cards7, 5):
-        sc = eval7.evaluate(list(comb))
-        if sc > best_score:
-            best_score = sc
-            best = list(comb)
-    return best
-
-def _values(card_list, unique=False, desc=True):
-    vals = [convert_rank_to_value(c.rank) for c in card_list]
-    vals = sorted(set(vals) if unique else vals, reverse=desc)
-    return vals
-
-def _is_straight_from_values(values_unique_desc):
-    # 5連番
-    for i in range(len(values_unique_desc) - 4):
-        window = values_unique_desc[i:i+5]
-        if window[0] - window[4] == 4 and len(set(window)) == 5:
-            return True
-    # A-5 ホイール
-    s = set(values_unique_desc)
-    return {14, 5, 4, 3, 2}.issubset(s)
-
-def classify5(cards5):
-    """5枚固定から役名を返す"""
-    ranks = [c.rank for c in cards5]
-    suits = [c.suit for c in cards5]
-    rc = Counter(ranks)
-    sc = Counter(suits)
-
-    is_flush = any(cnt >= 5 for cnt in sc.values())
-    uvals = _values(cards5, unique=True)
-
-    # ストフラ
-    if is_flush:
-        flush_suit = max(sc, key=lambda k: sc[k])
-        suited = [c for c in cards5 if c.suit == flush_suit]
-        su = _values(suited, unique=True)
-        if _is_straight_from_values(su):
-            return "straight_flush"
-
-    counts_sorted = sorted(rc.values(), reverse=True)
-    if counts_sorted[0] == 4:
-        return "quads"
-    if counts_sorted[0] == 3 and counts_sorted[1] == 2:
-        return "full_house"
-    if is_flush:
-        return "flush"
-    if _is_straight_from_values(uvals):
-        return "straight"
-    if counts_sorted[0] == 3:
-        return "set"
-    if counts_sorted[0] == 2 and counts_sorted[1] == 2:
-        return "two_pair"
-    if counts_sorted[0] == 2:
-        return "pair"
-    return "high_card"
-
-def detect_made_hand(hole_cards, board_cards):
-    """
-    役名とホールカード貢献枚数(hc)を返す。
-    - 5枚未満のときは安全に簡易判定（プリフロップ: ポケペア=pair / それ以外=high_card）
-    - 5枚以上のときは ベスト5→classify5 で厳密判定
-    """
-    seven = hole_cards + board_cards
-
-    # --- 5枚未満（プリフロップやターン前など） ---
-    if len(seven) < 5:
-        # プリフロップ想定：ポケットペアのみ pair とする
-        if len(hole_cards) == 2 and hole_cards[0].rank == hole_cards[1].rank:
-            return "pair", 2  # 両方関与
-        else:
-            return "high_card", 0
-
-    # --- 厳密（5枚以上） ---
-    best5 = best5_from_seven(seven)
-    hand_name = classify5(best5)
-
-    # ベスト5に入っているホールカード枚数 = 基本のhc
-    best5_set = set(best5)
-    hc_in_best5 = sum(1 for c in hole_cards if c in best5_set)
-
-    if hand_name in ["straight", "straight_flush", "flush"]:
-        hole_contrib = min(hc_in_best5, 2)
-    elif hand_name in ["pair", "two_pair", "set", "full_house", "quads"]:
-        # ランク一致で“役に絡んでいる”ホールカードを数える（ベスト5内）
-        ranks_best5 = [c.rank for c in best5]
-        rc = Counter(ranks_best5)
-        contrib = 0
-        for hc in hole_cards:
-            if hc in best5_set and rc[hc.rank] >= 2:
-                contrib += 1
-        hole_contrib = min(contrib, 2)
-    else:
-        hole_contrib = 0
-
-    return hand_name, hole_contrib
-
-# ============================================================
-
-def is_straight(values):
-    unique = sorted(set(values), reverse=True)
-    for i in range(len(unique) - 4):
-        if unique[i] - unique[i + 4] == 4:
-            return True
-    if set([14, 2, 3, 4, 5]).issubset(set(values)):
-        return True
-    return False
-
-def simulate_shift_flop_montecarlo(hand_str, flop_type, trials=10000):
+    return wins, ties
+
+def _sample_vs_random_numpy(my_hand, opp_hand, board, iterations):
+    runouts = DeckSampler(my_hand + opp_hand + board).draw_batch(iterations, 5 - len(board))
+    board_codes = np.broadcast_to(batch_eval.cards_to_codes(board), (iterations, len(board)))
+    my_scores = batch_eval.evaluate_batch(np.column_stack(
+        [np.broadcast_to(batch_eval.cards_to_codes(my_hand), (iterations, 2)), board_codes, runouts]))
+    opp_scores = batch_eval.evaluate_batch(np.column_stack(
+        [np.broadcast_to(batch_eval.cards_to_codes(opp_hand), (iterations, 2)), board_codes, runouts]))
+    return batch_eval.outcome_counts(my_scores, opp_scores)
+
+# tolerance 指定時に打ち切り判定する間隔（外側の試行数）
+ADAPTIVE_CHECK_EVERY = 100
+
+def simulate_shift_flop_montecarlo(hand_str, flop_type, trials=10000, engine="eval7",
+                                   tolerance=None, return_ci=False, opponents=1):
     hole_cards = hand_str_to_cards(hand_str)
-    static_wr = get_static_preflop_winrate(hand_str)
+    static_wr = get_static_preflop_winrate(hand_str, opponents)
     feature_shifts = {}
-    total_wr = 0
+    running = mc_stats.RunningMean()
 
     candidate_flops = generate_flops_by_type(flop_type)
+    made_preflop, _ = classify_made_hand(hole_cards, [])
+    flop_features = {}  # 特徴量はフロップごとに1回だけ判定する
 
     for _ in range(trials):
         flop_raw = random.choice(candidate_flops)
-        flop = [eval7.Card(str(c)) for c in flop_raw]
-        used_ids = set(str(c) for c in hole_cards + flop)
-        deck = [card for card in eval7.Deck() if str(card) not in used_ids]
-
-        opp_hand = random.sample(deck, 2)
-        winrate = simulate_vs_random(hole_cards, opp_hand, flop, iterations=20)
-        total_wr += winrate
+        flop = cards.to_cards(flop_raw)
+        if opponents > 1:
+            winrate = multiway.equity(hole_cards, flop, opponents, 20)
+        else:
+            opp_hand = DeckSampler(hole_cards + flop).draw(2)[:2]
+            winrate = simulate_vs_random(hole_cards, opp_hand, flop, iterations=20, engine=engine)
+        running.add(winrate)
         shift = winrate - static_wr
 
-        features = []
-        made_preflop, _ = detect_made_hand(hole_cards, [])
-        made_flop, hole_contrib = detect_made_hand(hole_cards, flop)
+        key = tuple(flop_raw)
+        if key not in flop_features:
+            flop_features[key] = flop_row_features(hole_cards, flop, made_preflop)
 
-        if made_flop != made_preflop and made_flop != "high_card":
-            features.append(f"newmade_{made_flop}_hc{hole_contrib}")
-        else:
-            new_feats = classify_flop_turn_pattern(flop, turn=None)
-            features.extend(["newmade_" + f for f in new_feats])
-
-        for feat in features:
+        for feat in flop_features[key]:
             feature_shifts.setdefault(feat, []).append(shift)
 
+        if _precise_enough(running, tolerance):
+            break
+
     avg_shifts = {feat: round(sum(lst) / len(lst), 2) for feat, lst in feature_shifts.items()}
-    average_wr = total_wr / trials
-    return average_wr, avg_shifts
+    average_wr = running.mean
+    return _with_ci(average_wr, avg_shifts, running.ci95, return_ci)
 
-def simulate_shift_flop_montecarlo_specific(hand_str, flop, trials=10000):
-    flop = [eval7.Card(str(c)) for c in flop]
+def simulate_shift_flop_montecarlo_specific(hand_str, flop, trials=10000, engine="eval7",
+                                            tolerance=None, return_ci=False, opponents=1):
+    flop = cards.to_cards(flop)
     hole_cards = hand_str_to_cards(hand_str)
-    static_wr = get_static_preflop_winrate(hand_str)
-    feature_shifts = {}
-    total_wr = 0
-
-    for _ in range(trials):
-        used_ids = set(str(c) for c in hole_cards + flop)
-        deck = [card for card in eval7.Deck() if str(card) not in used_ids]
-
-        opp_hand = random.sample(deck, 2)
-        winrate = simulate_vs_random(hole_cards, opp_hand, flop, iterations=20)
-        total_wr += winrate
-        shift = winrate - static_wr
-
-        features = []
-        made_preflop, _ = detect_made_hand(hole_cards, [])
-        made_flop, hole_contrib = detect_made_hand(hole_cards, flop)
-
-        if made_flop != made_preflop and made_flop != "high_card":
-            features.append(f"newmade_{made_flop}_hc{hole_contrib}")
-        else:
-            new_feats = classify_flop_turn_pattern(flop, turn=None)
-            features.extend(["newmade_" + f for f in new_feats])
+    # スート同型の局面は iso_cache のメモから返す
+    average_wr, avg_shifts, ci = iso_cache.memoized(
+        "flop", hole_cards, flop,
+        lambda: _simulate_shift_flop_specific(hand_str, hole_cards, flop, trials, engine, tolerance, opponents),
+        params=(trials, engine, tolerance, opponents),
+    )
+    return _with_ci(average_wr, avg_shifts, ci, return_ci)
+
+def _simulate_shift_flop_specific(hand_str, hole_cards, flop, trials, engine, tolerance, opponents=1):
+    """
+    フロップ固定の ShiftFlop。相手ハンド（残り47枚の2枚組 = 1081通り）を全列挙し、
+    各組に同じ本数のランアウト（ターン・リバー）を割り当てて勝率を求める。
+    - 1組あたりの本数は ceil(trials / 組数)。全ランアウト数（C(45,2)=990）の 1/5 以上なら
+      RunoutTree の厳密計算の方が速いので、そちらを使う（誤差 0）
+    - tolerance 指定時は全組に1本ずつ追加するラウンドを重ね、標準誤差が tolerance 以下で打ち切る
+    - 勝ち・引き分け・試行数は result_cache.refined_stats に保存し、試行回数を増やした再実行では
+      足りない分だけ追加する
+    相手が複数人（opponents >= 2）のときは multiway で trials 回標本化する（engine は使わない）。
+    特徴量はフロップ固定なので1回だけ判定する。
+    """
+    static_wr = get_static_preflop_winrate(hand_str, opponents)
+    features = flop_row_features(hole_cards, flop)
+    if opponents > 1:
+        stats = result_cache.refined_stats(
+            "flop", hole_cards, flop, ("multiway", opponents),
+            lambda s, rng: multiway.equity_stats(hole_cards, flop, opponents, trials, tolerance,
+                                                 rng=batch_eval.make_rng(rng), stats=s),
+            trials, tolerance, batch_size=5000, new_stats=mc_stats.ShareStats)
+        avg_shifts = {feat: round(stats.equity - static_wr, 2) for feat in features}
+        return stats.equity, avg_shifts, stats.ci95
+
+    live = batch_eval.live_codes(hole_cards + flop)
+    combos = live[batch_eval.combination_indices(len(live), 2)]
+    n_runouts = (len(live) - 2) * (len(live) - 3) // 2
+    per_combo = -(-trials // len(combos))
+
+    if per_combo * 5 >= n_runouts:
+        winrate, ci = RunoutTree(hole_cards, flop).flop_equity(), 0.0
+    else:
+        def extend(stats, rng):
+            if engine == "numpy":
+                np_rng = batch_eval.make_rng(rng)
+                sample = lambda n: _sample_combos_numpy(hole_cards, flop, live, n // len(combos), np_rng)
+            else:
+                sample = lambda n: _sample_combos(hole_cards, flop, combos, n // len(combos), rng)
+            return mc_stats.run_adaptive(sample, per_combo * len(combos), tolerance, batch_size=len(combos),
+                                         stats=stats)
+
+        # 相手ハンド全組に同じ本数ずつ足す層化なので、保存済みの統計量にもそのまま足せる
+        stats = result_cache.refined_stats(
+            "flop", hole_cards, flop, ("combos",), extend,
+            per_combo * len(combos), tolerance, batch_size=len(combos))
+        winrate, ci = stats.equity, stats.ci95
+
+    avg_shifts = {feat: round(winrate - static_wr, 2) for feat in features}
+    return winrate, avg_shifts, ci
+
+def _sample_combos(hole_cards, flop, combos, per_combo, rng=None):
+    """相手ハンド全組 × per_combo 本のランアウト（eval7 で1ハンドずつ評価）"""
+    wins = ties = 0
+    sampler = DeckSampler(hole_cards + flop, rng)
+    my7 = hole_cards + flop + [None, None]
+    opp7 = [None, None] + flop + [None, None]
+    for a, b in combos:
+        opp7[0], opp7[1] = cards.CARDS[a], cards.CARDS[b]
+        for _ in range(per_combo):
+            buf = sampler.draw(2, exclude=opp7[:2])
+            my7[5] = opp7[5] = buf[0]
+            my7[6] = opp7[6] = buf[1]
+            my_val = eval7.evaluate(my7)
+            opp_val = eval7.evaluate(opp7)
+            if my_val > opp_val:
+                wins += 1
+            elif my_val == opp_val:
+                ties += 1
+    return wins, ties
+
+def _sample_combos_numpy(hole_cards, flop, live, per_combo, rng=None):
+    """相手ハンド全組 × per_combo 本のランアウトを NumPy でまとめて評価"""
+    pairs = batch_eval.combination_indices(len(live), 2)
+    n = len(pairs) * per_combo
+    first = np.repeat(pairs[:, 0], per_combo)[:, None]
+    second = np.repeat(pairs[:, 1], per_combo)[:, None]
+
+    # 相手の2枚を除いた 45 枚の位置から引き、live 上の位置へずらす（first < second）
+    idx = batch_eval.sample_without_replacement(np.arange(len(live) - 2), n, 2, rng)
+    idx = idx + (idx >= first)
+    idx = idx + (idx >= second)
+    runouts = live[idx]
+
+    flop_codes = np.broadcast_to(batch_eval.cards_to_codes(flop), (n, 3))
+    my_scores = batch_eval.evaluate_batch(np.column_stack(
+        [np.broadcast_to(batch_eval.cards_to_codes(hole_cards), (n, 2)), flop_codes, runouts]))
+    opp_scores = batch_eval.evaluate_batch(np.column_stack(
+        [live[first], live[second], flop_codes, runouts]))
+    return batch_eval.outcome_counts(my_scores, opp_scores)
+
+def flop_row_features(hole_cards, flop, made_preflop=None):
+    """フロップで付く特徴ラベル（newmade_役_hc / newmade_ボード特徴）"""
+    if made_preflop is None:
+        made_preflop, _ = classify_made_hand(hole_cards, [])
+    made_flop, hole_contrib = classify_made_hand(hole_cards, flop)
+
+    if made_flop != made_preflop and made_flop != "high_card":
+        return [f"newmade_{made_flop}_hc{hole_contrib}"]
+    return ["newmade_" + f for f in classify_flop_turn_pattern(flop, turn=None)]
+
+def _precise_enough(running, tolerance):
+    """外側の試行ごとの勝率の標準誤差が tolerance 以下になったか"""
+    if tolerance is None or running.n % ADAPTIVE_CHECK_EVERY:
+        return False
+    return running.stderr <= tolerance
+
+def _with_ci(average_wr, avg_shifts, ci, return_ci):
+    if return_ci:
+        return average_wr, avg_shifts, ci
+    return average_wr, avg_shifts
 
-        for feat in features:
-            feature_shifts.setdefault(feat, []).append(shift)
+def simulate_shift_flop_from_tree(hand_str, tree, return_ci=False):
+    """
+    RunoutTree（runout_tree.py）のフロップ勝率を使う厳密版。
+    特徴量はフロップ固定なので1回だけ判定する。
+    """
+    hole_cards = tree.hole_cards
+    flop = tree.flop_cards
+    static_wr = get_static_preflop_winrate(hand_str)
+    winrate = tree.flop_equity()
+    shift = winrate - static_wr
 
-    avg_shifts = {feat: round(sum(lst) / len(lst), 2) for feat, lst in feature_shifts.items()}
-    average_wr = total_wr / trials
-    return average_wr, avg_shifts
+    features = flop_row_features(hole_cards, flop)
+    avg_shifts = {feat: round(shift, 2) for feat in features}
+    return _with_ci(winrate, avg_shifts, 0.0, return_ci)
 
-def run_shift_flop(hand_str, flop_input, trials=10000):
-    if isinstance(flop_input, str):
-        return simulate_shift_flop_montecarlo(hand_str, flop_input, trials)
+def run_shift_flop(hand_str, flop_input, trials=10000, engine="eval7", tree=None,
+                   tolerance=None, return_ci=False, opponents=1):
+    """
+    tolerance: 標準誤差（%ポイント）の目標。指定すると trials を上限に早期終了する。
+    return_ci=True のときは (勝率, 特徴別シフト, 95%信頼区間の半幅) を返す。
+    opponents: ランダムハンドの相手人数。基準のプリフロップ勝率も同じ人数のものを使う。
+      ツリー（ヘッズアップ専用）は 2 人以上では使わない。
+    フロップ指定（またはツリー）のときは result_cache の永続キャッシュを使う。
+    """
+    static_wr = get_static_preflop_winrate(hand_str, opponents)
+    if tree is not None and opponents > 1:
+        flop_input, tree = list(tree.flop_cards), None
+    if tree is not None:
+        hole_cards, flop = tree.hole_cards, tree.flop_cards
+        params = ("exact", static_wr)
+        compute = lambda: simulate_shift_flop_from_tree(hand_str, tree, return_ci=True)
+    elif isinstance(flop_input, str):
+        return simulate_shift_flop_montecarlo(hand_str, flop_input, trials, engine, tolerance, return_ci,
+                                              opponents)
     elif isinstance(flop_input, list):
-        return simulate_shift_flop_montecarlo_specific(hand_str, flop_input, trials)
+        hole_cards, flop = hand_str_to_cards(hand_str), cards.to_cards(flop_input)
+        params = (engine, trials, tolerance, static_wr, opponents)
+        compute = lambda: simulate_shift_flop_montecarlo_specific(hand_str, flop, trials, engine, tolerance,
+                                                                  return_ci=True, opponents=opponents)
     else:
         raise ValueError("flop_input must be a string (flop type) or list (specific flop)")
+
+    average_wr, avg_shifts, ci = result_cache.cached("flop", hand_str, hole_cards, flop, params, compute)
+    return _with_ci(average_wr, avg_shifts, ci, return_ci)
@@ -2,124 +2,39 @@
 
 import eval7
 import random
+import numpy as np
 import pandas as pd
 import itertools
-from collections import Counter
+import board_patterns
 from board_patterns import classify_flop_turn_pattern
 from hand_utils import hand_str_to_cards
+import batch_eval
+import cards
+import crn
+import iso_cache
+import mc_stats
+import multiway
+import result_cache
+from made_hand import classify_made_hand
+from cards import rank_value as convert_rank_to_value
 
 # =============================
 # Utility
 # =============================
 
-def convert_rank_to_value(rank):
-    rank_map = {'2':2,'3':3,'4':4,'5':5,'6':6,
-                '7':7,'8':8,'9':9,'T':10,'J':11,'Q':12,'K':13,'A':14}
-    if isinstance(rank, int):
-        return rank
-    return rank_map[str(rank)]
-
 def ensure_card(c):
     """文字列でも Card でも eval7.Card を返す"""
-    if isinstance(c, eval7.Card):
-        return c
-    return eval7.Card(str(c))
+    return cards.card(c)
 
 def generate_turns(flop_cards, hole_cards, n_turns=None):
-    used = {str(c) for c in flop_cards + hole_cards}
-    deck = [c for c in eval7.Deck() if str(c) not in used]
+    deck = cards.live_cards(flop_cards + hole_cards)
     if n_turns is None or n_turns >= len(deck):
         return deck
     random.shuffle(deck)
     return deck[:n_turns]
 
 def generate_rivers(board4, hole_cards):
-    used = {str(c) for c in board4 + hole_cards}
-    return [c for c in eval7.Deck() if str(c) not in used]
-
-
-# =============================
-# ベスト5 → 役判定（厳密）
-# =============================
-
-def best5_from_seven(cards7):
-    """6～7枚から eval7 の最高点 5 枚を返す"""
-    best = None
-    best_score = -1
-    for comb in itertools.combinations(cards7, 5):
-        sc = eval7.evaluate(list(comb))
-        if sc > best_score:
-            best_score = sc
-            best = list(comb)
-    return best
-
-def _values(cards, unique=False):
-    vals = [convert_rank_to_value(c.rank) for c in cards]
-    if unique:
-        vals = sorted(set(vals), reverse=True)
-    else:
-        vals = sorted(vals, reverse=True)
-    return vals
-
-def _is_straight_from_values(uniq_vals):
-    # 5連番 or A-5 wheel
-    for i in range(len(uniq_vals) - 4):
-        w = uniq_vals[i:i+5]
-        if w[0] - w[4] == 4 and len(set(w)) == 5:
-            return True
-    return {14, 5, 4, 3, 2}.issubset(set(uniq_vals))
-
-def classify5(cards5):
-    """5 枚固定から役名を返す"""
-    ranks = [c.rank for c in cards5]
-    suits = [c.suit for c in cards5]
-    rc = Counter(ranks)
-    sc = Counter(suits)
-    uniq_vals = _values(cards5, unique=True)
-
-    is_flush = any(v >= 5 for v in sc.values())
-    is_straight = _is_straight_from_values(uniq_vals)
-
-    # ストレートフラッシュ判定
-    if is_flush:
-        for s, cnt in sc.items():
-            if cnt >= 5:
-                suited = [c for c in cards5 if c.suit == s]
-                su = _values(suited, unique=True)
-                if _is_straight_from_values(su):
-                    return "straight_flush"
-
-    counts = sorted(rc.values(), reverse=True)  # 例: [3,1,1] / [2,2,1] など
-    if counts[0] == 4:
-        return "quads"
-    if counts[0] == 3 and counts[1] == 2:
-        return "full_house"
-    if is_flush:
-        return "flush"
-    if is_straight:
-        return "straight"
-    if counts[0] == 3:
-        return "set"
-    if counts[0] == 2 and counts[1] == 2:
-        return "two_pair"
-    if counts[0] == 2:
-        return "pair"
-    return "high_card"
-
-def detect_made_hand(hole_cards, board_cards):
-    """(6 or 7) 枚 → ベスト5 → 厳密分類"""
-    seven = hole_cards + board_cards
-    best5 = best5_from_seven(seven)
-    return [classify5(best5)]
-
-def count_holecards_in_made_hand(hole_cards, board_cards, hand_name):
-    """
-    完成役にホールカードが何枚“ベスト5内で”関与しているか
-    ※ 役名で分岐せず、ベスト5に入っているHC枚数を採用（最大2）
-    """
-    seven = hole_cards + board_cards
-    best5_set = set(best5_from_seven(seven))
-    return min(sum(1 for c in hole_cards if c in best5_set), 2)
+    return cards.live_cards(board4 + hole_cards)
 
 
 # =============================
@@ -135,9 +50,15 @@ def is_overcard_river(hole_cards, river):
 # =============================
 # 勝率（相手ハンド全列挙）
 # =============================
-def enumerate_vs_all(my_hand, board):
-    used = {str(c) for c in my_hand + board}
-    remaining = [c for c in eval7.Deck() if str(c) not in used]
+def enumerate_vs_all(my_hand, board, engine="eval7"):
+    """
+    相手ハンドを全列挙して勝率を返す。
+    engine="numpy" のときは batch_eval による一括評価を使う。
+    """
+    if engine == "numpy":
+        return _enumerate_vs_all_numpy(my_hand, board)
+
+    remaining = cards.live_cards(my_hand + board)
     my_score = eval7.evaluate(my_hand + board)
     wins = ties = total = 0
 
@@ -151,12 +72,31 @@ def enumerate_vs_all(my_hand, board):
 
     return (wins + ties / 2) / total * 100
 
+def _enumerate_vs_all_numpy(my_hand, board):
+    remaining = batch_eval.live_codes(my_hand + board)
+    board_codes = batch_eval.cards_to_codes(board)
+    my_score = batch_eval.evaluate_batch(batch_eval.cards_to_codes(my_hand + board))[0]
+
+    i, j = np.triu_indices(len(remaining), 1)
+    opp = np.column_stack([remaining[i], remaining[j],
+                           np.broadcast_to(board_codes, (len(i), len(board_codes)))])
+    opp_scores = batch_eval.evaluate_batch(opp)
+    wins, ties = batch_eval.outcome_counts(my_score, opp_scores)
+    return (wins + ties / 2) / len(i) * 100
+
 
 # =============================
 # Main（フロップ3枚 or フロップ＋固定ターン4枚 両対応）
 # =============================
 def simulate_shift_river_multiple_turns(hand_str, flop_cards_str, static_turn_winrate,
-                                        turn_count=1, trials_per_river=1000):
+                                        turn_count=1, trials_per_river=1000, engine="eval7", tree=None,
+                                        opponents=1, crn_seed=None):
+    """
+    リバー全カードの勝率変動。相手1人は全列挙（またはツリー）で厳密に、
+    相手複数人（opponents >= 2）は multiway で trials_per_river 回標本化する。
+    crn_seed を指定すると、標本化は全リバー（と同じフロップの別ターン・別ハンド）で
+    共通の標本（crn.shared_draws）を使う。
+    """
 
     # 基準は「ターン勝率」
     try:
@@ -178,34 +118,55 @@ def simulate_shift_river_multiple_turns(hand_str, flop_cards_str, static_turn_wi
     else:
         raise ValueError("flop_cards_str は 3 枚（フロップ）または 4 枚（フロップ＋固定ターン）にしてください。")
 
+    shared = crn.shared_draws(flop, trials_per_river, crn_seed) if crn_seed is not None and opponents > 1 else None
     all_rows = []
 
     for turn in turns:
         board4 = flop + [turn]
 
         # ターン時点の役名とボード特徴（newmade_* 比較に使用）
-        before = detect_made_hand(hole, board4)
+        before, _ = classify_made_hand(hole, board4)
         feats_before = classify_flop_turn_pattern(flop, turn)
 
         rivers = generate_rivers(board4, hole)
+        # リバーごとの新しいボード特徴（ターン時点の状態から一括で差分計算）
+        new_feats_by_river = board_patterns.new_features_bulk(
+            board_patterns.texture_state(board4), rivers, feats_before)
 
-        for river in rivers:
+        for river, new_feats in zip(rivers, new_feats_by_river):
             full_board = board4 + [river]
 
-            wr = enumerate_vs_all(hole, full_board)  # 全列挙
+            ci = 0.0  # 相手ハンド全列挙なので誤差なし
+            if shared is not None:
+                # 標本はフロップごとに違うので、フロップ（cards.mask）も統計量のキーに入れる
+                stats = result_cache.refined_stats(
+                    "river", hole, full_board, ("crn", crn_seed, cards.mask(flop), opponents),
+                    lambda s, rng: crn.equity_stats(hole, full_board, shared, opponents, trials_per_river, stats=s),
+                    trials_per_river, new_stats=mc_stats.ShareStats, canonical=False)
+                wr, ci = stats.equity, stats.ci95
+            elif opponents > 1:
+                # 十分統計量を保存し、試行回数を増やした再実行では足りない分だけ追加する
+                stats = result_cache.refined_stats(
+                    "river", hole, full_board, ("multiway", opponents),
+                    lambda s, rng: multiway.equity_stats(hole, full_board, opponents, trials_per_river,
+                                                         rng=batch_eval.make_rng(rng), stats=s),
+                    trials_per_river, batch_size=5000, new_stats=mc_stats.ShareStats)
+                wr, ci = stats.equity, stats.ci95
+            elif tree is not None:
+                wr = tree.river_equity(turn, river)  # ランアウトツリー（全列挙済み）
+            else:
+                wr = iso_cache.memoized(  # 全列挙（スート同型はメモから）
+                    "river", hole, full_board, lambda: enumerate_vs_all(hole, full_board, engine=engine))
             shift = round(wr - static_turn_winrate, 2)
 
-            after = detect_made_hand(hole, full_board)
-            hc = count_holecards_in_made_hand(hole, full_board, after[0])
+            after, hc = classify_made_hand(hole, full_board)
 
             features = []
             # 役の進化（high_card 以外）
-            if after[0] != before[0] and after[0] != "high_card":
-                features.append(f"newmade_{after[0]}_hc{hc}")
+            if after != before and after != "high_card":
+                features.append(f"newmade_{after}_hc{hc}")
             else:
                 # ボード要因（board_patterns.py の仕様に準拠：ボードのみ）
-                feats_after = classify_flop_turn_pattern(flop, turn, river)
-                new_feats = [f for f in feats_after if f not in feats_before]
                 features.extend([f"newmade_{f}" for f in new_feats])
                 if is_overcard_river(hole, river):
                     features.append("newmade_overcard")
@@ -215,8 +176,9 @@ def simulate_shift_river_multiple_turns(hand_str, flop_cards_str, static_turn_wi
                 "river_card": str(river),
                 "winrate": round(wr, 2),
                 "shift": shift,
+                "ci": round(ci, 2),
                 "features": features,
-                "hand_rank": after[0],
+                "hand_rank": after,
                 "hole_involved": hc
             })
 
@@ -229,8 +191,28 @@ def simulate_shift_river_multiple_turns(hand_str, flop_cards_str, static_turn_wi
 
 
 def run_shift_river(hand_str, flop_cards_str, static_turn_winrate,
-                    turn_count=1, trials_per_river=1000):
-    return simulate_shift_river_multiple_turns(
+                    turn_count=1, trials_per_river=1000, engine="eval7", tree=None, opponents=1, crn_seed=None):
+    """
+    simulate_shift_river_multiple_turns を実行する。
+    ターン固定（ボード4枚）のときは result_cache の永続キャッシュを使う
+    （相手1人は全列挙なのでエンジン・試行回数によらず同じ値）。
+    """
+    compute = lambda: simulate_shift_river_multiple_turns(
         hand_str, flop_cards_str, static_turn_winrate,
-        turn_count, trials_per_river
-    )
+        turn_count, trials_per_river, engine, tree, opponents, crn_seed
+    )[0]
+    board = [ensure_card(c) for c in flop_cards_str]
+    if opponents > 1:
+        params = ("multiway", opponents, trials_per_river, static_turn_winrate)
+        if crn_seed is not None:
+            # 共通乱数の標本は実際のフロップで決まるので、スート同型のボードとは行を共有しない
+            params = ("crn", crn_seed, cards.mask(board[:3])) + params
+    else:
+        params = ("exact", static_turn_winrate)
+    if len(board) != 4:
+        rows = compute()  # ターンをランダムに選ぶのでキャッシュしない
+    else:
+        rows = result_cache.cached("river", hand_str, hand_str_to_cards(hand_str), board,
+                                   params, compute,
+                                   card_fields=("turn_card", "river_card"))
+    return rows, rows[:10], rows[-10:]
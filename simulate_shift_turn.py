@@ -1,16 +1,19 @@
 import eval7
+import numpy as np
 import pandas as pd
-import random
+import board_patterns
 from board_patterns import classify_flop_turn_pattern
 from hand_utils import hand_str_to_cards
-
-def convert_rank_to_value(rank):
-    rank_dict = {'2': 2, '3': 3, '4': 4, '5': 5, '6': 6,
-                 '7': 7, '8': 8, '9': 9, 'T': 10,
-                 'J': 11, 'Q': 12, 'K': 13, 'A': 14}
-    if isinstance(rank, int):
-        return rank
-    return rank_dict[str(rank)]
+import batch_eval
+import cards
+import crn
+import iso_cache
+import mc_stats
+import multiway
+import result_cache
+from deck_sampler import DeckSampler
+from made_hand import classify_made_hand
+from cards import rank_value as convert_rank_to_value
 
 def is_overcard_turn(hole_cards, turn_card):
     if hole_cards[0].rank != hole_cards[1].rank:
@@ -20,212 +23,201 @@ def is_overcard_turn(hole_cards, turn_card):
     return turn_rank > pair_rank
 
 def generate_turns(flop, hole_cards):
-    used = set(flop + hole_cards)
-    deck = list(eval7.Deck())
-    return [card for card in deck if card not in used]
+    return cards.live_cards(flop + hole_cards)
+
+def simulate_vs_random(my_hand, flop_cards, turn_cards, iterations=1000, engine="eval7", tolerance=None):
+    """
+    tolerance（標準誤差, %ポイント）を指定すると iterations を上限にバッチ単位で打ち切る。
+    """
+    return simulate_vs_random_stats(my_hand, flop_cards, turn_cards, iterations, engine, tolerance).equity
+
+def simulate_vs_random_stats(my_hand, flop_cards, turn_cards, iterations=1000, engine="eval7", tolerance=None,
+                             stats=None, rng=None):
+    """
+    simulate_vs_random と同じ計算を mc_stats.EquityStats で返す（stats を渡すとその続きから）。
+    rng（random.Random）を渡すとその乱数で標本を引く。
+    """
+    if engine == "numpy":
+        np_rng = batch_eval.make_rng(rng)
+        sample = lambda n: _sample_vs_random_numpy(my_hand, flop_cards, turn_cards, n, np_rng)
+    else:
+        sample = lambda n: _sample_vs_random(my_hand, flop_cards, turn_cards, n, rng)
+    return mc_stats.run_adaptive(sample, iterations, tolerance, stats=stats)
 
-def simulate_vs_random(my_hand, flop_cards, turn_cards, iterations=1000):
-    used_cards = set(my_hand + flop_cards + turn_cards)
-    wins = ties = 0
+def _sample_vs_random(my_hand, flop_cards, turn_cards, iterations, rng=None):
     full_board_base = flop_cards + turn_cards
+    sampler = DeckSampler(my_hand + full_board_base, rng)
+    wins = ties = 0
+    k = 5 - len(full_board_base)
+
+    # 7枚の入れ物を1回だけ作り、相手2枚とランアウト部分だけ書き換える
+    my7 = my_hand + full_board_base + [None] * k
+    opp7 = [None, None] + full_board_base + [None] * k
+    base = 2 + len(full_board_base)
 
     for _ in range(iterations):
-        deck = [card for card in eval7.Deck() if card not in used_cards]
-        random.shuffle(deck)
-        opp_hand = deck[:2]
-        remaining_board = deck[2: 2 + (5 - len(full_board_base))]
-        full_board = full_board_base + remaining_board
+        buf = sampler.draw(2 + k)
+        opp7[0] = buf[0]
+        opp7[1] = buf[1]
+        for i in range(k):
+            my7[base + i] = opp7[base + i] = buf[2 + i]
 
-        my_score = eval7.evaluate(my_hand + full_board)
-        opp_score = eval7.evaluate(opp_hand + full_board)
+        my_score = eval7.evaluate(my7)
+        opp_score = eval7.evaluate(opp7)
 
         if my_score > opp_score:
             wins += 1
         elif my_score == opp_score:
             ties += 1
 
-    return (wins + ties / 2) / iterations * 100
+    return wins, ties
+
+def _sample_vs_random_numpy(my_hand, flop_cards, turn_cards, iterations, rng=None):
+    board = flop_cards + turn_cards
+    drawn = DeckSampler(my_hand + board).draw_batch(iterations, 2 + (5 - len(board)), rng)
+    full_board = np.column_stack(
+        [np.broadcast_to(batch_eval.cards_to_codes(board), (iterations, len(board))), drawn[:, 2:]])
+    my_scores = batch_eval.evaluate_batch(np.column_stack(
+        [np.broadcast_to(batch_eval.cards_to_codes(my_hand), (iterations, 2)), full_board]))
+    opp_scores = batch_eval.evaluate_batch(np.column_stack([drawn[:, :2], full_board]))
+    return batch_eval.outcome_counts(my_scores, opp_scores)
+
+def enumerate_turn_equity(my_hand, board4):
+    """
+    ターン時点（ボード4枚）の勝率を「リバー × 相手ハンド」全列挙で厳密に求める。
+    相手の7枚は ボード4枚 + 残りデッキ3枚（相手2枚+リバー）で決まるため、
+    3枚組ごとに1回だけ評価し、どれをリバーとみなすかの3通りで勝敗を数える。
+    """
+    remaining = batch_eval.live_codes(my_hand + board4)
+    board_codes = batch_eval.cards_to_codes(board4)
+    hero_codes = batch_eval.cards_to_codes(my_hand)
+
+    # リバーごとのヒーロースコア
+    n = len(remaining)
+    hero_scores = batch_eval.evaluate_batch(np.column_stack([
+        np.broadcast_to(np.concatenate([hero_codes, board_codes]), (n, 6)), remaining]))
+
+    # 3枚組ごとの相手スコア
+    triples = batch_eval.combination_indices(n, 3)
+    opp_scores = batch_eval.evaluate_batch(np.column_stack([
+        np.broadcast_to(board_codes, (len(triples), 4)), remaining[triples]]))
 
-# ===== ここから：役判定のみ刷新 =====
-def _has_straight_from_values(values_iterable):
-    """値の集合（int）からストレートの有無を厳密判定。Aは14扱い、A-5ストレートにも対応。"""
-    u = sorted(set(int(v) for v in values_iterable))
-    if not u:
-        return False
-    # A(14) を 1 としても扱う（5ハイストレート）
-    if 14 in u:
-        u_with_wheel = u + [1]
+    wins = ties = 0
+    for col in range(3):
+        w, t = batch_eval.outcome_counts(hero_scores[triples[:, col]], opp_scores)
+        wins += w
+        ties += t
+    total = len(triples) * 3
+    return (wins + ties / 2) / total * 100
+
+def turn_features(hole_cards, board4, turn_list, made_before, new_feats):
+    """
+    ターン行の特徴ラベルと役名 (features, made_after) を返す。
+    new_feats はターンで新しく付いたボード特徴（board_patterns.new_features_bulk）。
+    """
+    features = []
+    made_after, hc_count = classify_made_hand(hole_cards, board4)
+
+    # --- 役が進化した場合 ---
+    if made_after != made_before and made_after != "high_card":
+        features.append(f"newmade_{made_after}_hc{hc_count}")
+
+    # --- 役が進化しなかった場合：ボード特徴を比較 ---
     else:
-        u_with_wheel = u[:]
-
-    # 連続5個をチェック（昇順）
-    streak = 1
-    for i in range(1, len(u_with_wheel)):
-        if u_with_wheel[i] == u_with_wheel[i-1] + 1:
-            streak += 1
-            if streak >= 5:
-                return True
-        elif u_with_wheel[i] == u_with_wheel[i-1]:
-            continue
-        else:
-            streak = 1
-    return False
-
-def detect_made_hand(hole_cards, board_cards):
-    """7枚（2+5）から実際の役を厳密に判定して、文字列を1要素リストで返す。"""
-    all_cards = hole_cards + board_cards
-
-    # ランク/スーツの集計
-    ranks = [c.rank for c in all_cards]
-    suits = [c.suit for c in all_cards]
-    rank_counts = {}
-    for r in ranks:
-        rank_counts[r] = rank_counts.get(r, 0) + 1
-    suit_counts = {}
-    for s in suits:
-        suit_counts[s] = suit_counts.get(s, 0) + 1
-
-    # 値（A=14）一覧
-    all_values = [convert_rank_to_value(c.rank) for c in all_cards]
-
-    # --- ストレートフラッシュ ---
-    for s, cnt in suit_counts.items():
-        if cnt >= 5:
-            suited_vals = [convert_rank_to_value(c.rank) for c in all_cards if c.suit == s]
-            if _has_straight_from_values(suited_vals):
-                return ["straight_flush"]
-
-    # --- フォーカード ---
-    if any(c == 4 for c in rank_counts.values()):
-        return ["quads"]
-
-    # --- フルハウス（トリップス2種 or トリップス+別ランクのペア） ---
-    trips = [r for r, c in rank_counts.items() if c >= 3]
-    pairs = [r for r, c in rank_counts.items() if c >= 2]
-    if trips and (len(trips) >= 2 or any(r != trips[0] for r in pairs)):
-        return ["full_house"]
-
-    # --- フラッシュ ---
-    if any(cnt >= 5 for cnt in suit_counts.values()):
-        return ["flush"]
-
-    # --- ストレート ---
-    if _has_straight_from_values(all_values):
-        return ["straight"]
-
-    # --- セット ---
-    if any(c >= 3 for c in rank_counts.values()):
-        return ["set"]
-
-    # --- ツーペア（ペア以上のランクが2種類以上。上位役は既に除外済み） ---
-    if len([r for r, c in rank_counts.items() if c >= 2]) >= 2:
-        return ["two_pair"]
-
-    # --- ペア ---
-    if any(c >= 2 for c in rank_counts.values()):
-        return ["pair"]
-
-    return ["high_card"]
-# ===== ここまで：役判定のみ刷新 =====
-
-# （is_straight は使わなくなりましたが、他所で参照していないため残しても動作に影響はありません）
-def is_straight(values):
-    # 互換のため残置（未使用）。厳密判定は detect_made_hand 内の _has_straight_from_values を使用。
-    return _has_straight_from_values(values)
-
-# --- 役に何枚ホールカードが絡んでいるかを判定（そのまま） ---
-def count_holecard_involvement(hole_cards, hand_rank, board_cards):
-    hc_vals = [convert_rank_to_value(c.rank) for c in hole_cards]
-    all_vals = [convert_rank_to_value(c.rank) for c in (hole_cards + board_cards)]
-    rank_counts_vals = {}
-    for v in all_vals:
-        rank_counts_vals[v] = rank_counts_vals.get(v, 0) + 1
-
-    if hand_rank == "pair":
-        return sum(rank_counts_vals.get(v, 0) >= 2 for v in hc_vals)
-    if hand_rank == "two_pair":
-        return sum(rank_counts_vals.get(v, 0) >= 2 for v in hc_vals)
-    if hand_rank == "set":
-        return sum(rank_counts_vals.get(v, 0) >= 3 for v in hc_vals)
-    if hand_rank == "quads":
-        return sum(rank_counts_vals.get(v, 0) == 4 for v in hc_vals)
-    if hand_rank == "full_house":
-        return sum(rank_counts_vals.get(v, 0) >= 2 for v in hc_vals)
-    if hand_rank in ["straight", "straight_flush"]:
-        uniq = sorted(set(all_vals))
-        windows = []
-        # Aを1として扱う
-        if 14 in uniq:
-            uniq_with_wheel = sorted(set(uniq + [1]))
-        else:
-            uniq_with_wheel = uniq[:]
-        # 連続窓を列挙して HC 関与数を見る
-        for i in range(len(uniq_with_wheel) - 4):
-            if uniq_with_wheel[i+4] - uniq_with_wheel[i] == 4 and len(set(uniq_with_wheel[i:i+5])) == 5:
-                windows.append(set(uniq_with_wheel[i:i+5]))
-        if windows:
-            return max(sum(v in w for v in hc_vals) for w in windows)
-        return 0
-    if hand_rank in ["flush", "straight_flush"]:
-        suits = [c.suit for c in (hole_cards + board_cards)]
-        for s in set(suits):
-            suited = [convert_rank_to_value(c.rank) for c in (hole_cards + board_cards) if c.suit == s]
-            if len(suited) >= 5:
-                return sum(c.suit == s for c in hole_cards)
-    return 0
-
-def simulate_shift_turn_exhaustive(hand_str, flop_cards, static_winrate, trials_per_turn=1000):
+        # --- newmade_形式で特徴を記録（役が進化しなかった時のみ） ---
+        if new_feats:
+            for f in new_feats:
+                features.append(f"newmade_{f}")
+
+        # --- Overcard 判定 ---
+        for t in turn_list:
+            if is_overcard_turn(hole_cards, t):
+                features.append("newmade_overcard")
+                break
+    return features, made_after
+
+def simulate_shift_turn_exhaustive(hand_str, flop_cards, static_winrate, trials_per_turn=1000, engine="eval7",
+                                   exact=False, tree=None, tolerance=None, opponents=1, crn_seed=None):
+    """
+    全ターンカードについて勝率変動を求める。
+    exact=True のときはモンテカルロの代わりに enumerate_turn_equity で厳密列挙する（trials_per_turn は無視）。
+    tree（runout_tree.RunoutTree）を渡した場合はツリーのターン勝率をそのまま使う。
+    tolerance（標準誤差, %ポイント）を指定するとモンテカルロは trials_per_turn を上限に早期終了する。
+    各行の 'ci' は勝率（=シフト）の 95% 信頼区間の半幅（厳密列挙では 0）。
+    opponents（相手人数）が 2 以上なら multiway で trials_per_turn 回標本化する（exact / tree は使わない）。
+    crn_seed を指定すると、モンテカルロは全ターンで共通の標本（crn.shared_draws。フロップと crn_seed で
+    決まるので同じフロップの別ハンドとも共通）を使う。ターン間のシフトの差・順位が安定する。
+    モンテカルロの各ターンの十分統計量は result_cache.refined_stats に保存し、試行回数を増やした
+    再実行では足りない分だけ追加する（目標精度を満たしたターンは追加しない）。
+    """
     hole_cards = hand_str_to_cards(hand_str)
-    flop_cards = [eval7.Card(str(c)) for c in flop_cards]
+    flop_cards = cards.to_cards(flop_cards)
     turn_candidates = generate_turns(flop_cards, hole_cards)
 
     # フロップ時点の役・特徴を取得
-    made_before = detect_made_hand(hole_cards, flop_cards)
+    made_before, _ = classify_made_hand(hole_cards, flop_cards)
     feats_before = classify_flop_turn_pattern(flop_cards, turn=None)
+    # ターンごとの新しいボード特徴は一括で求めておく（複数枚ターンは最後の 1 枚で判定）
+    flop_texture = board_patterns.texture_state(flop_cards)
+    new_feats_by_turn = board_patterns.new_features_bulk(
+        flop_texture, [t[-1] if isinstance(t, list) else t for t in turn_candidates], feats_before)
+    # 共通乱数はモンテカルロで計算するときだけ（厳密列挙・ツリーは誤差なし）
+    shared = None
+    if crn_seed is not None and (opponents > 1 or (tree is None and not exact)):
+        shared = crn.shared_draws(flop_cards, trials_per_turn, crn_seed)
 
     results = []
-    for turn in turn_candidates:
+    for turn, new_feats in zip(turn_candidates, new_feats_by_turn):
         # --- ターンカードをリスト化（複数対応）---
         if isinstance(turn, list):
-            turn_list = [eval7.Card(str(t)) for t in turn]
+            turn_list = cards.to_cards(turn)
         else:
             turn_list = [turn]
 
         board4 = flop_cards + turn_list
-        winrate = simulate_vs_random(hole_cards, flop_cards, turn_list, trials_per_turn)
-        shift = winrate - static_winrate
-
-        features = []
-        made_after = detect_made_hand(hole_cards, board4)
-
-        # --- 役が進化した場合 ---
-        if made_after[0] != made_before[0] and made_after[0] != "high_card":
-            hc_count = count_holecard_involvement(hole_cards, made_after[0], board4)
-            features.append(f"newmade_{made_after[0]}_hc{hc_count}")
-
-        # --- 役が進化しなかった場合：ボード特徴を比較 ---
+        ci = 0.0
+        if shared is not None:
+            # スート同型でまとめない（同型局面の値は別の標本なので共通乱数にならない）。
+            # 標本はフロップごとに違うので、同じ 4 枚でもフロップ（cards.mask）が違えば別の統計量
+            stats = result_cache.refined_stats(
+                "turn", hole_cards, board4, ("crn", crn_seed, cards.mask(flop_cards), opponents),
+                lambda s, rng: crn.equity_stats(hole_cards, board4, shared, opponents, trials_per_turn, tolerance,
+                                                stats=s),
+                trials_per_turn, tolerance, new_stats=mc_stats.ShareStats, canonical=False)
+            winrate, ci = stats.equity, stats.ci95
+        elif opponents > 1:
+            stats = result_cache.refined_stats(
+                "turn", hole_cards, board4, ("multiway", opponents),
+                lambda s, rng: multiway.equity_stats(hole_cards, board4, opponents, trials_per_turn, tolerance,
+                                                     rng=batch_eval.make_rng(rng), stats=s),
+                trials_per_turn, tolerance, batch_size=5000, new_stats=mc_stats.ShareStats)
+            winrate, ci = stats.equity, stats.ci95
+        elif tree is not None:
+            winrate = tree.turn_equity(turn_list[-1])
+        elif exact:
+            winrate = iso_cache.memoized(
+                "turn", hole_cards, board4,
+                lambda: enumerate_turn_equity(hole_cards, board4), params=("exact",))
         else:
-            feats_after = classify_flop_turn_pattern(flop_cards, turn_list[-1])
-            new_feats = [f for f in feats_after if f not in feats_before]
-
-            # --- newmade_形式で特徴を記録（役が進化しなかった時のみ） ---
-            if new_feats:
-                for f in new_feats:
-                    features.append(f"newmade_{f}")
+            # eval7 / numpy は同じ分布からの標本なので、統計量はエンジンによらず共通
+            stats = result_cache.refined_stats(
+                "turn", hole_cards, board4, ("vs_random",),
+                lambda s, rng: simulate_vs_random_stats(hole_cards, flop_cards, turn_list, trials_per_turn,
+                                                        engine=engine, tolerance=tolerance, stats=s, rng=rng),
+                trials_per_turn, tolerance)
+            winrate, ci = stats.equity, stats.ci95
+        shift = winrate - static_winrate
 
-            # --- Overcard 判定 ---
-            for t in turn_list:
-                if is_overcard_turn(hole_cards, t):
-                    features.append("newmade_overcard")
-                    break
+        features, made_after = turn_features(hole_cards, board4, turn_list, made_before, new_feats)
 
         # --- 結果を記録 ---
         results.append({
             'turn_card': ','.join([str(t) for t in turn_list]),
             'winrate': round(winrate, 2),
             'shift': round(shift, 2),
+            'ci': round(ci, 2),
             'features': features if features else ["none"],
-            'hand_rank': made_after[0] if made_after else '―'
+            'hand_rank': made_after
         })
 
     # --- 結果をソート・保存 ---
@@ -238,5 +230,23 @@ def simulate_shift_turn_exhaustive(hand_str, flop_cards, static_winrate, trials_
     bottom10 = results_sorted[-10:]
     return results_sorted, top10, bottom10
 
-def run_shift_turn(hand_str, flop_cards, static_winrate, trials_per_turn=1000):
-    return simulate_shift_turn_exhaustive(hand_str, flop_cards, static_winrate, trials_per_turn)
+def run_shift_turn(hand_str, flop_cards, static_winrate, trials_per_turn=1000, engine="eval7", exact=False,
+                   tree=None, tolerance=None, opponents=1, crn_seed=None):
+    """simulate_shift_turn_exhaustive を result_cache の永続キャッシュ経由で実行する"""
+    flop_cards = cards.to_cards(flop_cards)
+    if opponents > 1:
+        params = ("multiway", opponents, trials_per_turn, tolerance, static_winrate)
+    elif tree is not None or exact:
+        params = ("exact", static_winrate)  # ツリーと厳密列挙は同じ値
+        crn_seed = None
+    else:
+        params = (engine, trials_per_turn, tolerance, static_winrate)
+    if crn_seed is not None:
+        # 共通乱数の標本は実際のフロップで決まるので、スート同型のフロップとは行を共有しない
+        params = ("crn", crn_seed, cards.mask(flop_cards)) + params
+    rows = result_cache.cached(
+        "turn", hand_str, hand_str_to_cards(hand_str), flop_cards, params,
+        lambda: simulate_shift_turn_exhaustive(hand_str, flop_cards, static_winrate, trials_per_turn, engine,
+                                               exact, tree, tolerance, opponents, crn_seed)[0],
+        card_fields=("turn_card",))
+    return rows, rows[:10], rows[-10:]
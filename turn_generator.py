@@ -1,4 +1,5 @@
-import eval7
+import cards
+from cards import rank_value as convert_rank_to_value
 
 RANKS = '23456789TJQKA'
 SUITS = 'shdc'
@@ -8,14 +9,10 @@ def generate_turn_cards(flop, used_cards=None):
     指定されたフロップに対して使用可能なターンカード（1枚ずつ）を全て返す。
     used_cards: フロップ＋自分のハンドなど（eval7.Card型）
     """
-    if used_cards is None:
-        used_cards = set(flop)
-    else:
-        used_cards = set(flop) | set(used_cards)
-
-    full_deck = [eval7.Card(r + s) for r in RANKS for s in SUITS]
-    turn_cards = [card for card in full_deck if card not in used_cards]
-    return turn_cards
+    dead = cards.mask(flop)
+    if used_cards is not None:
+        dead |= cards.mask(used_cards)
+    return cards.live_cards(dead)
 
 # 関数名の互換性維持のためのエイリアス
 generate_turns_for_flop = generate_turn_cards
@@ -57,15 +54,3 @@ def classify_turn_card(flop, turn):
         features.append("overcard")
 
     return features
-
-def convert_rank_to_value(rank_char) -> int:
-    """
-    ランク文字を数値に変換（例: A=14, K=13）。
-    数字や int で渡された場合も安全に処理。
-    """
-    rank_map = {
-        '2': 2, '3': 3, '4': 4, '5': 5, '6': 6,
-        '7': 7, '8': 8, '9': 9, 'T': 10,
-        'J': 11, 'Q': 12, 'K': 13, 'A': 14
-    }
-    return rank_map.get(str(rank_char).upper(), 0)